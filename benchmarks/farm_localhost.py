@@ -0,0 +1,257 @@
+################################################################################
+## Render Farm on Localhost
+##
+## Runs the farm coordinator with render agents on this machine, every agent
+## renders with the stub Blender (`benchmarks/stub_blender.py`), so neither
+## Blender nor other machines are needed. Checks that every frame was rendered
+## exactly once and prints how frames were shared between agent devices:
+##   python benchmarks/farm_localhost.py [--agents 2] [--devices CPU,CPU] [--frames 60]
+##
+## Set `STUB_FRAME_TIME` and `STUB_LOAD_TIME` to change the stub render times.
+
+import os
+import sys
+import time
+import types
+import shutil
+import secrets
+import argparse
+import tempfile
+import subprocess
+
+from pathlib import Path
+from threading import Thread, Lock
+from collections import Counter
+
+ROOT = Path(__file__).resolve().parents[1]
+STUB_BLENDER_PY = Path(__file__).resolve().parent / 'stub_blender.py'
+
+sys.path.insert(0, str(ROOT))
+
+# The coordinator logs through the window module, which builds the interface
+# on import. A plain module with `log` keeps this script headless.
+import kqueue
+
+def log(*args, **kwargs):
+    print(" ".join(str(a) for a in args), flush=True)
+
+kqueue.main = sys.modules['kqueue.main'] = types.ModuleType('kqueue.main')
+kqueue.main.log = log
+
+from kqueue.plan import ProjectPlan
+from kqueue.scheduler import FrameScheduler
+from kqueue.farm.coordinator import FarmCoordinator
+from kqueue import store
+
+
+class StubProject():
+    """
+    Queue entry with the settings a plan needs.
+    """
+
+    fingerprint = None
+    dependency_states = {}
+
+    def __init__(self, file, render_filepath):
+        self.file = file
+        self.settings = {
+            'scene' : "Scene",
+            'camera' : "Camera",
+            'render_filepath' : render_filepath,
+            'file_format' : "PNG",
+            'samples' : 4,
+        }
+
+    def __getattr__(self, name):
+
+        if not name.startswith('get_'):
+            raise AttributeError(name)
+
+        return lambda: self.settings.get(name[4:])
+
+
+class StubPreset():
+    """
+    Render status the remote instances check.
+    """
+
+    def __init__(self):
+        self.status = 'RENDERING'
+        self.preview_render = False
+        self.failed_frames = {}
+
+    def is_status(self, *statuses):
+        return self.status in statuses
+
+
+class CountingScheduler(FrameScheduler):
+    """
+    Records which instance rendered each frame.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rendered = []
+        self.rendered_lock = Lock()
+
+    def on_frame(self, instance, frame, seconds=None):
+        chunk = self.running.get(instance)
+
+        with self.rendered_lock:
+            self.rendered.append((instance.get_name(), chunk.project.file if chunk else None, frame))
+
+        super().on_frame(instance, frame, seconds)
+
+
+class LocalFarm():
+    """
+    Starts a worker for every instance, also for agents that join late.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.workers = []
+
+    def add_instance(self, instance):
+        self.scheduler.add_instance(instance)
+
+        t = Thread(target=self.work, args=(instance,))
+        self.workers.append(t)
+        t.start()
+
+    def work(self, instance):
+
+        while True:
+            chunk = self.scheduler.next_chunk(instance)
+
+            if chunk is None:
+                break
+
+            project, frames = chunk
+            instance.render(project, frames, self.scheduler)
+
+    def join(self):
+
+        while any(t.is_alive() for t in self.workers):
+
+            for t in list(self.workers):
+                t.join()
+
+
+def write_launcher(folder):
+    """
+    Executable that starts the stub Blender with this Python.
+    """
+
+    if os.name == 'nt':
+        file = folder / 'blender.cmd'
+        file.write_text(f'@"{sys.executable}" "{STUB_BLENDER_PY}" %*\n')
+
+    else:
+        file = folder / 'blender'
+        file.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_BLENDER_PY}" "$@"\n')
+        file.chmod(0o755)
+
+    return file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the stub Blender with agents on localhost.")
+    parser.add_argument('--agents', type=int, default=2)
+    parser.add_argument('--devices', default="CPU,CPU", help="device pool of every agent")
+    parser.add_argument('--projects', type=int, default=2)
+    parser.add_argument('--frames', type=int, default=60, help="frames per project")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for agents")
+
+    args = parser.parse_args(argv)
+
+    folder = Path(tempfile.mkdtemp(prefix="kqueue_farm_"))
+    blender_exe = write_launcher(folder)
+    token = secrets.token_hex(16)
+
+    store.working_dir = str(folder)
+    store.preset = preset = StubPreset()
+
+    farm = FarmCoordinator(host="127.0.0.1", port=0, token=token)
+    farm.start()
+
+    agents = []
+
+    for i in range(args.agents):
+        agents.append(subprocess.Popen([
+            sys.executable, '-m', 'kqueue.farm.agent',
+            '--host', "127.0.0.1",
+            '--port', str(farm.port),
+            '--token', token,
+            '--blender', str(blender_exe),
+            '--devices', args.devices,
+            '--name', f'agent-{i + 1}',
+            '--temp', str(folder / f'agent-{i + 1}'),
+        ], cwd=str(ROOT), stdout=subprocess.DEVNULL))
+
+    try:
+        deadline = time.time() + args.timeout
+
+        while len(farm.get_agents()) < args.agents:
+
+            if time.time() > deadline:
+                log(f'Only {len(farm.get_agents())} of {args.agents} agents connected.')
+                shutil.rmtree(folder, ignore_errors=True)
+                return 1
+
+            time.sleep(0.1)
+
+        jobs = []
+
+        for i in range(args.projects):
+            project = StubProject(str(folder / f'shot_{i + 1}.blend'), str(folder / 'output' / f'shot_{i + 1}_####'))
+            plan = ProjectPlan(project, range(1, args.frames + 1), False)
+            jobs.append((plan, list(plan.frames)))
+
+        scheduler = CountingScheduler(jobs, [], should_stop=lambda: preset.is_status('RENDERING_STOPPING'))
+        local_farm = LocalFarm(scheduler)
+
+        start_time = time.time()
+
+        for instance in farm.attach(local_farm):
+            local_farm.add_instance(instance)
+
+        local_farm.join()
+        farm.detach()
+
+        render_time = time.time() - start_time
+
+    finally:
+        farm.stop()
+
+        for agent in agents:
+            agent.terminate()
+
+        for agent in agents:
+            agent.wait()
+
+    expected = { (plan.file, frame) for plan, frames in jobs for frame in frames }
+    rendered = Counter((file, frame) for _, file, frame in scheduler.rendered)
+    instances = Counter(name for name, _, _ in scheduler.rendered)
+
+    missing = { (plan.file, frame) for plan, frames in jobs for frame in frames if not plan.get_output(frame).exists() }
+    missing |= expected - set(rendered)
+    twice = [ key for key, count in rendered.items() if count > 1 ]
+
+    log(f'Rendered {len(rendered)} of {len(expected)} frames in {render_time:.2f}s')
+
+    for name, count in sorted(instances.items()):
+        log(f'  {name}: {count} frames')
+
+    if missing:
+        log(f'Frames not rendered: {len(missing)}')
+
+    if twice:
+        log(f'Frames rendered more than once: {len(twice)}')
+
+    shutil.rmtree(folder, ignore_errors=True)
+
+    return 1 if missing or twice else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+################################################################################
+## Log Parser Benchmark
+##
+## Compares the render listener parser with the per-line `re.search` chain
+## it replaced. Reads a recorded log (kQueue writes Blender output to
+## `log.txt`) or generates one:
+##   python benchmarks/log_parser.py [log.txt]
+
+import sys
+import time
+
+from re import search
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from kqueue.utils.log_parser import parse_line
+
+
+def parse_line_legacy(line):
+    """
+    The listener before the parser: up to six uncompiled searches per line.
+    """
+
+    if search(r'(?:.*)--background ["](.*?.blend)["].*?-f ["](.*?)["]', line):
+        return 'project'
+
+    if search(r'(?:.*)All settings loaded successfully!', line):
+        return 'settings'
+
+    if search(r'(?:.*)Rendered (\d+)/(\d+) Tiles, Sample (\d+)/(\d+)', line):
+        return 'tiles'
+
+    if search(r'(?:.*)Sample (\d+)/(\d+)', line):
+        return 'samples'
+
+    if search(r'(?:.*)Saved: [\'|\"](.*?)[\'|\"]', line):
+        return 'saved'
+
+    if search(r'(?:.*)Rendering single frame \(frame (\d+)\)', line) or search(r'(?:.*)Rendering frame (\d+)', line):
+        return 'frame'
+
+    return None
+
+
+def generate_log(frames=50, samples=256):
+    """
+    Blender 4.x Cycles output of a short animation.
+    """
+
+    lines = [
+        'C:\\Blender>blender --background "D:/Projects/shot_010.blend" --scene "Scene" -E "CYCLES" --python "render_settings.py" -f "1..3"',
+        "Blender 4.2.0 (hash a51f293548ad built 2024-07-16 06:27:02)",
+        "Read blend: \"D:/Projects/shot_010.blend\"",
+        "All settings loaded successfully!",
+    ]
+
+    for frame in range(1, frames + 1):
+        lines.append(f"Fra:{frame} Mem:312.44M (Peak 318.02M) | Time:00:00.41 | Syncing Cube.001")
+        lines.append(f"Fra:{frame} Mem:402.19M (Peak 402.19M) | Time:00:01.07 | Mem:120.50M, Peak:120.50M | Scene, ViewLayer | Updating Device | Writing constant memory")
+        lines.append(f"Fra:{frame} Mem:402.19M (Peak 402.19M) | Time:00:01.12 | Mem:120.50M, Peak:120.50M | Scene, ViewLayer | Loading render kernels (may take a few minutes the first time)")
+
+        for sample in range(1, samples + 1, 4):
+            lines.append(f"Fra:{frame} Mem:402.19M (Peak 402.19M) | Time:00:{sample // 10:02d}.55 | Remaining:00:12.31 | Mem:120.50M, Peak:120.50M | Scene, ViewLayer | Sample {sample}/{samples}")
+
+        lines.append(f"Fra:{frame} Mem:402.19M (Peak 402.19M) | Time:00:31.02 | Mem:120.50M, Peak:120.50M | Scene, ViewLayer | Finished")
+        lines.append(f"Saved: 'D:/Renders/shot_010/{frame:04d}.png'")
+        lines.append(" Time: 00:31.40 (Saving: 00:00.12)")
+        lines.append("")
+
+    lines.append("Blender quit")
+
+    return lines
+
+
+def measure(func, lines, repeat=5):
+    """
+    Best lines per second of a few runs.
+    """
+
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+
+        for line in lines:
+            func(line)
+
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(lines) / best
+
+
+def main(argv):
+
+    if len(argv) > 1:
+        with open(argv[1], 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    else:
+        lines = generate_log()
+
+    # Both parsers must agree before speed matters
+    for line in lines:
+        parsed = parse_line(line)
+        kind = parsed[0] if parsed else None
+
+        if kind != parse_line_legacy(line):
+            print(f'Parsers disagree: {kind} != {parse_line_legacy(line)} | {line}')
+            return 1
+
+    legacy = measure(parse_line_legacy, lines)
+    current = measure(parse_line, lines)
+
+    print(f'Lines: {len(lines)}')
+    print(f'Legacy: {legacy:,.0f} lines/s')
+    print(f'Parser: {current:,.0f} lines/s')
+    print(f'Speedup: {current / legacy:.1f}x')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
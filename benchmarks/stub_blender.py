@@ -0,0 +1,177 @@
+################################################################################
+## Stub Blender
+##
+## Stands in for the Blender executable when the render path is tested without
+## Blender. Runs the real render driver with a minimal `bpy`: opening a file
+## and rendering a frame only sleep, a frame writes an empty output file and
+## calls the render handlers of the settings script, so the driver and the
+## handlers print their `KQUEUE-RENDER` events like in Blender:
+##   python benchmarks/stub_blender.py --background --python kqueue/blender/render_driver.py -- --serve
+##
+## `STUB_LOAD_TIME` and `STUB_FRAME_TIME` set the seconds of a file load and
+## of a frame, `STUB_SAMPLES` the number of sample lines printed per frame.
+
+import os
+import re
+import sys
+import time
+import runpy
+import types
+
+from pathlib import Path
+
+LOAD_TIME = float(os.environ.get('STUB_LOAD_TIME', '0.2'))
+FRAME_TIME = float(os.environ.get('STUB_FRAME_TIME', '0.1'))
+SAMPLES = int(os.environ.get('STUB_SAMPLES', '4'))
+
+
+class Stub():
+    """
+    Takes any attribute, call or item, so settings scripts run unchanged.
+    """
+
+    def __getattr__(self, name):
+
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        value = Stub()
+        setattr(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __getitem__(self, key):
+        return Stub()
+
+    def __contains__(self, key):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def __floordiv__(self, other):
+        return 1
+
+
+class Render(Stub):
+
+    def __init__(self):
+        self.filepath = "//render_"
+        self.image_settings = Stub()
+        self.image_settings.file_format = "PNG"
+
+    def frame_path(self, frame=0):
+        """
+        Output filename of a frame, "#" are the frame number.
+        """
+
+        path = self.filepath.replace('\\', '/')
+        hashes = re.findall(r'#+', path)
+
+        if hashes:
+            path = path.replace(hashes[-1], str(frame).zfill(len(hashes[-1])))
+        else:
+            path += str(frame).zfill(4)
+
+        return f'{path}.{str(self.image_settings.file_format).lower()}'
+
+
+class Scene(Stub):
+
+    def __init__(self):
+        self.name = "Scene"
+        self.frame_current = 1
+        self.render = Render()
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+
+def new_file(filepath=""):
+    bpy.data.filepath = filepath
+    bpy.data.scenes = { 'Scene' : Scene() }
+    bpy.context.scene = bpy.data.scenes['Scene']
+
+
+def open_mainfile(filepath="", **kwargs):
+    new_file(filepath)
+
+    print(f'Read blend: "{filepath}"', flush=True)
+    time.sleep(LOAD_TIME)
+
+
+def render(write_still=False, scene=None, **kwargs):
+    """
+    Render a frame of the scene: handlers, sample lines and the output file.
+    """
+
+    scene = bpy.data.scenes.get(scene) or bpy.context.scene
+    frame = scene.frame_current
+    handlers = bpy.app.handlers
+
+    for handler in list(handlers.render_pre):
+        handler(scene)
+
+    for sample in range(1, SAMPLES + 1):
+        time.sleep(FRAME_TIME / SAMPLES)
+
+        stats = f'Fra:{frame} Mem:24.00M (Peak 24.00M) | Time:00:00.10 | Sample {sample}/{SAMPLES}'
+        print(stats)
+
+        for handler in list(handlers.render_stats):
+            handler(stats)
+
+    if write_still:
+        path = Path(scene.render.frame_path(frame=frame))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+        print(f"Saved: '{path}'")
+
+        for handler in list(handlers.render_write):
+            handler(scene)
+
+    for handler in list(handlers.render_post):
+        handler(scene)
+
+    sys.stdout.flush()
+
+
+bpy = types.ModuleType('bpy')
+bpy.data = Stub()
+bpy.data.filepath = ""
+bpy.data.objects = {}
+bpy.context = Stub()
+bpy.ops = Stub()
+bpy.ops.wm.open_mainfile = open_mainfile
+bpy.ops.render.render = render
+bpy.app = Stub()
+
+for name in ('render_pre', 'render_post', 'render_write', 'render_stats', 'render_cancel'):
+    setattr(bpy.app.handlers, name, [])
+
+
+def main():
+    argv = sys.argv[1:]
+
+    if '--python' not in argv:
+        print("Stub Blender only runs scripts: --background --python script.py -- args")
+        return 1
+
+    sys.modules['bpy'] = bpy
+    new_file()
+
+    # Blender leaves its whole command line in `sys.argv`
+    script = argv[argv.index('--python') + 1]
+    sys.argv = [ sys.executable ] + argv
+
+    runpy.run_path(script, run_name='__main__')
+    sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
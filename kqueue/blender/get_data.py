@@ -1,18 +1,144 @@
-
 import os
 import sys
 import bpy
 import json
 from pathlib import Path
 
-BRIDGE_FILE = sys.argv[6]
-
-scene = bpy.context.scene
-cycles = scene.cycles
-render = scene.render
+# Single mode:
+#   blender FILE --background --python get_data.py BRIDGE.json
+#
+# Batch mode (one Blender for many files):
+#   blender --background --python get_data.py -- BRIDGE.jsonl FILES.txt
+#
+# In batch mode, `FILES.txt` holds one .blend path per line and every file
+# produces one JSON record per line in `BRIDGE.jsonl`:
+#   {"file": "...", "data": {...}} or {"file": "...", "error": "..."}
+#
+# Serve mode (long-lived Blender that kQueue keeps warm):
+#   blender --background --python get_data.py -- --serve
+#
+# Reads one JSON request per line from stdin and answers on stdout with a
+# line that starts with `KQUEUE-DATA `:
+#   {"id": 1, "cmd": "inspect", "file": "..."} => {"id": 1, "data": {...}}
+#   {"id": 2, "cmd": "ping"} => {"id": 2, "data": "pong"}
+#   {"id": 3, "cmd": "quit"}
+
+if "--" in sys.argv:
+    ARGS = sys.argv[sys.argv.index("--") + 1:]
+else:
+    ARGS = sys.argv[6:]
+
+SERVE = ARGS[:1] == ["--serve"]
+BRIDGE_FILE = ARGS[0] if not SERVE else None
+FILES_FILE = ARGS[1] if len(ARGS) > 1 else None
+RESPONSE_TAG = "KQUEUE-DATA "
 
 print("BLENDER-START----------------------------------------")
 
+
+def get_data():
+    """
+    Get the data of the currently opened project.
+
+    Top level keys hold the active scene, `scenes` holds every scene, so
+    switching scenes in kQueue does not need another fetch.
+    """
+
+    data = get_scene_data(bpy.context.scene)
+
+    data['scene'] = bpy.context.scene.name
+    data['scene_list'] = [ s.name for s in bpy.data.scenes ]
+    data['scenes'] = { s.name : get_scene_data(s) for s in bpy.data.scenes }
+    data['dependencies'] = get_dependencies()
+
+    return data
+
+
+def get_dependencies():
+    """
+    Get absolute paths of files the project reads: linked libraries, images
+    and caches. Sequences and tiled images give their folder.
+    """
+
+    rv = set()
+
+    def add(path, library):
+
+        if not path:
+            return
+
+        rv.add(os.path.normpath(bpy.path.abspath(path, library=library)))
+
+    # Indirectly linked libraries are relative to their parent library
+    for library in bpy.data.libraries:
+        add(library.filepath, library.parent)
+
+    for image in bpy.data.images:
+
+        if image.packed_file or image.source not in {'FILE', 'SEQUENCE', 'MOVIE', 'TILED'}:
+            continue
+
+        if image.source in {'SEQUENCE', 'TILED'}:
+            add(os.path.dirname(image.filepath), image.library)
+        else:
+            add(image.filepath, image.library)
+
+    for cache_file in bpy.data.cache_files:
+        add(cache_file.filepath, cache_file.library)
+
+    for volume in bpy.data.volumes:
+
+        if volume.packed_file is None:
+            add(volume.filepath, volume.library)
+
+    return sorted(rv)
+
+
+def get_scene_data(scene):
+    """
+    Get render data of a scene.
+    """
+
+    # Names the expressions below read
+    names = {
+        'scene' : scene,
+        'cycles' : scene.cycles,
+        'render' : scene.render,
+    }
+
+    data = {}
+
+    for key, value in {
+        'frame_start' : 'scene.frame_start',
+        'frame_end' : 'scene.frame_end',
+        'camera' : 'scene.camera.name if scene.camera else None',
+        'camera_list' : '[ o.name for o in scene.objects if o and o.type == "CAMERA" ]',
+        'resolution_x' : 'render.resolution_x',
+        'resolution_y' : 'render.resolution_y',
+        'resolution_percentage' : 'render.resolution_percentage',
+        'render_filepath' : 'render.filepath',
+        'file_format' : 'render.image_settings.file_format',
+        'use_persistent_data' : 'render.use_persistent_data',
+        'use_adaptive_sampling' : 'cycles.use_adaptive_sampling',
+        'samples' : 'cycles.samples',
+        'denoiser' : 'cycles.denoiser',
+        'denoising_use_gpu' : 'cycles.denoising_use_gpu', # OPENIMAGEDENOISE, OPTIX
+        'denoising_input_passes' : 'cycles.denoising_input_passes',
+        'denoising_prefilter' : 'cycles.denoising_prefilter',
+        'view_layers' : '[ { "name" : vl.name, "use" : vl.use } for vl in scene.view_layers ]',
+    }.items():
+        data[key] = eval(value, names)
+
+    markers = []
+
+    for marker in scene.timeline_markers:
+        markers.append(marker.frame)
+
+    data['markers'] = markers
+
+    return data
+
+
 def main():
 
     bridge_file = Path(BRIDGE_FILE)
@@ -20,37 +146,8 @@ def main():
     if bridge_file.suffix != ".json":
         raise Exception(f'Bad data file name: {bridge_file.resolve()}')
 
-    data = {}
-
     try:
-        for key, value in {
-            'frame_start' : 'scene.frame_start',
-            'frame_end' : 'scene.frame_end',
-            'scene' : 'scene.name',
-            'scene_list' : '[ s.name for s in bpy.data.scenes ]',
-            'camera' : 'scene.camera.name if scene.camera else None',
-            'camera_list' : '[ o.name for o in scene.objects if o and o.type == "CAMERA" ]',
-            'resolution_x' : 'render.resolution_x',
-            'resolution_y' : 'render.resolution_y',
-            'resolution_percentage' : 'render.resolution_percentage',
-            'render_filepath' : 'render.filepath',
-            'file_format' : 'render.image_settings.file_format',
-            'use_persistent_data' : 'render.use_persistent_data',
-            'use_adaptive_sampling' : 'cycles.use_adaptive_sampling',
-            'samples' : 'cycles.samples',
-            'denoiser' : 'cycles.denoiser',
-            'denoising_use_gpu' : 'cycles.denoising_use_gpu', # OPENIMAGEDENOISE, OPTIX
-            'denoising_input_passes' : 'cycles.denoising_input_passes',
-            'denoising_prefilter' : 'cycles.denoising_prefilter',
-        }.items():
-            data[key] = eval(value)
-
-        markers = []
-
-        for marker in scene.timeline_markers:
-            markers.append(marker.frame)
-
-        data['markers'] = markers
+        data = get_data()
 
     except:
         if bridge_file.exists():
@@ -63,6 +160,84 @@ def main():
 
     print("Data fetched successfully.")
 
-main()
 
-print("BLENDER-END------------------------------------------")
\ No newline at end of file
+def main_batch():
+
+    bridge_file = Path(BRIDGE_FILE)
+
+    if bridge_file.suffix != ".jsonl":
+        raise Exception(f'Bad data file name: {bridge_file.resolve()}')
+
+    with open(FILES_FILE, 'r', encoding='utf-8') as f:
+        files = [ line.strip() for line in f if line.strip() ]
+
+    with open(bridge_file, 'w', encoding='utf-8') as f:
+
+        for file in files:
+            record = { 'file' : file }
+
+            try:
+                bpy.ops.wm.open_mainfile(filepath=file, load_ui=False)
+                record['data'] = get_data()
+
+            except Exception as e:
+                record['error'] = repr(e)
+
+            # Flush every record, so kQueue can read it while we continue.
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+            print(f'Data fetched: {file}')
+
+
+def main_serve():
+
+    def respond(response):
+        sys.stdout.write(RESPONSE_TAG + json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+
+        if not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+
+        cmd = request.get('cmd')
+        response = { 'id' : request.get('id') }
+
+        if cmd == 'quit':
+            break
+
+        try:
+
+            if cmd == 'ping':
+                response['data'] = 'pong'
+
+            elif cmd == 'inspect':
+                bpy.ops.wm.open_mainfile(filepath=request['file'], load_ui=False)
+                response['data'] = get_data()
+
+                # Don't keep the project in memory while we wait
+                bpy.ops.wm.read_factory_settings(use_empty=True)
+
+            else:
+                response['error'] = f'Unknown command: {cmd}'
+
+        except Exception as e:
+            response['error'] = repr(e)
+
+        respond(response)
+
+
+if SERVE:
+    main_serve()
+elif FILES_FILE is None:
+    main()
+else:
+    main_batch()
+
+print("BLENDER-END------------------------------------------")
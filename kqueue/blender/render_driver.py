@@ -0,0 +1,277 @@
+import os
+import sys
+import bpy
+import json
+import time
+import traceback
+
+from queue import Queue
+from threading import Thread, RLock
+
+# Render session (one Blender renders many jobs):
+#   blender --background --python render_driver.py -- --serve
+#
+# Batch job (frames that don't fit the command line), renders one request of
+# the job file and quits:
+#   blender --background --python render_driver.py -- --job render_job.json
+#
+# Reads one JSON request per line from stdin:
+#   {"id": 1, "cmd": "render", "file": "...", "scene": "...", "engine": "CYCLES",
+#    "script": "render_settings.py", "frames": [1, 2, 3]}
+#   {"id": 1, "cmd": "steal", "count": 1}
+#   {"id": 1, "cmd": "load", "file": "...", "scene": "...", "engine": "CYCLES",
+#    "script": "render_settings.py"}
+#   {"id": 2, "cmd": "ping"}
+#   {"id": 3, "cmd": "quit"}
+#
+# Blender output is printed as usual, events are lines that start with
+# `KQUEUE-RENDER `:
+#   {"id": 1, "event": "start", "file": "...", "frames": [1, 2, 3]}
+#   {"id": 1, "event": "ready", "time": 4.2, "handlers": true}
+#   {"id": 1, "event": "frame", "frame": 1, "time": 31.5}
+#   {"id": 1, "event": "stolen", "frames": [3]}
+#   {"id": 1, "event": "done"} or {"id": 1, "event": "error", "error": "..."}
+#   {"id": 1, "event": "loaded", "time": 4.2}
+#   {"id": 2, "event": "pong"}
+#
+# Settings scripts register render handlers that print tagged events too:
+#   {"event": "render_pre", "file": "...", "frame": 1}, see `HANDLERS_PY`.
+#
+# `steal` is answered right away, even while rendering: the job gives up to
+# `count` frames it didn't start from its end, so another instance takes them.
+#
+# The opened file is kept between jobs with the same file and settings, so
+# the next chunk of a project doesn't load it again. `load` prepares a job
+# ahead: the file is opened, settings applied and the scene evaluated, then
+# Blender waits until the job is sent.
+
+EVENT_TAG = "KQUEUE-RENDER "
+
+print("BLENDER-START----------------------------------------")
+
+
+# The job being rendered: {"id": 1, "frames": [frames not started]}
+current = {}
+lock = RLock()
+
+
+def send(event):
+
+    with lock:
+        sys.stdout.write(EVENT_TAG + json.dumps(event) + "\n")
+        sys.stdout.flush()
+
+
+def read_requests(requests):
+    """
+    Read stdin in the background, answer steal requests right away.
+    """
+
+    for line in sys.stdin:
+
+        if not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+
+        if request.get('cmd') != 'steal':
+            requests.put(request)
+            continue
+
+        frames = []
+
+        # Answer under the lock, so the job can't report `done` before the
+        # frames it gave up are known.
+        with lock:
+
+            if current.get('id') == request.get('id'):
+                count = max(0, min(int(request.get('count', 1)), len(current['frames'])))
+
+                if count:
+                    frames = current['frames'][-count:]
+                    del current['frames'][-count:]
+
+            send({ 'id' : request.get('id'), 'event' : 'stolen', 'frames' : frames })
+
+    requests.put({ 'cmd' : 'quit' })
+
+
+def get_mtime(file):
+
+    try:
+        return os.stat(file).st_mtime_ns
+    except OSError:
+        return None
+
+
+def has_handlers():
+    """
+    Are progress handlers of the settings script registered?
+    """
+
+    return any(getattr(h, '__name__', "").startswith('kqueue_') for h in bpy.app.handlers.render_pre)
+
+
+def load(request, state):
+    """
+    Open the file and apply the settings script, unless they are loaded.
+    """
+
+    file = request['file']
+    script = request.get('script')
+    code = ""
+
+    if script:
+
+        with open(script, 'r', encoding='utf-8') as f:
+            code = f.read()
+
+    # Settings scripts change the scene, load the file again if it changed
+    # on disk or other settings are applied.
+    key = (file, get_mtime(file), request.get('scene'), request.get('engine'), code)
+
+    if state.get('key') == key:
+        print("All settings loaded successfully!")
+        return
+
+    state.clear()
+    bpy.ops.wm.open_mainfile(filepath=file, load_ui=False)
+
+    scene = bpy.data.scenes.get(request.get('scene') or "") or bpy.context.scene
+    scene.render.engine = request.get('engine') or scene.render.engine
+
+    if code:
+        exec(compile(code, script, 'exec'), { '__name__' : '__main__' })
+
+    # Build the scene now, not when the first frame renders
+    bpy.context.evaluated_depsgraph_get()
+
+    state['key'] = key
+
+
+def render(request, state):
+    """
+    Render frames of a project with the settings script.
+    """
+
+    request_id = request.get('id')
+    file = request['file']
+    frames = request['frames']
+
+    with lock:
+        current['id'] = request_id
+        current['frames'] = list(frames)
+
+    send({ 'id' : request_id, 'event' : 'start', 'file' : file, 'frames' : frames })
+
+    start_time = time.time()
+
+    load(request, state)
+
+    scene = bpy.data.scenes.get(request.get('scene') or "") or bpy.context.scene
+
+    send({ 'id' : request_id, 'event' : 'ready', 'time' : time.time() - start_time, 'handlers' : has_handlers() })
+
+    while True:
+
+        with lock:
+
+            if not current['frames']:
+                break
+
+            frame = current['frames'].pop(0)
+
+        print(f'Rendering frame {frame}')
+        sys.stdout.flush()
+
+        start_time = time.time()
+
+        scene.frame_set(frame)
+        bpy.ops.render.render(write_still=True, scene=scene.name)
+
+        send({ 'id' : request_id, 'event' : 'frame', 'frame' : frame, 'time' : time.time() - start_time })
+
+
+def run_job(file):
+    """
+    Render the request of a job file.
+    """
+
+    with open(file, 'r', encoding='utf-8') as f:
+        request = json.load(f)
+
+    try:
+        render(request, {})
+
+    except Exception as e:
+        traceback.print_exc()
+        send({ 'id' : request.get('id'), 'event' : 'error', 'error' : repr(e) })
+        return
+
+    send({ 'id' : request.get('id'), 'event' : 'done' })
+
+
+def main():
+    state = {}
+    requests = Queue()
+
+    t = Thread(target=read_requests, args=(requests,), daemon=True)
+    t.start()
+
+    while True:
+        request = requests.get()
+        cmd = request.get('cmd')
+        request_id = request.get('id')
+
+        if cmd == 'quit':
+            break
+
+        if cmd == 'ping':
+            send({ 'id' : request_id, 'event' : 'pong' })
+            continue
+
+        if cmd == 'load':
+            start_time = time.time()
+
+            try:
+                load(request, state)
+
+            except Exception as e:
+                traceback.print_exc()
+                state.clear()
+                send({ 'id' : request_id, 'event' : 'error', 'error' : repr(e) })
+                continue
+
+            send({ 'id' : request_id, 'event' : 'loaded', 'time' : time.time() - start_time })
+            continue
+
+        if cmd != 'render':
+            send({ 'id' : request_id, 'event' : 'error', 'error' : f'Unknown command: {cmd}' })
+            continue
+
+        try:
+            render(request, state)
+
+        except Exception as e:
+            traceback.print_exc()
+            state.clear()
+            send({ 'id' : request_id, 'event' : 'error', 'error' : repr(e) })
+            continue
+
+        finally:
+
+            with lock:
+                current.clear()
+
+        send({ 'id' : request_id, 'event' : 'done' })
+
+
+if '--job' in sys.argv:
+    run_job(sys.argv[sys.argv.index('--job') + 1])
+else:
+    main()
+
+print("BLENDER-END------------------------------------------")
@@ -21,3 +21,117 @@ PERSISTENT_FILE = f"kqueue/{SAVE_FOLDER}/.persistent"
 BRIDGE_FILE = f"{TEMP_FOLDER}data.json"
 GET_DATA_BAT = f"{TEMP_FOLDER}get_data.bat"
 GET_DATA_PY = "kqueue/blender/get_data.py"
+RENDER_DRIVER_PY = "kqueue/blender/render_driver.py"
+JOURNAL_FOLDER = "kqueue/blender/journal/"
+
+# Log file writer: lines are written in batches from a bounded queue, the
+# file is compressed to a backup above `LOG_MAX_SIZE` bytes, and the status
+# line of the window is updated at most every `LOG_GUI_INTERVAL` seconds.
+LOG_QUEUE_SIZE = 10000
+LOG_FLUSH_INTERVAL = 0.5
+LOG_GUI_INTERVAL = 0.1
+LOG_MAX_SIZE = 8 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# How many background Blender instances may fetch project data at once.
+LOADER_WORKERS = 4
+
+# How many projects one background Blender instance reads before it exits.
+LOADER_BATCH_SIZE = 16
+
+# Read project data from .blend file blocks first, Blender is launched only
+# for projects that could not be decoded.
+LOADER_READ_BLEND = True
+
+# Project data cache database, the entries above these limits are pruned
+# starting from the least recently used.
+CACHE_DB = "kqueue/blender/cache.db"
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_SIZE = 64 * 1024 * 1024
+CACHE_TOUCH_INTERVAL = 3600
+
+# Files watcher: polling interval (or wait timeout of change notifications),
+# full rescan interval, and whether to fill the cache of changed projects
+# right away. Polling checks dependencies only on the full rescan.
+WATCHER_POLL_INTERVAL = 2.0
+WATCHER_RESCAN_INTERVAL = 60.0
+WATCHER_PREFETCH = False
+
+# Keep background Blender instances warm between project reloads, stop them
+# after being idle for `DAEMON_IDLE_TIMEOUT` seconds.
+LOADER_USE_DAEMON = True
+DAEMON_IDLE_TIMEOUT = 300.0
+DAEMON_REQUEST_TIMEOUT = 120.0
+DAEMON_PING_TIMEOUT = 10.0
+DAEMON_CHECK_INTERVAL = 15.0
+
+# Render device pool, one Blender instance renders on every entry at once:
+# "CPU", "OPTIX:0", "CUDA:1", "HIP:0", "METAL", "ONEAPI:0". An entry without
+# an index uses all GPUs of its backend, several "CPU" entries split the
+# cores. Empty list renders with one instance on the devices of the project.
+RENDER_DEVICES = []
+
+# Keep one Blender per render instance alive between jobs, jobs are sent to
+# `render_driver.py` over a pipe. With `RENDER_PREWARM` an instance that
+# renders the last frame of a job starts Blender for its next project, which
+# loads the file and waits for the job.
+RENDER_USE_SESSION = True
+RENDER_PREWARM = True
+
+# Rendering starts from a plan of the queue: frames, resolved settings and
+# settings scripts of every project. With `RENDER_DRY_RUN` the plan is written
+# as JSON next to the render journal and nothing is rendered.
+RENDER_DRY_RUN = False
+
+# Blender that crashed, exited early or was killed by the watchdog is started
+# again up to `RENDER_RETRY_LIMIT` times per job with the frames that are
+# left, after `RENDER_RETRY_BACKOFF` seconds doubled with every retry. A frame
+# that was being rendered `RENDER_FRAME_FAILURES` times when Blender failed is
+# skipped and marked as failed.
+RENDER_RETRY_LIMIT = 3
+RENDER_RETRY_BACKOFF = 5.0
+RENDER_RETRY_BACKOFF_MAX = 60.0
+RENDER_FRAME_FAILURES = 2
+
+# Frames that ran out of memory ("Out of memory", "CUDA error") are rendered
+# again with one more step of `RENDER_OOM_LADDER`, steps stay for the rest of
+# the project on that instance: 'tiles' - tiles of `RENDER_OOM_TILE_SIZE`,
+# 'no_persistent_data', 'cpu' - render on CPU, 'resolution' - half resolution,
+# preview renders only. Then Blender is retried as any failed one.
+RENDER_OOM_LADDER = [ 'tiles', 'no_persistent_data', 'cpu', 'resolution' ]
+RENDER_OOM_TILE_SIZE = 256
+
+# Watchdog of render instances, checks every `RENDER_WATCHDOG_INTERVAL`
+# seconds. Blender is killed if it printed nothing for `RENDER_STALL_TIMEOUT`
+# seconds, or if a frame takes `RENDER_FRAME_TIMEOUT_FACTOR` times the median
+# of the last `RENDER_FRAME_HISTORY` frames of the project, and at least
+# `RENDER_FRAME_TIMEOUT_MIN` seconds.
+RENDER_WATCHDOG_INTERVAL = 5.0
+RENDER_STALL_TIMEOUT = 900.0
+RENDER_FRAME_TIMEOUT_FACTOR = 5.0
+RENDER_FRAME_TIMEOUT_MIN = 300.0
+RENDER_FRAME_HISTORY = 9
+
+# Frames are rendered in chunks from a shared queue. Chunks shrink as the
+# queue drains, but stay large enough to keep Blender overhead under
+# `RENDER_CHUNK_OVERHEAD` of the chunk time. `RENDER_CHUNK_FIRST` frames are
+# rendered before the frame time of a project is known.
+RENDER_CHUNK_FIRST = 2
+RENDER_CHUNK_MAX = 200
+RENDER_CHUNK_OVERHEAD = 0.1
+
+# LAN render farm. With `FARM_COORDINATOR` kQueue listens for render agents
+# (`python -m kqueue.farm.agent`) on `FARM_PORT`, every device of an agent
+# renders chunks of the queue next to local instances. Agents that were silent
+# for `FARM_AGENT_TIMEOUT` seconds are dropped and their frames go back to the
+# queue. Agents run settings scripts of the coordinator, so they must send
+# `FARM_TOKEN` if it is set. Only local agents can connect by default, to
+# accept agents of the LAN set `FARM_HOST` to "0.0.0.0" and set `FARM_TOKEN`,
+# other hosts than loopback are refused without a token.
+FARM_COORDINATOR = False
+FARM_HOST = "127.0.0.1"
+FARM_PORT = 7720
+FARM_TOKEN = ""
+FARM_HEARTBEAT_INTERVAL = 5.0
+FARM_AGENT_TIMEOUT = 20.0
+FARM_RECONNECT_INTERVAL = 5.0
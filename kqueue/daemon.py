@@ -0,0 +1,288 @@
+################################################################################
+## Metadata Daemon
+##
+## Long-lived background Blender that runs `get_data.py` in serve mode and
+## answers "inspect file X" requests, so reloads don't pay Blender startup.
+
+import json
+import subprocess
+
+from time import time
+from queue import Queue, Empty
+from threading import Lock
+from pathlib import Path
+from .config import *
+from .orchestrator import get_orchestrator
+from . import store
+
+RESPONSE_TAG = "KQUEUE-DATA "
+
+
+class DaemonError(Exception):
+    pass
+
+
+class MetadataDaemon():
+    """
+    One background Blender waiting for requests on stdin.
+    """
+
+    def __init__(self, blender_exe, idle_timeout=DAEMON_IDLE_TIMEOUT):
+        self.blender_exe = blender_exe
+        self.idle_timeout = idle_timeout
+        self.process = None
+        self.responses = Queue()
+        self.lock = Lock()
+        self.request_id = 0
+        self.last_used = time()
+        self.restarts = 0
+
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+
+    def start(self):
+        """
+        Start Blender in serve mode.
+        """
+
+        self.stop()
+
+        responses = self.responses = Queue()
+        self.process = get_orchestrator().spawn(
+            [
+                self.blender_exe,
+                "--factory-startup",
+                "--background",
+                "--python", str(store.get_data_py.resolve()),
+                "--",
+                "--serve",
+            ],
+            on_line=lambda line: self.read_line(line, responses),
+            # Wake up whoever waits for a response of a crashed process
+            on_exit=lambda code: responses.put(None),
+            cwd=str(Path(self.blender_exe).parent),
+        )
+
+        self.last_used = time()
+
+
+    def stop(self):
+        """
+        Ask Blender to quit, kill it if it doesn't.
+        """
+
+        process, self.process = self.process, None
+
+        if process is None or process.poll() is not None:
+            return
+
+        try:
+            process.stdin.write(json.dumps({ 'cmd' : 'quit' }) + "\n")
+            process.stdin.flush()
+            process.wait(timeout=5.0)
+
+        except Exception:
+            process.kill()
+
+
+    def read_line(self, line, responses):
+        """
+        Collect tagged responses, Blender prints other things too.
+        """
+
+        if not line.startswith(RESPONSE_TAG):
+            return
+
+        try:
+            responses.put(json.loads(line[len(RESPONSE_TAG):]))
+        except ValueError:
+            pass
+
+
+    def request(self, cmd, timeout=DAEMON_REQUEST_TIMEOUT, touch=True, **kwargs):
+        """
+        Send a request and wait for the response.
+
+        Restarts Blender if it is not running and once more if it crashes
+        while answering.
+
+        `touch` - does this request reset the idle timer?
+        """
+
+        with self.lock:
+
+            for attempt in range(2):
+
+                if not self.is_running():
+
+                    if self.process is not None:
+                        self.restarts += 1
+
+                    self.start()
+
+                self.request_id += 1
+                request_id = self.request_id
+
+                try:
+                    self.process.stdin.write(json.dumps({ 'id' : request_id, 'cmd' : cmd, **kwargs }) + "\n")
+                    self.process.stdin.flush()
+                    response = self.wait_response(request_id, timeout)
+
+                except (OSError, DaemonError) as e:
+                    self.kill()
+
+                    if attempt:
+                        raise DaemonError(f'Blender does not respond: {e}')
+
+                    continue
+
+                if touch:
+                    self.last_used = time()
+
+                if 'error' in response:
+                    raise DaemonError(response['error'])
+
+                return response.get('data')
+
+
+    def wait_response(self, request_id, timeout):
+        end_time = time() + timeout
+
+        while True:
+
+            try:
+                response = self.responses.get(timeout=max(0.0, end_time - time()))
+            except Empty:
+                raise DaemonError("Timeout.")
+
+            if response is None:
+                raise DaemonError("Blender has crashed.")
+
+            if response.get('id') == request_id:
+                return response
+
+
+    def kill(self):
+
+        if self.process is None:
+            return
+
+        if self.process.poll() is None:
+            self.process.kill()
+
+        # Reap it, so the next request doesn't see a dying process as running
+        try:
+            self.process.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+    def ping(self):
+        """
+        Health check.
+        """
+
+        try:
+            return self.request('ping', timeout=DAEMON_PING_TIMEOUT, touch=False) == 'pong'
+        except DaemonError:
+            return False
+
+
+    def inspect(self, file):
+        """
+        Get project data of a file.
+        """
+
+        return self.request('inspect', file=file)
+
+
+    def check(self):
+        """
+        Restart crashed Blender, stop it if nobody needed it for a while,
+        otherwise make sure it still answers.
+        """
+
+        # Busy with a request, it is alive
+        if not self.lock.acquire(blocking=False):
+            return
+
+        try:
+
+            if self.process is None:
+                return
+
+            if self.process.poll() is not None:
+                self.restarts += 1
+                self.start()
+                return
+
+            if time() - self.last_used > self.idle_timeout:
+                self.stop()
+                return
+
+        finally:
+            self.lock.release()
+
+        # Hung Blender gets killed and started again
+        self.ping()
+
+
+################################################################################
+# Daemons Pool
+
+__daemons = {}
+__lock = Lock()
+__watchdog = None
+
+
+def get_daemon(slot):
+    """
+    Get the daemon of the loader worker slot.
+    """
+
+    global __watchdog
+
+    blender_exe = store.preset.blender_exe
+
+    with __lock:
+        daemon = __daemons.get(slot)
+
+        if daemon is not None and daemon.blender_exe != blender_exe:
+            daemon.stop()
+            daemon = None
+
+        if daemon is None:
+            daemon = __daemons[slot] = MetadataDaemon(blender_exe)
+
+        # Checks may wait for a ping, they run on a worker thread
+        if __watchdog is None:
+            __watchdog = get_orchestrator().every(DAEMON_CHECK_INTERVAL, watchdog, blocking=True)
+
+    return daemon
+
+
+def watchdog():
+    """
+    Check daemons health, called from time to time.
+    """
+
+    with __lock:
+        daemons = list(__daemons.values())
+
+    for daemon in daemons:
+        daemon.check()
+
+
+def stop_all():
+    """
+    Stop all daemons.
+    """
+
+    with __lock:
+        daemons = list(__daemons.values())
+        __daemons.clear()
+
+    for daemon in daemons:
+        daemon.stop()
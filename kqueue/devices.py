@@ -0,0 +1,120 @@
+################################################################################
+## Render Devices
+##
+## Device pool of the render scheduler. Every device runs its own Blender
+## instance, the settings script of the instance selects the device in
+## Cycles preferences.
+
+import os
+
+from .config import *
+
+# Cycles compute backends, `CPU` is a device type of its own.
+BACKENDS = [ 'CUDA', 'OPTIX', 'HIP', 'METAL', 'ONEAPI' ]
+
+
+class RenderDevice():
+    """
+    One slot of the device pool.
+
+    `backend` - 'CPU' or a Cycles compute backend.
+    `index` - GPU index among devices of the backend, `None` uses all of them.
+    `threads` - CPU threads of the instance, 0 detects them automatically.
+    """
+
+    def __init__(self, slot, backend=None, index=None, threads=0):
+        self.slot = slot
+        self.backend = backend
+        self.index = index
+        self.threads = threads
+
+
+    def get_name(self):
+
+        if self.backend is None:
+            return "Default"
+
+        if self.index is None:
+            return self.backend
+
+        return f'{self.backend}:{self.index}'
+
+
+    def get_script(self):
+        """
+        Get settings script lines that select this device.
+        """
+
+        if self.backend is None:
+            return ""
+
+        if self.backend == 'CPU':
+            script = """
+# Device
+cycles.device = "CPU"
+"""
+            if self.threads:
+                script += f"""render.threads_mode = "FIXED"
+render.threads = {self.threads}
+"""
+            return script
+
+        use = "True" if self.index is None else f"i == {self.index}"
+
+        return f"""
+# Device
+cycles_prefs = bpy.context.preferences.addons["cycles"].preferences
+cycles_prefs.compute_device_type = "{self.backend}"
+
+if hasattr(cycles_prefs, "refresh_devices"):
+    cycles_prefs.refresh_devices()
+else:
+    cycles_prefs.get_devices()
+
+backend_devices = [ d for d in cycles_prefs.devices if d.type == "{self.backend}" ]
+
+for d in cycles_prefs.devices:
+    d.use = False
+
+for i, d in enumerate(backend_devices):
+    d.use = {use}
+
+cycles.device = "GPU"
+"""
+
+
+def get_devices(entries=None, cpu_count=None):
+    """
+    Parse device pool entries: "CPU", "OPTIX:0", "CUDA".
+
+    CPU entries split the cores evenly. No entries give one instance that
+    renders on the device set in the project.
+
+    `cpu_count` - cores of the machine that renders, this one by default.
+    """
+
+    if entries is None:
+        entries = RENDER_DEVICES
+
+    if not entries:
+        return [ RenderDevice(0) ]
+
+    cpu_slots = sum(1 for entry in entries if entry.strip().upper() == 'CPU')
+    threads = (cpu_count or os.cpu_count() or 1) // cpu_slots if cpu_slots > 1 else 0
+
+    rv = []
+
+    for entry in entries:
+        backend, _, index = entry.strip().upper().partition(":")
+
+        if backend != 'CPU' and backend not in BACKENDS:
+            raise ValueError(f'Unknown render device: {entry}')
+
+        rv.append(RenderDevice(
+            len(rv),
+            backend=backend,
+            index=int(index) if index else None,
+            threads=max(1, threads) if backend == 'CPU' and threads else 0,
+        ))
+
+    return rv
@@ -0,0 +1,385 @@
+################################################################################
+## Render Agent
+##
+## Headless render node of the LAN render farm, needs no GUI libraries:
+##   python -m kqueue.farm.agent --host 192.168.0.10 --blender "C:/Blender/blender.exe" --devices OPTIX:0,CPU
+##
+## Connects to the coordinator, registers its devices and renders the jobs it
+## gets with one Blender session per device. Blender output goes back to the
+## coordinator. Projects and outputs must be on shared storage, `--map` maps
+## coordinator paths that are mounted elsewhere on this machine.
+
+import os
+import sys
+import socket
+import argparse
+import tempfile
+
+from time import sleep
+from queue import Queue, Empty
+from threading import Thread
+from pathlib import Path
+from ..session import RenderSession, SessionError
+from ..config import *
+from .protocol import Connection, PROTOCOL_VERSION
+
+DRIVER_PY = Path(__file__).resolve().parents[1] / 'blender' / 'render_driver.py'
+
+
+def log(*args):
+    print(" ".join(str(a) for a in args), flush=True)
+
+
+################################################################################
+# Device Worker
+
+class DeviceWorker():
+    """
+    One device of the agent, renders jobs one by one in its own session.
+    """
+
+    def __init__(self, agent, slot, entry):
+        self.agent = agent
+        self.slot = slot
+        self.entry = entry
+        self.jobs = Queue()
+        self.session = None
+        self.temp_folder = Path(agent.temp_folder) / f'device_{slot}'
+
+        Thread(target=self.run, daemon=True).start()
+
+
+    def run(self):
+
+        while True:
+            job = self.jobs.get()
+
+            if job is None:
+                break
+
+            self.render(job)
+
+        if self.session is not None:
+            self.session.stop()
+
+
+    def render(self, job):
+        """
+        Render one job, the result goes to the coordinator after the output.
+        """
+
+        agent = self.agent
+
+        if self.session is None:
+            self.session = RenderSession(agent.blender_exe, agent.outbox, owner=(self.slot, None), processes=agent.processes, driver=agent.driver)
+
+        # Output lines carry the job, the coordinator drops lines of old jobs
+        self.session.owner = (self.slot, job.get('job'))
+
+        os.makedirs(self.temp_folder, exist_ok=True)
+
+        script = self.temp_folder / 'render_settings.py'
+
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write(agent.map_script(job.get('script') or ""))
+
+        try:
+            frames = self.session.render(
+                agent.map_path(job['file']),
+                job['frames'],
+                scene=job.get('scene'),
+                engine=job.get('engine'),
+                script=str(script),
+            )
+            error = None
+
+        except SessionError as e:
+            frames = e.frames
+            error = str(e)
+
+        # Through the outbox, so it is sent after the output of the job
+        agent.outbox.put((self.session.owner, {
+            'type' : 'result',
+            'device' : self.slot,
+            'job' : job.get('job'),
+            'frames' : frames,
+            'error' : error,
+        }))
+
+
+    def steal(self, count):
+
+        if self.session is not None:
+            self.session.steal(count)
+
+
+    def drop_jobs(self):
+        """
+        Forget queued jobs and kill Blender, the current job fails.
+        """
+
+        while True:
+
+            try:
+                self.jobs.get_nowait()
+            except Empty:
+                break
+
+        if self.session is not None:
+            self.session.kill()
+
+
+################################################################################
+# Agent
+
+class RenderAgent():
+    """
+    Connection to the coordinator and workers of the devices.
+
+    `path_map` - list of `(coordinator prefix, local prefix)`.
+    """
+
+    def __init__(self, host, port, blender_exe, devices, name=None, token=FARM_TOKEN,
+                 path_map=(), temp_folder=None, driver=DRIVER_PY):
+        self.host = host
+        self.port = port
+        self.blender_exe = blender_exe
+        self.devices = list(devices)
+        self.name = name or socket.gethostname()
+        self.token = token
+        self.path_map = [ (src.replace('\\', '/'), dst.replace('\\', '/')) for src, dst in path_map ]
+        self.temp_folder = temp_folder or os.path.join(tempfile.gettempdir(), 'kqueue_agent')
+        self.driver = driver
+        self.connection = None
+        self.running = True
+
+        # (slot, output line or result message) of every device
+        self.outbox = Queue()
+
+        # Blender processes of the sessions
+        self.processes = []
+
+        # One worker even without devices, it renders on the project devices
+        self.workers = [ DeviceWorker(self, slot, entry) for slot, entry in enumerate(self.devices or [ None ]) ]
+
+        Thread(target=self.forward, daemon=True).start()
+        Thread(target=self.heartbeat, daemon=True).start()
+
+
+    def map_path(self, path):
+
+        p = path.replace('\\', '/')
+
+        for src, dst in self.path_map:
+
+            if p.lower().startswith(src.lower()):
+                return dst + p[len(src):]
+
+        return path
+
+
+    def map_script(self, script):
+
+        for src, dst in self.path_map:
+            script = script.replace(src, dst)
+
+        return script
+
+
+    def send(self, message):
+        """
+        Send a message if connected, a lost connection is closed.
+        """
+
+        connection = self.connection
+
+        if connection is None:
+            return
+
+        try:
+            connection.send(message)
+        except OSError:
+            connection.close()
+
+
+    def forward(self):
+        """
+        Send output lines and results of the devices in order.
+        """
+
+        while True:
+            (slot, job), item = self.outbox.get()
+
+            if isinstance(item, dict):
+                self.send(item)
+            else:
+                self.send({ 'type' : 'output', 'device' : slot, 'job' : job, 'line' : item })
+
+
+    def heartbeat(self):
+
+        while self.running:
+            sleep(FARM_HEARTBEAT_INTERVAL)
+            self.send({ 'type' : 'heartbeat' })
+
+
+    def run(self, reconnect=True):
+        """
+        Serve the coordinator, connect again when the connection is lost.
+        """
+
+        while self.running:
+
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=10.0)
+
+            except OSError as e:
+                log(f'Unable to connect to {self.host}:{self.port}: {e}')
+
+                if not reconnect:
+                    break
+
+                sleep(FARM_RECONNECT_INTERVAL)
+                continue
+
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            self.serve(Connection(sock))
+
+            # Frames of dropped jobs are rendered by others
+            for worker in self.workers:
+                worker.drop_jobs()
+
+            log("Disconnected.")
+
+            if not reconnect:
+                break
+
+            sleep(FARM_RECONNECT_INTERVAL)
+
+        self.stop()
+
+
+    def serve(self, connection):
+
+        try:
+            connection.send({
+                'type' : 'register',
+                'version' : PROTOCOL_VERSION,
+                'name' : self.name,
+                'token' : self.token,
+                'devices' : self.devices,
+                'cpu_count' : os.cpu_count(),
+            })
+
+        except OSError:
+            connection.close()
+            return
+
+        self.connection = connection
+
+        try:
+
+            for message in connection.read():
+                kind = message.get('type')
+
+                if kind == 'welcome':
+                    log(f'Connected to {self.host}:{self.port} as {self.name}.')
+
+                elif kind == 'rejected':
+                    log(f'Rejected: {message.get("error")}')
+                    self.running = False
+                    break
+
+                elif kind == 'render':
+                    worker = self.get_worker(message.get('device'))
+
+                    if worker is None:
+                        self.send({ 'type' : 'result', 'device' : message.get('device'), 'job' : message.get('job'), 'frames' : [], 'error' : "Unknown device." })
+                        continue
+
+                    worker.jobs.put(message)
+
+                elif kind == 'steal':
+                    worker = self.get_worker(message.get('device'))
+
+                    if worker is not None:
+                        worker.steal(int(message.get('count', 1)))
+
+                elif kind == 'stop':
+
+                    for worker in self.workers:
+                        worker.drop_jobs()
+
+        finally:
+            self.connection = None
+            connection.close()
+
+
+    def get_worker(self, slot):
+
+        if isinstance(slot, int) and 0 <= slot < len(self.workers):
+            return self.workers[slot]
+
+        return None
+
+
+    def stop(self):
+
+        self.running = False
+
+        for worker in self.workers:
+            worker.drop_jobs()
+            worker.jobs.put(None)
+
+
+################################################################################
+# Command Line
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="kqueue.farm.agent", description="kQueue render agent.")
+    parser.add_argument('--host', required=True, help="coordinator address")
+    parser.add_argument('--port', type=int, default=FARM_PORT)
+    parser.add_argument('--blender', required=True, help="Blender executable")
+    parser.add_argument('--devices', default=",".join(RENDER_DEVICES), help="device pool, e.g. OPTIX:0,CPU")
+    parser.add_argument('--name', default=None, help="agent name, host name by default")
+    parser.add_argument('--token', default=FARM_TOKEN)
+    parser.add_argument('--map', action='append', default=[], metavar="SRC=DST", help="map a coordinator path prefix")
+    parser.add_argument('--temp', default=None, help="folder of settings scripts")
+
+    args = parser.parse_args(argv)
+
+    path_map = []
+
+    for item in args.map:
+        src, sep, dst = item.partition("=")
+
+        if not sep:
+            parser.error(f'Bad --map: {item}')
+
+        path_map.append((src, dst))
+
+    agent = RenderAgent(
+        args.host,
+        args.port,
+        args.blender,
+        [ d for d in args.devices.split(",") if d.strip() ],
+        name=args.name,
+        token=args.token,
+        path_map=path_map,
+        temp_folder=args.temp,
+    )
+
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
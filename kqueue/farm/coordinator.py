@@ -0,0 +1,504 @@
+################################################################################
+## Render Farm Coordinator
+##
+## Accepts render agents of the LAN render farm. Every device of an agent is a
+## remote render instance that takes chunks from the frame scheduler like a
+## local one, and its Blender output goes to the same listener.
+
+import hmac
+import json
+import socket
+import ipaddress
+
+from time import time, sleep
+from queue import Queue
+from threading import Thread, Lock
+from ..devices import get_devices
+from ..session import EVENT_TAG
+from ..render import RenderInstance, get_settings_script
+from ..config import *
+from .. import store, main
+from .protocol import Connection, FarmError, PROTOCOL_VERSION
+
+
+################################################################################
+# Remote Instance
+
+class RemoteInstance(RenderInstance):
+    """
+    One device of a render agent.
+
+    Jobs are sent to the agent, rendered and stolen frames come back as
+    render driver events in the output of the agent.
+    """
+
+    def __init__(self, agent, device):
+        super().__init__(device, None)
+
+        self.agent = agent
+        self.job_id = None
+
+        # Driver events and job results, `None` when the agent is lost
+        self.events = Queue()
+
+
+    def get_name(self):
+        return f'{self.agent.name}#{self.device.slot} {self.device.get_name()}'
+
+
+    def put_line(self, line, job=None):
+        """
+        Output line of the agent Blender, rendering job `job`.
+        """
+
+        output = self.output
+
+        if output is not None:
+            output.put((self, line))
+
+        if not line.startswith(EVENT_TAG):
+            return
+
+        try:
+            event = json.loads(line[len(EVENT_TAG):])
+        except ValueError:
+            return
+
+        event['job'] = job
+        self.events.put(event)
+
+
+    def put_result(self, message):
+        """
+        Agent finished a job.
+        """
+
+        self.events.put({
+            'event' : 'result',
+            'job' : message.get('job'),
+            'frames' : message.get('frames') or [],
+            'error' : message.get('error'),
+        })
+
+
+    def steal(self, count):
+
+        if self.job_id is None or not self.agent.alive:
+            return False
+
+        try:
+            self.agent.send({ 'type' : 'steal', 'device' : self.device.slot, 'count' : count })
+        except OSError:
+            return False
+
+        return True
+
+
+    def render(self, project, frames, scheduler):
+        """
+        Render frames on the agent. Failed jobs are sent again with the frames
+        that are left, frames of a lost agent go back to the scheduler.
+        """
+
+        preset = store.preset
+
+        script = get_settings_script(project, self.device)
+        left = list(frames)
+        restarts = 0
+
+        while left and not preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED'):
+            rendered = set()
+            error = None
+
+            self.job_id = job_id = self.agent.coordinator.next_job_id()
+
+            try:
+                self.agent.send({
+                    'type' : 'render',
+                    'device' : self.device.slot,
+                    'job' : job_id,
+                    'file' : project.file,
+                    'scene' : project.scene,
+                    'engine' : project.engine,
+                    'script' : script,
+                    'frames' : left,
+                })
+
+            except OSError as e:
+                error = f'Agent does not respond: {e}'
+
+            while error is None:
+                event = self.events.get()
+
+                if event is None:
+                    error = "Agent was lost."
+                    break
+
+                # Late events of a job that failed or was stopped
+                if event.get('job') != job_id:
+                    continue
+
+                name = event.get('event')
+
+                if name == 'ready':
+                    scheduler.on_ready(self, event.get('time', 0.0))
+
+                elif name == 'frame':
+                    rendered.add(event.get('frame'))
+                    scheduler.on_frame(self, event.get('frame'), event.get('time'))
+
+                elif name == 'stolen':
+                    stolen = event.get('frames') or []
+                    left = [ f for f in left if f not in stolen ]
+                    scheduler.give_back(self, stolen)
+
+                elif name == 'result':
+                    rendered.update(event.get('frames'))
+
+                    if event.get('error') is None:
+                        break
+
+                    error = event.get('error')
+
+            self.job_id = None
+            left = [ f for f in left if f not in rendered ]
+
+            if error is None or preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED'):
+                break
+
+            if not self.agent.alive:
+                main.log(f'Instance {self.get_name()}: {error} {len(left)} frames go back to the queue.')
+                scheduler.give_back(self, left)
+                break
+
+            main.log(f'Instance {self.get_name()}: {error}')
+
+            if restarts >= RENDER_RETRY_LIMIT:
+                self.fail_frames(project, left, error)
+                break
+
+            restarts += 1
+            main.log(f'Sending the job again, {len(left)} frames left.')
+
+        scheduler.finish(self)
+
+
+    def close(self):
+        """
+        The agent keeps its Blender for the next render.
+        """
+
+        pass
+
+
+################################################################################
+# Agent
+
+class RemoteAgent():
+    """
+    Connected render agent.
+    """
+
+    def __init__(self, coordinator, connection, name, address):
+        self.coordinator = coordinator
+        self.connection = connection
+        self.name = name
+        self.address = address
+        self.instances = []
+        self.last_seen = time()
+        self.alive = True
+
+
+    def send(self, message):
+        self.connection.send(message)
+
+
+    def get_instance(self, slot):
+
+        for instance in self.instances:
+
+            if instance.device.slot == slot:
+                return instance
+
+        return None
+
+
+################################################################################
+# Coordinator
+
+class FarmCoordinator():
+    """
+    TCP server of the render farm.
+
+    Agents stay connected between renders, their instances join the render
+    thread that is attached.
+    """
+
+    def __init__(self, host=FARM_HOST, port=FARM_PORT, token=FARM_TOKEN):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server = None
+        self.agents = []
+        self.lock = Lock()
+        self.render_thread = None
+        self.job_id = 0
+
+
+    def start(self):
+        """
+        Listen for agents, raises `OSError` if the port is taken and
+        `FarmError` if the host is not loopback and there is no token.
+        """
+
+        if not self.token and not is_loopback(self.host):
+            raise FarmError(f'Listening on {self.host} needs a FARM_TOKEN.')
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen()
+
+        # Port 0 picks a free one
+        self.port = server.getsockname()[1]
+        self.server = server
+
+        Thread(target=self.accept, args=(server,), daemon=True).start()
+        Thread(target=self.watchdog, args=(server,), daemon=True).start()
+
+
+    def stop(self):
+        """
+        Stop listening and disconnect all agents.
+        """
+
+        server, self.server = self.server, None
+
+        if server is not None:
+
+            # Wakes up `accept` of the other thread
+            try:
+                server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            server.close()
+
+        with self.lock:
+            agents = list(self.agents)
+
+        for agent in agents:
+            agent.connection.close()
+
+
+    def accept(self, server):
+
+        while True:
+
+            try:
+                sock, address = server.accept()
+            except OSError:
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            Thread(target=self.serve, args=(sock, address), daemon=True).start()
+
+
+    def serve(self, sock, address):
+        """
+        Read messages of one agent until it disconnects.
+        """
+
+        connection = Connection(sock)
+        agent = None
+
+        try:
+
+            for message in connection.read():
+                kind = message.get('type')
+
+                if agent is None:
+
+                    if kind != 'register':
+                        continue
+
+                    agent = self.register(connection, message, address)
+
+                    if agent is None:
+                        break
+
+                    continue
+
+                agent.last_seen = time()
+
+                if kind == 'output':
+                    instance = agent.get_instance(message.get('device'))
+
+                    if instance is not None:
+                        instance.put_line(message.get('line') or "", message.get('job'))
+
+                elif kind == 'result':
+                    instance = agent.get_instance(message.get('device'))
+
+                    if instance is not None:
+                        instance.put_result(message)
+
+        finally:
+            connection.close()
+
+            if agent is not None:
+                self.unregister(agent)
+
+
+    def register(self, connection, message, address):
+        """
+        Check the agent and create instances of its devices.
+        """
+
+        name = str(message.get('name') or address[0])
+
+        def reject(error):
+            main.log(f'Render agent {name} was rejected: {error}')
+
+            try:
+                connection.send({ 'type' : 'rejected', 'error' : error })
+            except OSError:
+                pass
+
+        token = str(message.get('token') or '').encode('utf-8')
+
+        if self.token and not hmac.compare_digest(token, self.token.encode('utf-8')):
+            reject("Wrong token.")
+            return None
+
+        if message.get('version') != PROTOCOL_VERSION:
+            reject(f'Protocol version {message.get("version")} is not supported.')
+            return None
+
+        try:
+            devices = get_devices(message.get('devices') or [], cpu_count=message.get('cpu_count'))
+        except ValueError as e:
+            reject(str(e))
+            return None
+
+        agent = RemoteAgent(self, connection, name, address)
+        agent.instances = [ RemoteInstance(agent, device) for device in devices ]
+
+        try:
+            connection.send({ 'type' : 'welcome' })
+        except OSError:
+            return None
+
+        with self.lock:
+            self.agents.append(agent)
+            render_thread = self.render_thread
+
+        main.log(f'Render agent connected: {name} | {", ".join(d.get_name() for d in devices)}')
+
+        if render_thread is not None:
+
+            for instance in agent.instances:
+                render_thread.add_instance(instance)
+
+        return agent
+
+
+    def unregister(self, agent):
+        """
+        Agent disconnected, its jobs fail and its frames go back to the queue.
+        """
+
+        with self.lock:
+            agent.alive = False
+
+            if agent in self.agents:
+                self.agents.remove(agent)
+
+            render_thread = self.render_thread
+
+        for instance in agent.instances:
+
+            if render_thread is not None:
+                render_thread.remove_instance(instance)
+
+            instance.events.put(None)
+
+        main.log(f'Render agent disconnected: {agent.name}')
+
+
+    def watchdog(self, server):
+        """
+        Drop agents that stopped sending heartbeats.
+        """
+
+        while self.server is server:
+            sleep(FARM_HEARTBEAT_INTERVAL)
+
+            with self.lock:
+                agents = list(self.agents)
+
+            for agent in agents:
+
+                if time() - agent.last_seen > FARM_AGENT_TIMEOUT:
+                    main.log(f'Render agent {agent.name} does not respond.')
+                    agent.connection.close()
+
+
+    def attach(self, render_thread):
+        """
+        Render started, returns instances of connected agents. Agents that
+        connect later join `render_thread` with `add_instance`.
+        """
+
+        with self.lock:
+            self.render_thread = render_thread
+
+            return [ instance for agent in self.agents for instance in agent.instances ]
+
+
+    def detach(self):
+
+        with self.lock:
+            self.render_thread = None
+
+
+    def stop_jobs(self):
+        """
+        Rendering was stopped, agents drop their jobs.
+        """
+
+        with self.lock:
+            agents = list(self.agents)
+
+        for agent in agents:
+
+            try:
+                agent.send({ 'type' : 'stop' })
+            except OSError:
+                pass
+
+
+    def next_job_id(self):
+
+        with self.lock:
+            self.job_id += 1
+            return self.job_id
+
+
+    def get_agents(self):
+
+        with self.lock:
+            return list(self.agents)
+
+
+def is_loopback(host):
+    """
+    Is the host only reachable from this computer?
+    """
+
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
@@ -0,0 +1,95 @@
+################################################################################
+## Render Farm Protocol
+##
+## Coordinator and render agents talk over TCP with one JSON message per line.
+##
+## Agent => coordinator:
+##   {"type": "register", "name": "node-2", "token": "...", "cpu_count": 16,
+##    "devices": ["OPTIX:0", "CPU"], "version": 1}
+##   {"type": "output", "device": 0, "job": 7, "line": "Fra:1 Mem:..."}
+##   {"type": "result", "device": 0, "job": 7, "frames": [1, 2], "error": null}
+##   {"type": "heartbeat"}
+##
+## Coordinator => agent:
+##   {"type": "welcome"} or {"type": "rejected", "error": "..."}
+##   {"type": "render", "device": 0, "job": 7, "file": "...", "scene": "...",
+##    "engine": "CYCLES", "script": "import bpy...", "frames": [1, 2, 3]}
+##   {"type": "steal", "device": 0, "count": 2}
+##   {"type": "stop"}
+##
+## Output lines carry render driver events, so the coordinator learns about
+## rendered and stolen frames the same way it does from local sessions. Events
+## of other jobs than the one being rendered are late and dropped.
+
+import json
+import socket
+
+from threading import Lock
+
+PROTOCOL_VERSION = 1
+
+
+class FarmError(Exception):
+    pass
+
+
+class Connection():
+    """
+    Socket that sends and reads messages, sending is thread safe.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = Lock()
+        self.reader = sock.makefile('r', encoding='utf-8', errors='replace', newline="\n")
+
+
+    def send(self, message):
+        """
+        Send a message, raises `OSError` if the connection is lost.
+        """
+
+        data = (json.dumps(message) + "\n").encode('utf-8')
+
+        with self.lock:
+            self.sock.sendall(data)
+
+
+    def read(self):
+        """
+        Yield received messages until the connection is closed.
+        """
+
+        try:
+
+            for line in self.reader:
+
+                if not line.strip():
+                    continue
+
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+
+                if isinstance(message, dict):
+                    yield message
+
+        except (OSError, ValueError):
+            return
+
+
+    def close(self):
+        """
+        Close the connection, readers of other threads stop.
+        """
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        try:
+            self.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,178 @@
+################################################################################
+## Render Journal
+##
+## Append-only log of a queue run: planned, started, saved and failed frames.
+## If kQueue or the machine dies mid-queue, the next render of the same preset
+## resumes from the journal instead of checking every output file.
+
+import os
+import json
+
+from time import time
+from hashlib import sha1
+from threading import Lock
+from pathlib import Path
+from .utils.filter_frames import FrameSet
+from . import store
+
+
+def get_key(*parts):
+    """
+    Key of project settings, frames rendered with other settings are not
+    resumed.
+    """
+
+    return sha1("\n".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def get_journal_file(preset):
+    """
+    Journal of the preset, unsaved presets share one.
+    """
+
+    name = sha1(str(preset.filename or "unsaved").encode('utf-8')).hexdigest()[:16]
+
+    return Path(store.journal_folder) / f'{name}.jsonl'
+
+
+def read_records(file):
+    """
+    Read journal records, a line torn by a crash is skipped.
+    """
+
+    records = []
+
+    try:
+        with open(file, 'r', encoding='utf-8', errors='replace') as f:
+
+            for line in f:
+
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    except OSError:
+        pass
+
+    return records
+
+
+def load_resume(file):
+    """
+    Get frames of an unfinished run: `{file : {'key' : key, 'saved' : {frame : [path, size]}}}`.
+    Empty if the last run has finished.
+    """
+
+    projects = {}
+
+    for record in read_records(file):
+        kind = record.get('type')
+
+        if kind == 'plan':
+            project = projects.get(record['file'])
+
+            if project is None or project['key'] != record.get('key'):
+                projects[record['file']] = { 'key' : record.get('key'), 'saved' : {} }
+
+        elif kind == 'saved':
+            project = projects.get(record.get('file'))
+
+            if project is not None:
+                project['saved'][record.get('frame')] = [record.get('path'), record.get('size')]
+
+        elif kind == 'end' and record.get('status') == 'finished':
+            projects = {}
+
+    return projects
+
+
+def is_complete(path, size):
+    """
+    Is the saved frame still there as it was written?
+    """
+
+    try:
+        return os.stat(path).st_size == size
+    except (OSError, TypeError):
+        return False
+
+
+class RenderJournal():
+    """
+    Journal of one render. Every record is flushed to disk, so it survives
+    a crash of the machine.
+    """
+
+    def __init__(self, file):
+        self.file = Path(file)
+        self.lock = Lock()
+        self.handle = None
+
+
+    def open(self, append=False):
+        """
+        Start a new journal, or continue the one of an unfinished run.
+        """
+
+        os.makedirs(self.file.parent, exist_ok=True)
+
+        self.handle = open(self.file, 'a' if append else 'w', encoding='utf-8')
+        self.write({ 'type' : 'run', 'preset' : str(store.preset.filename or "") })
+
+
+    def write(self, record):
+
+        with self.lock:
+
+            if self.handle is None:
+                return
+
+            record['time'] = time()
+
+            try:
+                self.handle.write(json.dumps(record) + "\n")
+                self.handle.flush()
+                os.fsync(self.handle.fileno())
+
+            except OSError:
+                pass
+
+
+    def plan(self, file, key, frames):
+        self.write({ 'type' : 'plan', 'file' : file, 'key' : key, 'frames' : str(FrameSet(frames)) })
+
+
+    def started(self, file, frame):
+        self.write({ 'type' : 'start', 'file' : file, 'frame' : frame })
+
+
+    def saved(self, file, frame, path):
+        """
+        Frame was written, its size tells a half-written frame later.
+        """
+
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = None
+
+        self.write({ 'type' : 'saved', 'file' : file, 'frame' : frame, 'path' : path, 'size' : size })
+
+
+    def failed(self, file, frame, reason):
+        self.write({ 'type' : 'failed', 'file' : file, 'frame' : frame, 'reason' : reason })
+
+
+    def close(self, status):
+        """
+        End the run, `finished` runs are not resumed.
+        """
+
+        self.write({ 'type' : 'end', 'status' : status })
+
+        with self.lock:
+
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
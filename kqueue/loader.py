@@ -1,204 +1,519 @@
 ################################################################################
 ## Blend Files Loader
 
-import subprocess
 import PyQt5.QtCore as qtc
 import json
 
 from os import makedirs
+from math import ceil
+from queue import Queue
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from .utils.pathutils import join
+from .utils import blendfile, fingerprint
 from .config import *
+from .orchestrator import get_orchestrator
 from . import store
 from .project.object import BlendProject
-from . import main, save_load
+from . import main, save_load, daemon
 
 
 class LoaderThread(qtc.QThread):
 
 
-    def __init__(self, *files):
+    def __init__(self, workers=LOADER_WORKERS, prefetch=False):
+        """
+        The thread keeps running and loads queued jobs.
+
+        `prefetch` - only fill the cache of queued files, don't touch the
+        projects list. Files that are queued already are skipped.
+        """
+
         super().__init__()
 
-        self.files = files
+        self.workers = max(1, int(workers))
+        self.prefetch = prefetch
+        self.jobs = Queue()
+
+        # Prefetched files that are queued or loading
+        self.pending = set()
+        self.lock = Lock()
+
+
+    def add_files(self, *files):
+        """
+        Queue files to load.
+        """
+
+        if self.prefetch:
+
+            with self.lock:
+                files = tuple(file for file in dict.fromkeys(files) if file not in self.pending)
+                self.pending.update(files)
+
+            if not files:
+                return
+
+        self.jobs.put(files)
+
+
+    def stop(self):
+        self.jobs.put(None)
 
 
     def run(self):
         preset = store.preset
         mw = store.mw
 
-        if preset.is_adding_projects:
-            return
-
         makedirs(store.temp_folder, exist_ok=True)
 
-        preset.is_adding_projects = True
-        mw.update_widgets.emit()
+        while True:
+            job = self.jobs.get()
 
-        # Load cache
-        cache = save_load.load_cache()
+            if job is None:
+                break
 
-        files = [ join(file) for file in self.files if file.endswith(".blend")]
-        loaded_projects_list = []
-        need_save = False
+            files = list(job)
+
+            # Files dropped meanwhile share the same workers
+            while not self.jobs.empty():
+                job = self.jobs.get()
 
-        for i, file in enumerate(files):
+                if job is None:
+                    self.jobs.put(None)
+                    break
 
-            if not is_file_openable(file):
+                files += job
+
+            if self.prefetch:
+                self.prefetch_files(files)
                 continue
 
-            mod_time = int(Path(file).stat().st_mtime)
+            preset.is_adding_projects = True
+            mw.update_widgets.emit()
 
-            # Update the project that already exists
-            project = None
+            try:
+                self.load(files)
 
-            for p in preset.project_list:
+            except Exception as e:
+                main.log(f'Exception during loading: {repr(e)}')
 
-                if file != p.file:
-                    continue
+            preset.is_adding_projects = not self.jobs.empty()
 
-                project = p
-                break
+            mw.update_list.emit(False)
+            mw.update_widgets.emit()
 
-            if not loaded_projects_list:
-                print("------------------------")
-                main.log("Loading new projects...")
+        save_load.close_cache_connection()
 
-            # Get cached project data
-            if file in cache and (cache[file]['mod_time'] == mod_time):
-                main.log(f'({i + 1}/{len(files)}) Loading cache: {file}')
-                data = cache[file]
 
-            # Get project data
-            else:
-                main.log(f'({i + 1}/{len(files)}) Reading project: {file}')
+    def prefetch_files(self, files):
+        """
+        Fill the cache of files, they can be queued again afterwards.
+        """
 
-                BATCH = f"""
-@CHCP 65001 > NUL
-blender "{file}" --factory-startup --background  --python "{store.get_data_py.resolve()}" "{store.bridge_file.resolve()}"
-"""
+        try:
+            self.load(files)
 
-                with open(store.get_data_bat, 'w') as f:
-                    f.write(BATCH.strip())
+        except Exception as e:
+            main.log(f'Exception during prefetching: {repr(e)}')
 
-                process = subprocess.Popen([store.get_data_bat.resolve()],
-                                        # stderr=subprocess.STDOUT,
-                                        # stdout=subprocess.PIPE,
-                                        # stdin=subprocess.PIPE,
-                                        #    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP, #DETACHED_PROCESS
-                                        #    creationflags=subprocess.DETACHED_PROCESS, #DETACHED_PROCESS
-                                        #    preexec_fn=os.setsid,
-                                        cwd=join(Path(preset.blender_exe).parent),
-                                        shell=True)
+        with self.lock:
+            self.pending.difference_update(files)
 
-                process.wait()
 
-                if not store.bridge_file.exists():
-                    main.log(f'Could not fetch project data: {file} | Bridge: {store.bridge_file}')
-                    return
+    def load(self, files):
+        """
+        Load project data of files and fill in their projects.
+        """
 
-                # Read project data
-                with open(store.bridge_file, 'r') as f:
-                    data = json.load(f)
+        preset = store.preset
+        mw = store.mw
+
+        files = [ join(file) for file in files if file.endswith(".blend")]
+        files = list(dict.fromkeys(files))
 
-                # Write cache project data
-                data['mod_time'] = mod_time
+        # Placeholders of files we can't read
+        for file in files:
+
+            if Path(file).exists() and is_file_openable(file):
+                continue
 
-                # Update cache
+            main.log(f'Could not open project: {file}')
+            self.remove_placeholder(file)
+
+        files = [ file for file in files if Path(file).exists() and is_file_openable(file) ]
+
+        loaded_projects_list = []
+        need_save = False
+
+        # Load cache
+        cache = {}
+
+        for file in files:
+            data = save_load.load_cache_entry(file)
+
+            if data is not None:
                 cache[file] = data
-                save_load.save_cache(cache)
-
-            # Unpack project data
-            loaded_project = BlendProject(
-                file,
-                frame_start=data['frame_start'],
-                frame_end=data['frame_end'],
-                scene=data['scene'],
-                scene_list=data['scene_list'],
-                camera=data['camera'],
-                camera_list=data['camera_list'],
-                resolution_x=data['resolution_x'],
-                resolution_y=data['resolution_y'],
-                resolution_percentage=data['resolution_percentage'],
-                render_filepath=data['render_filepath'],
-                file_format=data['file_format'],
-                use_persistent_data=data['use_persistent_data'],
-                use_adaptive_sampling=data['use_adaptive_sampling'],
-                samples=data['samples'],
-                denoiser=data['denoiser'],
-                denoising_use_gpu=data['denoising_use_gpu'],
-                denoising_input_passes=data['denoising_input_passes'],
-                denoising_prefilter=data['denoising_prefilter'],
-                markers=data.get('markers', []),
-                mod_time=mod_time,
-            )
-
-            if project is None:
-                preset.project_list.append(loaded_project)
-                need_save = True
 
+        # Fingerprints, only files that were touched get hashed.
+        def get_fingerprint(file):
+            previous = cache[file].get('fingerprint') if file in cache else None
+            return fingerprint.get_fingerprint(file, previous=previous)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            fingerprints = dict(zip(files, pool.map(get_fingerprint, files)))
+
+        # Every fetched project is put here as soon as its record arrives.
+        results = Queue()
+        pending = []
+
+        for file in files:
+            cached = cache.get(file, {}).get('fingerprint') or {}
+
+            # Get cached project data, entries from older versions miss some keys.
+            # Changed libraries may change project data too, read it again then.
+            if (cached.get('hash') == fingerprints[file]['hash'] and blendfile.is_complete(cache[file])
+                    and fingerprint.is_same_dependencies(cache[file].get('dependency_states'))):
+                results.put((file, cache[file], None))
             else:
+                pending.append(file)
 
-                if project.frames != loaded_project.frames:
-                    project.frames_override = loaded_project.frames_override
-
-                for name in [
-                    'frames',
-                    'scene',
-                    'scene_list',
-                    'camera',
-                    'camera_list',
-                    'resolution_x',
-                    'resolution_y',
-                    'resolution_percentage',
-                    'use_persistent_data',
-                    'render_filepath',
-                    'file_format',
-                    'use_adaptive_sampling',
-                    'samples',
-                    'denoiser',
-                    'denoising_use_gpu',
-                    'denoising_input_passes',
-                    'denoising_prefilter',
-                    'markers',
-                    'mod_time',
-                ]:
-
-                    if not hasattr(loaded_project, name):
-                        continue
-
-                    new_value = getattr(loaded_project, name)
-                    old_value = getattr(project, name)
-
-                    if new_value == old_value:
-                        continue
-
-                    setattr(project, name, new_value)
-
-                    if name not in ['mod_time']:
-                        need_save = True
-
-                        print(name, old_value, "=>", new_value)
+        # Read project data from the file blocks, launch Blender only for
+        # projects we could not fully decode.
+        if LOADER_READ_BLEND and pending:
 
-            mw.update_list.emit(False)
-            mw.update_widgets.emit()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                decoded = list(pool.map(blendfile.read_blend_data, pending))
+
+            left = []
+
+            for file, data in zip(pending, decoded):
+
+                if blendfile.is_complete(data):
+                    results.put((file, data, None))
+                else:
+                    left.append(file)
+
+            pending = left
+
+        # Split files into batches, one background Blender reads one batch.
+        workers = min(self.workers, len(pending)) or 1
+        size = max(1, min(LOADER_BATCH_SIZE, ceil(len(pending) / workers)))
+        batches = [ pending[i:i + size] for i in range(0, len(pending), size) ]
+
+        # Every worker slot owns its own bridge, list and batch files.
+        slots = Queue()
+
+        for slot in range(workers):
+            slots.put(slot)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+
+            for batch in batches:
+                pool.submit(self.fetch_projects_data, batch, slots, results)
+
+            for _ in range(len(files)):
+                file, data, error = results.get()
+                fp = fingerprints[file]
+
+                if not loaded_projects_list and not self.prefetch:
+                    print("------------------------")
+                    main.log("Loading new projects...")
+
+                if error is not None:
+                    main.log(f'Could not fetch project data: {file} | {error}')
+
+                    if not self.prefetch:
+                        self.remove_placeholder(file)
+                        mw.update_list.emit(False)
+
+                    continue
+
+                n = len(loaded_projects_list) + 1
+
+                if data is cache.get(file):
+                    main.log(f'({n}/{len(files)}) Loading cache: {file}')
+
+                    # The file was touched, but its content is the same
+                    if data['fingerprint'] != fp:
+                        data['fingerprint'] = fp
+                        save_load.save_cache_entry(file, data)
+
+                else:
+                    main.log(f'({n}/{len(files)}) Reading project: {file}')
+
+                    # Write cache project data
+                    data['fingerprint'] = fp
+                    data['dependencies'] = sorted({ join(path) for path in data.get('dependencies', []) })
+                    data['dependency_states'] = fingerprint.get_dependency_states(data['dependencies'])
+
+                    # Update cache
+                    cache[file] = data
+                    save_load.save_cache_entry(file, data)
+
+                if self.prefetch:
+                    continue
+
+                loaded_project, changed = self.apply_project_data(file, data, fp)
+                need_save = need_save or changed
 
-            loaded_projects_list.append(loaded_project)
+                mw.update_list.emit(False)
+                mw.update_widgets.emit()
+
+                loaded_projects_list.append(loaded_project)
+
+        if self.prefetch:
+            return
 
         if loaded_projects_list:
 
             if need_save:
                 preset.set_need_save()
-                main.log(f'All projects loaded!')
+                main.log('All projects loaded!')
 
             else:
-                main.log(f'No new data loaded.')
+                main.log('No new data loaded.')
+
+
+    def fetch_projects_data(self, files, slots, results):
+        """
+        Read the data of several projects with one background Blender.
+
+        `slots` - queue of free worker slots, each slot owns its own
+        bridge, list and batch files.
+        `results` - queue that receives `(file, data, error)` for every
+        file as soon as Blender writes its record.
+        """
+
+        preset = store.preset
+        slot = slots.get()
+        left = list(files)
+
+        # Ask the warm Blender of this slot
+        if LOADER_USE_DAEMON:
+
+            try:
+
+                for file in files:
+
+                    try:
+                        results.put((file, daemon.get_daemon(slot).inspect(file), None))
+                    except daemon.DaemonError as e:
+                        results.put((file, None, str(e)))
+
+                    left.remove(file)
+
+            finally:
+
+                for file in left:
+                    results.put((file, None, "Loader error."))
+
+                slots.put(slot)
+
+            return
+
+        try:
+            bridge_file = get_slot_file(store.bridge_file.with_suffix(".jsonl"), slot)
+            files_file = get_slot_file(store.bridge_file.with_suffix(".txt"), slot)
+            batch_file = get_slot_file(store.get_data_bat, slot)
+
+            if bridge_file.exists():
+                bridge_file.unlink()
+
+            with open(files_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(files))
+
+            BATCH = f"""
+@CHCP 65001 > NUL
+blender --factory-startup --background --python "{store.get_data_py.resolve()}" -- "{bridge_file.resolve()}" "{files_file.resolve()}"
+"""
+
+            with open(batch_file, 'w') as f:
+                f.write(BATCH.strip())
+
+            # Blender prints a line after every record it writes and the
+            # records are read then, `None` means it has exited.
+            wakeups = Queue()
+
+            def on_line(line):
+
+                if line.startswith('Data fetched:'):
+                    wakeups.put(True)
+
+            get_orchestrator().spawn([batch_file.resolve()],
+                                     on_line=on_line,
+                                     on_exit=lambda code: wakeups.put(None),
+                                     cwd=join(Path(preset.blender_exe).parent),
+                                     stdin=False)
+
+            # Stream records while Blender is still reading the next files.
+            position = 0
+
+            while True:
+                done = wakeups.get() is None
+
+                if bridge_file.exists():
+
+                    with open(bridge_file, 'r', encoding='utf-8') as f:
+                        f.seek(position)
+
+                        while line := f.readline():
+
+                            if not line.endswith("\n"):
+                                break
+
+                            position = f.tell()
+                            record = json.loads(line)
+                            file = record['file']
+
+                            if file not in left:
+                                continue
+
+                            left.remove(file)
+
+                            if 'data' in record:
+                                results.put((file, record['data'], None))
+                            else:
+                                results.put((file, None, record.get('error')))
+
+                if done:
+                    break
+
+        except Exception as e:
+
+            for file in left:
+                results.put((file, None, repr(e)))
+
+            left = []
+
+        finally:
+
+            for file in left:
+                results.put((file, None, f'Bridge: {bridge_file}'))
+
+            slots.put(slot)
+
+
+    def remove_placeholder(self, file):
+        """
+        Remove the placeholder of a project that could not be loaded.
+        """
+
+        for project in list(store.preset.project_list):
+
+            if project.file == file and project.is_loading:
+                store.preset.project_list.remove(project)
+
+
+    def apply_project_data(self, file, data, fp):
+        """
+        Fill in the placeholder or update the project that already exists.
+
+        Returns the loaded project and whether a save is needed.
+        """
+
+        preset = store.preset
+        need_save = False
+
+        # Update the project that already exists
+        project = None
+
+        for p in preset.project_list:
+
+            if file != p.file:
+                continue
+
+            project = p
+            break
+
+        # Unpack project data
+        loaded_project = BlendProject(
+            file,
+            frame_start=data['frame_start'],
+            frame_end=data['frame_end'],
+            scene=data['scene'],
+            scene_list=data['scene_list'],
+            camera=data['camera'],
+            camera_list=data['camera_list'],
+            resolution_x=data['resolution_x'],
+            resolution_y=data['resolution_y'],
+            resolution_percentage=data['resolution_percentage'],
+            render_filepath=data['render_filepath'],
+            file_format=data['file_format'],
+            use_persistent_data=data['use_persistent_data'],
+            use_adaptive_sampling=data['use_adaptive_sampling'],
+            samples=data['samples'],
+            denoiser=data['denoiser'],
+            denoising_use_gpu=data['denoising_use_gpu'],
+            denoising_input_passes=data['denoising_input_passes'],
+            denoising_prefilter=data['denoising_prefilter'],
+            markers=data.get('markers', []),
+            fingerprint=fp,
+            scenes=data.get('scenes'),
+            dependency_states=data.get('dependency_states'),
+        )
+
+        # The placeholder was removed while loading
+        if project is None:
+            return loaded_project, need_save
+
+        if project.is_loading:
+            project.is_loading = False
+            need_save = True
+
+        if project.frames != loaded_project.frames:
+            project.frames_override = loaded_project.frames_override
+
+        for name in [
+            'frames',
+            'scene',
+            'scene_list',
+            'camera',
+            'camera_list',
+            'resolution_x',
+            'resolution_y',
+            'resolution_percentage',
+            'use_persistent_data',
+            'render_filepath',
+            'file_format',
+            'use_adaptive_sampling',
+            'samples',
+            'denoiser',
+            'denoising_use_gpu',
+            'denoising_input_passes',
+            'denoising_prefilter',
+            'markers',
+            'scenes',
+            'fingerprint',
+            'dependency_states',
+        ]:
+
+            if not hasattr(loaded_project, name):
+                continue
+
+            new_value = getattr(loaded_project, name)
+            old_value = getattr(project, name)
+
+            if new_value == old_value:
+                continue
+
+            setattr(project, name, new_value)
+
+            if name not in ['fingerprint', 'dependency_states']:
+                need_save = True
+
+                print(name, old_value, "=>", new_value)
+
+        return loaded_project, need_save
 
-        preset.is_adding_projects = False
 
-        mw.update_list.emit(False)
-        mw.update_widgets.emit()
+def get_slot_file(path, slot):
+    """
+    Get a file path that belongs to the worker slot: `data.json` => `data_0.json`.
+    """
 
+    return path.with_name(f'{path.stem}_{slot}{path.suffix}')
 
 
 def is_file_openable(file_path):
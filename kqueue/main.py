@@ -3,7 +3,7 @@
 
 import os
 import ctypes
-import subprocess
+import asyncio
 
 import PyQt5.QtWidgets as qtw
 import PyQt5.QtGui as qtg
@@ -13,18 +13,25 @@ from PyQt5.QtCore import Qt
 
 from os import getcwd, makedirs
 from sys import exit
-from time import time, sleep
+from time import time
 from pathlib import Path
 from psutil import Process
-from threading import Thread
+from threading import Thread, Event
 
 from .utils import monitor, utils, gpu, pathutils
+from .utils.log_writer import LogWriter
 from .project.widgets import QBlendProject, QBlendProjectSettings
+from .project.object import BlendProject
 
 from .render import RenderThread
+from .plan import compile_plan, get_plan_file
 from .loader import LoaderThread
+from .watcher import WatcherThread
+from .farm.coordinator import FarmCoordinator
+from .farm.protocol import FarmError
+from .orchestrator import get_orchestrator
 from .config import *
-from . import store, save_load
+from . import store, save_load, daemon
 
 from .widgets.QPushButton import QPushButton
 from .widgets.QComboBox import QComboBox
@@ -50,13 +57,18 @@ os.environ["QT_SCALE_FACTOR"] = f'{factor}'
 # Init path variables
 store.working_dir = pathutils.join(getcwd() + "/kqueue")
 store.cache_file = Path(pathutils.join(getcwd(), CACHE_FILE))
+store.cache_db = Path(pathutils.join(getcwd(), CACHE_DB))
 store.crash_file = Path(pathutils.join(getcwd(), CRASH_FILE))
 store.persistent_file = Path(pathutils.join(getcwd(), PERSISTENT_FILE))
 store.bridge_file = Path(pathutils.join(getcwd(), BRIDGE_FILE))
 store.get_data_py = Path(pathutils.join(getcwd(), GET_DATA_PY))
+store.render_driver_py = Path(pathutils.join(getcwd(), RENDER_DRIVER_PY))
+store.journal_folder = Path(pathutils.join(getcwd(), JOURNAL_FOLDER))
 store.get_data_bat = Path(pathutils.join(getcwd(), GET_DATA_BAT))
 store.temp_folder = Path(pathutils.join(getcwd(), TEMP_FOLDER))
 
+log_writer = LogWriter(store.crash_file, on_line=lambda line: store.mw.log.emit(line) if store.mw else None)
+
 print(store.get_data_bat, store.get_data_bat.exists())
 
 
@@ -76,15 +88,31 @@ class QueuePreset():
         # List of project objects.
         self.project_list = []
 
-        # Process object.
-        self.process = None
+        # Blender processes that are rendering.
+        self.processes = []
 
         # Status.
         self.blender_status = 'READY_TO_RENDER'
 
+        # Set while rendering stops or is finished, wakes up instances that
+        # wait to start Blender again.
+        self.stopping = Event()
+
         # Are we currently loading new blender projects?
         self.is_adding_projects = False
 
+        # Thread that loads queued projects.
+        self.loader_thread = None
+
+        # Render farm coordinator, `None` unless render agents are accepted.
+        self.farm = None
+
+        # Snapshot of the queue the last render started from, see `plan.py`.
+        self.plan = None
+
+        # Loader that fills the cache of changed projects.
+        self.prefetch_thread = None
+
         # Are we currently shutting down the PC?
         self.is_shutting_down = False
 
@@ -111,6 +139,10 @@ class QueuePreset():
         Get total frames number.
         """
 
+        # Frames of the queue were counted when rendering started
+        if self.plan is not None and self.is_status('RENDERING', 'RENDERING_STOPPING'):
+            return self.plan.frame_count
+
         return sum([ len(p.get_frames_list()) for p in self.project_list if p.is_renderable() ])
 
 
@@ -136,14 +168,15 @@ class QueuePreset():
         self.global_render_start_time = time()
         self.render_start_time = time()
         self.render_avg_time = []
-        self.global_frames = self.get_global_frames_number()
+        self.global_frames = self.plan.frame_count if self.plan is not None else self.get_global_frames_number()
         self.global_frame = 0
         self.project_frames = 0
         self.project_frame = 0
+        self.project_progress = {}
         self.renders_list = []
 
-        self.frame_flag = 0
-        self.last_frame_flag = None
+        # file => frames that failed to render
+        self.failed_frames = {}
 
         if gui:
             mw.w_gProgressBar.setValue(0)
@@ -160,6 +193,11 @@ class QueuePreset():
             raise Exception(f'Unknown status "{value}".')
 
         self.blender_status = value
+
+        if value in ('RENDERING_STOPPING', 'RENDERING_FINISHED'):
+            self.stopping.set()
+        else:
+            self.stopping.clear()
         # if gui: log(f'Status: {self.blender_status}', developer=True)
 
 
@@ -288,6 +326,12 @@ class QueuePreset():
 
         log(f'Loaded: {filename}')
 
+        # Projects that were saved before their data was loaded
+        loading_files = [ p.file for p in self.project_list if p.is_loading ]
+
+        if loading_files:
+            self.add_projects(*loading_files)
+
         # Save persistent
         persistent_data = save_load.load_persistent()
         persistent_data['last_project_filename'] = filename
@@ -323,11 +367,29 @@ class QueuePreset():
             log("Locate blender.exe first!")
             return
 
-        if self.is_adding_projects:
+        files = [ pathutils.join(file) for file in files if file.endswith(".blend") ]
+
+        if not files:
             return
 
-        self.loader_thread = LoaderThread(*files)
-        self.loader_thread.start()
+        # Show new projects right away, their data fills in later
+        known_files = { p.file for p in self.project_list }
+
+        for file in files:
+
+            if file in known_files:
+                continue
+
+            self.project_list.append(BlendProject.placeholder(file))
+            known_files.add(file)
+
+        mw.update_list.emit(False)
+
+        if self.loader_thread is None or not self.loader_thread.isRunning():
+            self.loader_thread = LoaderThread()
+            self.loader_thread.start()
+
+        self.loader_thread.add_files(*files)
 
 
     def reload_projects(self):
@@ -347,6 +409,37 @@ class QueuePreset():
         self.add_projects(*files)
 
 
+    def prefetch_projects(self, *files):
+        """
+        Fill the cache of changed projects in background, the watcher signals
+        changed files to the GUI thread.
+        """
+
+        if not self.blender_exe:
+            return
+
+        if self.prefetch_thread is None or not self.prefetch_thread.isRunning():
+            self.prefetch_thread = LoaderThread(prefetch=True)
+            self.prefetch_thread.start()
+
+        self.prefetch_thread.add_files(*files)
+
+
+    def update_watcher(self):
+        """
+        Watch project files, their dependencies and render output folders.
+        """
+
+        if not store.watcher:
+            return
+
+        files = [ p.file for p in self.project_list ]
+        folders = [ Path(p.get_render_filepath()).parent for p in self.project_list if not p.is_loading ]
+        dependencies = { path for p in self.project_list for path in p.dependency_states }
+
+        store.watcher.set_paths(files, folders, dependencies)
+
+
     def get_outdated_projects(self):
         """
         """
@@ -375,6 +468,10 @@ class QueuePreset():
 
         mw.update_gpu_monitor.emit()
 
+        # The watcher updates widgets when files change
+        if store.watcher and store.watcher.isRunning():
+            return
+
         if not self.is_status('RENDERING', 'RENDERING_STOPPING'):
             mw.update_widgets.emit()
 
@@ -387,6 +484,15 @@ class QueuePreset():
         if not self.is_status('READY_TO_RENDER') or not preset.project_list:
             return
 
+        self.plan = compile_plan(self)
+
+        if RENDER_DRY_RUN:
+            file = get_plan_file(self)
+            makedirs(file.parent, exist_ok=True)
+            self.plan.export(file)
+            log(f'Dry run, {self.plan.frame_count} frames of {len(self.plan.projects)} projects were planned: {file}')
+            return
+
         self.init_render_variables(gui=True)
 
         self.render_thread = RenderThread() #qtc.QThread()
@@ -407,20 +513,66 @@ class QueuePreset():
         Stop rendering process.
         """
 
-        if not self.is_status('RENDERING') or not self.process:
-            return
-
-        if self.is_status('RENDERING_STOPPING'):
+        # Blender may be between jobs or waiting for a retry, instances
+        # check the status before they start it again.
+        if not self.is_status('RENDERING'):
             return
 
         self.set_status('RENDERING_STOPPING')
         log("Stopping rendering...")
 
-        for proc in Process(self.process.pid).children(recursive=True):
-            proc.terminate()
+        for process in list(self.processes):
+
+            try:
+                for proc in Process(process.pid).children(recursive=True):
+                    proc.terminate()
+
+                process.terminate()
 
-        self.process.terminate()
-        self.process = None
+            except Exception:
+                pass
+
+        self.processes = []
+
+        if self.farm is not None:
+            self.farm.stop_jobs()
+
+
+    def start_coordinator(self):
+        """
+        Accept render agents of the LAN render farm.
+        """
+
+        if self.farm is not None:
+            return
+
+        farm = FarmCoordinator()
+
+        try:
+            farm.start()
+
+        except OSError as e:
+            log(f'Render farm: unable to listen on port {farm.port}: {e}')
+            return
+
+        except FarmError as e:
+            log(f'Render farm: {e}')
+            return
+
+        self.farm = farm
+        log(f'Render farm: waiting for agents on port {farm.port}.')
+
+
+    def stop_coordinator(self):
+        """
+        Disconnect render agents.
+        """
+
+        if self.farm is None:
+            return
+
+        self.farm.stop()
+        self.farm = None
 
 
     def shutdown(self, delay=15.0):
@@ -431,7 +583,7 @@ class QueuePreset():
         if mw.w_onComplete.currentText() != 'SHUTDOWN':
             return
 
-        def do_shutdown(delay):
+        async def do_shutdown(delay):
             self.is_shutting_down = True
             mw.update_widgets.emit()
             monitor.screen_on()
@@ -440,7 +592,7 @@ class QueuePreset():
                 d = delay - i
                 log(f'Shutting down in {d:.0f} {"seconds" if d > 1 else "second"}.')
                 mw.update_widgets.emit()
-                sleep(1)
+                await asyncio.sleep(1)
 
                 if not self.is_shutting_down:
                     log("Shutting down was cancelled.")
@@ -449,12 +601,12 @@ class QueuePreset():
             log("Shutting down...")
 
             if not DEV_MODE:
-                subprocess.call(["shutdown", "-s", "-t", "15"])
+                process = await asyncio.create_subprocess_exec("shutdown", "-s", "-t", "15")
+                await process.wait()
 
             mw.update_widgets.emit()
 
-        t = Thread(target=do_shutdown, args=(delay,))
-        t.start()
+        get_orchestrator().run(do_shutdown(delay))
 
 
     def cancel_shutdown(self):
@@ -1073,15 +1225,21 @@ class MainWindow(qtw.QMainWindow):
 
             w_project.set_filename(project.file)
             w_project.set_active(project.active)
-            w_project.set_frames(project.get_frames())
             w_project.set_tooltip(project.get_notes())
 
-            x, y = project.get_final_resolution()
-            w_project.set_resolution(f'{x}x{y}')
+            if project.is_loading:
+                w_project.set_loading()
+
+            else:
+                w_project.set_frames(project.get_frames())
+
+                x, y = project.get_final_resolution()
+                w_project.set_resolution(f'{x}x{y}')
+
+                w_project.set_samples(project.get_samples())
+                w_project.set_camera(project.get_camera())
+                w_project.set_render_filepath(project.get_render_filepath())
 
-            w_project.set_samples(project.get_samples())
-            w_project.set_camera(project.get_camera())
-            w_project.set_render_filepath(project.get_render_filepath())
             w_project.update_widgets()
 
             item = qtw.QListWidgetItem(self.w_listOfProjects)
@@ -1123,6 +1281,8 @@ class MainWindow(qtw.QMainWindow):
         if old_files != new_files:
             preset.set_need_save()
 
+        preset.update_watcher()
+
         max_cycles = 1000
 
         while self.w_listOfProjects.verticalScrollBar().value() != old_value and max_cycles > 0:
@@ -1173,7 +1333,7 @@ class MainWindow(qtw.QMainWindow):
 
         self.w_startRender.setEnabled(bool(preset.blender_exe and not preset.is_status('RENDERING') and preset.project_list and preset.get_global_frames_number()))
         self.w_stopRender.setEnabled(preset.is_status('RENDERING') and not preset.is_status('RENDERING_STOPPING'))
-        self.w_listOfProjects.setEnabled(bool(not preset.is_adding_projects and not preset.is_status('RENDERING')))
+        self.w_listOfProjects.setEnabled(bool(not preset.is_status('RENDERING')))
         self.w_cancelShutdown.setEnabled(bool(preset.is_shutting_down))
         self.w_openRender.setEnabled(bool(preset.renders_list))
         self.w_openRenderFolder.setEnabled(bool(preset.renders_list))
@@ -1248,32 +1408,10 @@ def log(*args, developer=False, write=True, open_file=False):
     if not line:
         return
 
-    if not line.startswith('WARN '):
-        mw.log.emit(line)
-
-    print(line)
-
-    if write:
-        done = False
-        retries = 100
-
-        while retries > 0:
-
-            try:
-                with open(store.crash_file, 'a', encoding='utf-8') as f:
-                    f.write(f"\n{line}")
-
-                done = True
-
-            except:
-                retries -= 1
-
-            if done:
-                break
-
-            sleep(.01)
+    log_writer.write(line, gui=not line.startswith('WARN '), file=write)
 
     if open_file:
+        log_writer.flush()
         pathutils.open_image(store.crash_file)
 
 
@@ -1283,6 +1421,7 @@ ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(APPID)
 store.app = app = qtw.QApplication([])
 store.mw = mw = MainWindow()
 store.preset = preset = QueuePreset()
+store.watcher = WatcherThread()
 
 
 app.setStyleSheet('''
@@ -1672,18 +1811,13 @@ def __start_periodic(interval=1.0):
     Start periodic function.
     """
 
-    def loop():
-
-        while True:
-            preset = store.preset
-
-            if preset:
-                preset.periodic()
+    def periodic():
+        preset = store.preset
 
-            sleep(interval)
+        if preset:
+            preset.periodic()
 
-    t = Thread(target=loop, daemon=True)
-    t.start()
+    get_orchestrator().every(interval, periodic, blocking=True)
 
 
 ############################################################################
@@ -1697,6 +1831,16 @@ def main():
 
         __start_periodic()
 
+        if FARM_COORDINATOR:
+            preset.start_coordinator()
+
+        store.watcher.changed.connect(lambda path: mw.update_widgets.emit())
+        store.watcher.prefetch.connect(lambda path: preset.prefetch_projects(path))
+        store.watcher.start()
+
+        # Forget cached data of deleted projects
+        Thread(target=save_load.prune_cache, daemon=True).start()
+
         persistent_data = save_load.load_persistent()
         last_project_filename = persistent_data.get('last_project_filename')
 
@@ -1704,7 +1848,23 @@ def main():
             preset.load_from(last_project_filename)
 
         mw.show()
-        exit(app.exec_())
+        code = app.exec_()
+
+        store.watcher.stop()
+        store.watcher.wait()
+
+        if preset.loader_thread is not None:
+            preset.loader_thread.stop()
+
+        if preset.prefetch_thread is not None:
+            preset.prefetch_thread.stop()
+
+        daemon.stop_all()
+        preset.stop_coordinator()
+        get_orchestrator().stop()
+        log_writer.flush()
+
+        exit(code)
 
     except Exception as e:
         log(f'Critical Exception: {e}', open_file=True)
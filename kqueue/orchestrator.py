@@ -0,0 +1,315 @@
+################################################################################
+## Orchestrator
+##
+## One asyncio event loop on its own thread owns the Blender subprocesses,
+## reads their output as streams and runs the timers, nothing polls or sleeps
+## while idle. Qt keeps its own loop: Qt code and worker threads call in with
+## thread-safe methods, and callbacks here emit Qt signals, which Qt queues
+## to the GUI thread.
+
+import asyncio
+import subprocess
+
+from threading import Thread, Lock, get_ident
+
+# Output lines of Blender can be long, e.g. echoed frame lists
+STREAM_LIMIT = 1 << 20
+
+
+class AsyncProcess():
+    """
+    Subprocess owned by the orchestrator with the `Popen` methods kQueue uses,
+    so worker threads can wait for it and stop it.
+    """
+
+    def __init__(self, orchestrator, process, encoding):
+        self.orchestrator = orchestrator
+        self.process = process
+        self.pid = process.pid
+        self.stdin = ProcessInput(self, encoding)
+
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+
+    def poll(self):
+        return self.process.returncode
+
+
+    def wait(self, timeout=None):
+        """
+        Wait for the exit, raises `subprocess.TimeoutExpired` on timeout.
+        """
+
+        future = self.orchestrator.run(self.process.wait())
+
+        try:
+            return future.result(timeout)
+
+        except TimeoutError:
+            future.cancel()
+            raise subprocess.TimeoutExpired(self.pid, timeout)
+
+
+    def send_signal(self, name):
+
+        def send():
+
+            if self.process.returncode is None:
+
+                try:
+                    getattr(self.process, name)()
+                except ProcessLookupError:
+                    pass
+
+        self.orchestrator.call(send)
+
+
+    def kill(self):
+        self.send_signal('kill')
+
+
+    def terminate(self):
+        self.send_signal('terminate')
+
+
+class ProcessInput():
+    """
+    Text stdin of an async process, `write` returns when the data is sent.
+    """
+
+    def __init__(self, process, encoding):
+        self.process = process
+        self.encoding = encoding
+
+
+    def write(self, text):
+        stdin = self.process.process.stdin
+
+        async def write():
+            stdin.write(text.encode(self.encoding))
+            await stdin.drain()
+
+        try:
+            self.process.orchestrator.run(write()).result()
+        except (ConnectionError, RuntimeError) as e:
+            raise OSError(str(e))
+
+
+    def flush(self):
+        pass
+
+
+class Periodic():
+    """
+    Handle of a repeated call, `cancel` stops it.
+    """
+
+    def __init__(self, orchestrator, task):
+        self.orchestrator = orchestrator
+        self.task = task
+
+
+    def cancel(self):
+        self.orchestrator.call(self.task.cancel)
+
+
+class Orchestrator():
+    """
+    Event loop thread.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = Lock()
+
+        # Subprocesses that didn't exit yet, used only in the loop
+        self.processes = set()
+
+
+    def start(self):
+
+        with self.lock:
+
+            if self.loop is not None:
+                return self.loop
+
+            # The default loop on Windows is the proactor one, it supports
+            # subprocess pipes.
+            self.loop = asyncio.new_event_loop()
+            self.thread = Thread(target=self.loop.run_forever, daemon=True)
+            self.thread.start()
+
+            return self.loop
+
+
+    def is_loop_thread(self):
+        return self.thread is not None and self.thread.ident == get_ident()
+
+
+    def run(self, coroutine):
+        """
+        Run a coroutine in the loop, returns a `concurrent.futures.Future`.
+        """
+
+        loop = self.start()
+
+        if self.is_loop_thread():
+            coroutine.close()
+            raise RuntimeError("Blocking call from the orchestrator loop.")
+
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+
+    def call(self, func, *args):
+        """
+        Call a function in the loop soon.
+        """
+
+        self.start().call_soon_threadsafe(func, *args)
+
+
+    def spawn(self, args, on_line=None, on_exit=None, cwd=None, encoding='utf-8', stdin=True):
+        """
+        Start a subprocess, returns `AsyncProcess`.
+
+        `on_line` - called in the loop with every output line (stderr too).
+        `on_exit` - called in the loop with the return code.
+        """
+
+        async def create():
+            process = await asyncio.create_subprocess_exec(
+                *[ str(a) for a in args ],
+                stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                cwd=cwd,
+                limit=STREAM_LIMIT,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+            )
+
+            self.processes.add(process)
+            asyncio.get_running_loop().create_task(self.read(process, on_line, on_exit, encoding))
+
+            return process
+
+        return AsyncProcess(self, self.run(create()).result(), encoding)
+
+
+    async def read(self, process, on_line, on_exit, encoding):
+        """
+        Pass output lines of a process until it exits.
+        """
+
+        while True:
+
+            try:
+                data = await process.stdout.readuntil(b'\n')
+
+            except asyncio.IncompleteReadError as e:
+                # Last line without a newline
+                data = e.partial
+
+            except asyncio.LimitOverrunError as e:
+                # Longer than the limit, pass it in parts
+                data = await process.stdout.read(max(1, e.consumed))
+
+            if not data:
+                break
+
+            if on_line is not None:
+                # Universal newlines like text mode `Popen`
+                on_line(data.decode(encoding, errors='replace').replace('\r\n', '\n'))
+
+        code = await process.wait()
+        self.processes.discard(process)
+
+        if on_exit is not None:
+            on_exit(code)
+
+
+    def every(self, interval, func, blocking=False):
+        """
+        Call `func` every `interval` seconds until it returns `False`.
+
+        `blocking` - run it on a worker thread, it may wait for something.
+        """
+
+        async def repeat():
+            loop = asyncio.get_running_loop()
+
+            while True:
+                await asyncio.sleep(interval)
+
+                try:
+
+                    if blocking:
+                        result = await loop.run_in_executor(None, func)
+                    else:
+                        result = func()
+
+                except Exception as e:
+                    print(f'Periodic call failed: {repr(e)}')
+                    result = None
+
+                if result is False:
+                    break
+
+        return Periodic(self, self.run(self.create_task(repeat())).result())
+
+
+    async def create_task(self, coroutine):
+        return asyncio.get_running_loop().create_task(coroutine)
+
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the loop, processes that are still running are killed. Waits
+        for the loop thread at most `timeout` seconds.
+        """
+
+        with self.lock:
+            loop, self.loop = self.loop, None
+            thread = self.thread
+
+        if loop is None:
+            return
+
+        def shutdown():
+
+            for process in list(self.processes):
+
+                if process.returncode is not None:
+                    continue
+
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+
+            self.processes.clear()
+
+            for task in asyncio.all_tasks(loop):
+                task.cancel()
+
+            # Cancelled tasks end on the next iteration
+            loop.call_soon(loop.stop)
+
+        loop.call_soon_threadsafe(shutdown)
+
+        if not self.is_loop_thread():
+            thread.join(timeout)
+
+
+__orchestrator = Orchestrator()
+
+
+def get_orchestrator():
+    """
+    Get the orchestrator of this process.
+    """
+
+    return __orchestrator
@@ -0,0 +1,275 @@
+################################################################################
+## Render Plan
+##
+## Rendering starts from a snapshot of the queue. Settings of every project
+## are resolved once, frames are filtered once (selective render checks every
+## output file then) and the settings script of the project is generated once.
+## Render instances, the listener and the ETA read the plan, so the queue can
+## be edited while it renders. With `RENDER_DRY_RUN` the plan is written as
+## JSON instead of rendering.
+
+import json
+
+from time import time
+from types import MappingProxyType
+from .project.object import compose_filename
+from .utils.filter_frames import FrameSet
+from .utils.fingerprint import get_state, get_dependency_states
+from .journal import get_key, get_journal_file
+
+
+class ReadOnly():
+    """
+    Attributes can't be changed after `__init__`.
+    """
+
+    def __setattr__(self, name, value):
+
+        if getattr(self, 'frozen', False):
+            raise AttributeError(f'{type(self).__name__} is read only.')
+
+        super().__setattr__(name, value)
+
+
+class ProjectPlan(ReadOnly):
+    """
+    Frames and resolved settings of one project.
+    """
+
+    def __init__(self, project, frames, preview):
+        self.file = project.file
+        self.scene = project.get_scene()
+        self.camera = project.get_camera()
+        self.engine = 'CYCLES' if not preview else 'BLENDER_WORKBENCH'
+        self.frames = FrameSet(frames)
+
+        self.settings = MappingProxyType({
+            'render_filepath' : project.get_render_filepath(),
+            'file_format' : project.get_file_format(),
+            'resolution_x' : project.get_resolution_x(),
+            'resolution_y' : project.get_resolution_y(),
+            'resolution_percentage' : project.get_resolution_percentage(),
+            'use_persistent_data' : project.get_use_persistent_data(),
+            'use_adaptive_sampling' : project.get_use_adaptive_sampling(),
+            'samples' : project.get_samples(),
+            'denoiser' : project.get_denoiser(),
+            'denoising_input_passes' : project.get_denoising_input_passes(),
+            'denoising_prefilter' : project.get_denoising_prefilter(),
+            'denoising_use_gpu' : project.get_denoising_use_gpu(),
+        })
+
+        self.script = get_project_script(self, preview)
+
+        # Frames rendered with other settings, from another version of the
+        # file or of its textures and libraries are not resumed. Projects
+        # loaded without a fingerprint fall back to the size and modification
+        # time.
+        content = (project.fingerprint or {}).get('hash') or get_state(self.file)
+        dependencies = sorted(get_dependency_states(project.dependency_states).items())
+        self.key = get_key(self.script, self.scene, content, dependencies)
+
+        self.frozen = True
+
+
+    def get_output(self, frame):
+        """
+        Render filename of a frame.
+        """
+
+        return compose_filename(self.settings['render_filepath'], self.settings['file_format'], frame)
+
+
+    def to_dict(self):
+        return {
+            'file' : self.file,
+            'scene' : self.scene,
+            'camera' : self.camera,
+            'engine' : self.engine,
+            'key' : self.key,
+            'settings' : dict(self.settings),
+            'frames' : str(self.frames),
+            'outputs' : [ str(self.get_output(f)) for f in self.frames ],
+            'script' : self.script,
+        }
+
+
+class RenderPlan(ReadOnly):
+    """
+    Projects of the queue in render order.
+    """
+
+    def __init__(self, projects, preset):
+        self.created = time()
+        self.blender_exe = preset.blender_exe
+        self.preview_render = bool(preset.preview_render)
+        self.selective_render = bool(preset.selective_render)
+        self.marker_render = bool(preset.marker_render)
+        self.projects = tuple(projects)
+
+        # A file queued twice renders its first entry
+        files = {}
+
+        for project in self.projects:
+            files.setdefault(project.file, project)
+
+        self.files = MappingProxyType(files)
+        self.frame_count = sum(len(p.frames) for p in self.projects)
+
+        self.frozen = True
+
+
+    def get(self, file):
+        """
+        Plan of the project, `None` if it is not rendered.
+        """
+
+        return self.files.get(file)
+
+
+    def to_dict(self):
+        return {
+            'created' : self.created,
+            'blender_exe' : self.blender_exe,
+            'preview_render' : self.preview_render,
+            'selective_render' : self.selective_render,
+            'marker_render' : self.marker_render,
+            'frame_count' : self.frame_count,
+            'projects' : [ p.to_dict() for p in self.projects ],
+        }
+
+
+    def export(self, file):
+        """
+        Write the plan as JSON.
+        """
+
+        with open(file, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
+
+
+def compile_plan(preset):
+    """
+    Snapshot the queue of the preset, projects without a scene, a camera or
+    frames to render are left out.
+    """
+
+    projects = []
+
+    for project in preset.project_list:
+
+        if not project.is_renderable():
+            continue
+
+        if not project.get_scene() or not project.get_camera():
+            continue
+
+        frames = project.get_frames_list()
+
+        if not frames:
+            continue
+
+        projects.append(ProjectPlan(project, frames, preset.preview_render))
+
+    return RenderPlan(projects, preset)
+
+
+def get_plan_file(preset):
+    """
+    Dry run plan of the preset, next to its journal.
+    """
+
+    return get_journal_file(preset).with_suffix('.plan.json')
+
+
+def get_project_script(plan, preview):
+    """
+    Get the part of the settings script that applies project settings.
+    """
+
+    settings = plan.settings
+
+    PYTHON = f"""
+import bpy
+
+scene = bpy.data.scenes.get("{plan.scene}") or bpy.context.scene
+cycles = scene.cycles
+render = scene.render
+image_settings = render.image_settings
+shading = scene.display.shading
+
+# Scene
+if "{plan.camera}" in bpy.data.objects:
+    scene.camera = bpy.data.objects["{plan.camera}"]
+
+render.filepath = "{settings['render_filepath'].replace('\\', '/')}"
+render.use_overwrite = True
+render.use_persistent_data = {settings['use_persistent_data']}
+
+# Compositor
+render.compositor_device = "GPU"
+render.compositor_precision = "FULL"
+"""
+    # New data
+    for name, value in [
+        ('image_settings.file_format', settings['file_format']),
+        ('render.resolution_x', settings['resolution_x']),
+        ('render.resolution_y', settings['resolution_y']),
+        ('render.resolution_percentage', settings['resolution_percentage'])
+    ]:
+
+        if value is None or value == "None":
+            continue
+
+        if isinstance(value, str):
+
+            if value.isnumeric():
+                value = eval(value)
+
+            else:
+                value = f'"{value}"'
+
+        PYTHON += f'\n{name} = {value}'
+
+    if preview:
+        PYTHON += """
+
+# Render
+render.use_simplify = True
+render.simplify_subdivision_render = 0
+render.use_border = False
+
+# Shading
+shading.color_type = "TEXTURE"
+shading.show_cavity = True
+shading.use_dof = True
+shading.show_object_outline = True
+shading.show_backface_culling = False
+shading.show_shadows = False
+
+# Compositor
+render.compositor_device = "GPU"
+render.compositor_precision = "FULL"
+"""
+
+    else:
+        PYTHON += f"""
+render.use_simplify = False
+render.use_border = False
+
+# Render
+cycles.use_adaptive_sampling = {settings['use_adaptive_sampling']}
+cycles.samples = {settings['samples']}
+
+# Denoiser
+cycles.denoiser = "{settings['denoiser']}"
+cycles.denoising_input_passes = "{settings['denoising_input_passes']}"
+cycles.denoising_prefilter = "{settings['denoising_prefilter']}"
+cycles.denoising_quality = "HIGH"
+cycles.denoising_use_gpu = {settings['denoising_use_gpu']}
+"""
+
+    # Technically, take scene settings and assigning sRGB
+    PYTHON += "\nimage_settings.color_management = 'FOLLOW_SCENE'"
+    PYTHON += "\nscene.display_settings.display_device = 'sRGB'"
+
+    return PYTHON.strip()
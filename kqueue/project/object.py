@@ -3,11 +3,12 @@
 
 import os
 from pathlib import Path
+from collections import OrderedDict
 
-from ..utils.filter_frames import filter_frames
+from ..utils.filter_frames import filter_frames, FrameSet
 from ..utils.pathutils import join, exists, open_folder, open_image
 from ..config import *
-from .. import store, save_load
+from .. import store
 
 FORMATS = {
     'PNG' : '.png',
@@ -17,11 +18,59 @@ FORMATS = {
     'TIFF' : '.tiff'
 }
 
+# render filepath => (folder version, last render image), the least recently
+# used are forgotten first.
+OUTPUT_IMAGES_MAX = 256
+_output_images = OrderedDict()
+
+
+def path_exists(path):
+    """
+    Does the path exist? Asks the watcher if it is running.
+    """
+
+    if store.watcher:
+        return store.watcher.exists(path)
+
+    return exists(path)
+
+
+def compose_filename(filepath, format, frame):
+    """
+    Compose the render filename of a frame, "#" in the name are the frame
+    number.
+    """
+
+    suffix = FORMATS.get(format, None)
+
+    if suffix is None:
+        raise Exception(f'Unknown image format: {format}')
+
+    path = Path(filepath)
+    basename = path.stem
+    zeros = basename.count("#") or 4
+    number = str(frame)
+
+    while len(number) < zeros:
+        number = "0" + number
+
+    to_replace = "#" * zeros
+
+    if to_replace in basename:
+        basename = basename.replace(to_replace, number)
+    else:
+        basename += number
+
+    return path.parent / f'{basename}{suffix}'
+
 
 class BlendProject():
     active = True
+    is_loading = False
     markers = []
-    mod_time = None
+    scenes = {}
+    fingerprint = None
+    dependency_states = {}
     file_format, file_format_override = 'PNG', None
     resolution_x, resolution_x_override = None, None
     resolution_y, resolution_y_override = None, None
@@ -49,7 +98,9 @@ class BlendProject():
                  denoising_input_passes,
                  denoising_prefilter,
                  markers,
-                 mod_time):
+                 fingerprint,
+                 scenes=None,
+                 dependency_states=None):
         self.active = True
         self.file = file if file else None
         self.frames, self.frames_override = f"{frame_start}-{frame_end}", None
@@ -70,14 +121,51 @@ class BlendProject():
         self.denoising_input_passes, self.denoising_input_passes_override = denoising_input_passes, None
         self.denoising_prefilter, self.denoising_prefilter_override = denoising_prefilter, None
         self.markers = markers
-        self.mod_time = mod_time
+        self.fingerprint = fingerprint
+        self.scenes = scenes or {}
+        self.dependency_states = dependency_states or {}
         self.notes = ""
+        self.is_loading = False
+
+
+    @classmethod
+    def placeholder(cls, file):
+        """
+        Create a project that waits for its data to be loaded.
+        """
+
+        project = cls(file,
+                      frame_start=0,
+                      frame_end=0,
+                      scene=None,
+                      scene_list=[],
+                      camera=None,
+                      camera_list=[],
+                      resolution_x=None,
+                      resolution_y=None,
+                      resolution_percentage=None,
+                      use_persistent_data=False,
+                      render_filepath="",
+                      file_format='PNG',
+                      use_adaptive_sampling=None,
+                      samples=None,
+                      denoiser=None,
+                      denoising_use_gpu=None,
+                      denoising_input_passes=None,
+                      denoising_prefilter=None,
+                      markers=[],
+                      fingerprint=None)
+
+        project.frames = ""
+        project.is_loading = True
+
+        return project
 
 
     def is_renderable(self):
         """ """
 
-        return self.active and self.get_camera() and self.file_exists() and self.render_filepath_exists()
+        return self.active and not self.is_loading and self.get_camera() and self.file_exists() and self.render_filepath_exists()
 
 
     def file_exists(self):
@@ -88,40 +176,80 @@ class BlendProject():
         if not self.file:
             return False
 
-        return exists(self.file)
+        return path_exists(self.file)
 
 
     def is_outdated(self):
         """
-        Was the project updated after the last data fetch?
+        Was the project or a file it depends on updated after the last data fetch?
+
+        Only reads the state the watcher keeps in memory, paths it did not
+        see yet are not outdated until it does.
         """
 
-        if not self.file_exists():
-            return True
+        watcher = store.watcher
+
+        if not watcher:
+            return False
+
+        state = watcher.get_known_state(self.file)
 
-        cache = save_load.load_cache()
+        if state is None:
+            return False
+
+        if not state[0]:
+            return True
 
-        if cache is None:
+        if watcher.is_cached(self.file) is False:
             return True
 
-        mod_time = int(Path(self.file).stat().st_mtime)
+        fp = watcher.get_fingerprint(self.file)
 
-        if self.file not in cache:
+        if fp is not None and fp.get('hash') != (self.fingerprint or {}).get('hash'):
             return True
 
-        if self.mod_time != mod_time:
+        if self.dependency_states is None:
             return True
 
+        for path, recorded in self.dependency_states.items():
+            state = watcher.get_known_state(path)
+
+            if state is not None and tuple(state) != tuple(recorded):
+                return True
+
         return False
 
 
+    def get_scene_value(self, name, scene=None):
+        """
+        Get a value of the selected scene, falls back to the active scene
+        of the file for projects loaded without per-scene data.
+        """
+
+        data = self.scenes.get(scene or self.get_scene()) or {}
+
+        if name == 'frames':
+
+            if 'frame_start' not in data or 'frame_end' not in data:
+                return self.frames
+
+            return f"{data['frame_start']}-{data['frame_end']}"
+
+        return data.get(name, getattr(self, name))
+
+    def get_view_layers(self, scene=None):
+        """ Get names of view layers the scene renders. """
+        data = self.scenes.get(scene or self.get_scene()) or {}
+        return [ vl['name'] for vl in data.get('view_layers', []) if vl.get('use') ]
+
+
     def get_frames(self):
         """ Get frames list as a string. """
-        return self.get(self.frames_override, self.frames) or ""
+        return self.get(self.frames_override, self.get_scene_value('frames')) or ""
 
     def frames_overrode(self):
         """ Are frames overrode? """
-        return self.get_frames() != self.frames
+        return self.get_frames() != self.get_scene_value('frames')
 
     def reset_frames_override(self):
         """ Reset frames override settings. """
@@ -133,7 +261,7 @@ class BlendProject():
         Get markers as a string.
         """
 
-        markers = self.markers
+        markers = self.get_scene_value('markers')
 
         if not markers:
             return ""
@@ -143,7 +271,7 @@ class BlendProject():
 
     def get_frames_list(self, frames=None):
         """
-        Get frames as an int list.
+        Get frames as a `FrameSet`.
         """
 
         if not frames:
@@ -155,17 +283,20 @@ class BlendProject():
         if store.preset.selective_render:
             rv = []
 
+            filepath = self.get_render_filepath()
+            format = self.get_file_format()
+
             for frame in filter_frames(frames) or []:
-                filename = self.compose_render_filename(frame)
+                filename = compose_filename(filepath, format, frame)
 
                 if Path(filename).exists():
                     continue
 
                 rv.append(frame)
 
-            return rv or []
+            return FrameSet(rv)
 
-        return filter_frames(frames) or []
+        return filter_frames(frames) or FrameSet()
 
 
     def get_frames_list_string(self, frames=None):
@@ -173,7 +304,7 @@ class BlendProject():
         Get frames list as a string.
         """
 
-        return ",".join([ str(frame) for frame in self.get_frames_list(frames) ])
+        return str(self.get_frames_list(frames))
 
 
     def get_notes(self):
@@ -182,41 +313,27 @@ class BlendProject():
         return self.notes or ""
 
 
-    def render_filepath_exists(self):
+    def get_failed_frames(self):
         """
+        Frames that failed to render in the last render.
         """
 
-        return Path(self.get_render_filepath()).parent.exists()
+        return tuple(store.preset.failed_frames.get(self.file, ()))
 
 
-    def compose_render_filename(self, frame):
+    def render_filepath_exists(self):
         """
-        Compose render filename.
         """
 
-        format = self.get_file_format()
-        suffix = FORMATS.get(format, None)
-
-        if suffix is None:
-            raise Exception(f'Unknown image format: {format}')
+        return path_exists(Path(self.get_render_filepath()).parent)
 
-        filepath = self.get_render_filepath()
-        path = Path(filepath)
-        basename = path.stem
-        zeros = basename.count("#") or 4
-        number = str(frame)
 
-        while len(number) < zeros:
-            number = "0" + number
-
-        to_replace = "#" * zeros
-
-        if to_replace in basename:
-            basename = basename.replace(to_replace, number)
-        else:
-            basename += number
+    def compose_render_filename(self, frame):
+        """
+        Compose render filename.
+        """
 
-        return path.parent / f'{basename}{suffix}'
+        return compose_filename(self.get_render_filepath(), self.get_file_format(), frame)
 
 
     def get(self, v1, v2, other_list=None):
@@ -231,19 +348,19 @@ class BlendProject():
         return rv
 
     def get_scene(self): return self.get(self.scene_override, self.scene, self.scene_list)
-    def get_camera(self): return self.get(self.camera_override, self.camera, self.camera_list)
-    def get_resolution_x(self): return self.get(self.resolution_x_override, self.resolution_x) or 0
-    def get_resolution_y(self): return self.get(self.resolution_y_override, self.resolution_y) or 0
-    def get_resolution_percentage(self): return self.get(self.resolution_percentage_override, self.resolution_percentage) or 0
-    def get_use_persistent_data(self): return self.get(self.use_persistent_data_override, self.use_persistent_data)
-    def get_render_filepath(self): return join(self.get(self.render_filepath_override, self.render_filepath))
-    def get_file_format(self): return self.get(self.file_format_override, self.file_format)
-    def get_use_adaptive_sampling(self): return self.get(self.use_adaptive_sampling_override, self.use_adaptive_sampling)
-    def get_samples(self): return self.get(self.samples_override, self.samples)
-    def get_denoiser(self): return self.get(self.denoiser_override, self.denoiser)
-    def get_denoising_use_gpu(self): return self.get(self.denoising_use_gpu_override, self.denoising_use_gpu)
-    def get_denoising_input_passes(self): return self.get(self.denoising_input_passes_override, self.denoising_input_passes)
-    def get_denoising_prefilter(self): return self.get(self.denoising_prefilter_override, self.denoising_prefilter)
+    def get_camera(self): return self.get(self.camera_override, self.get_scene_value('camera'), self.get_scene_value('camera_list'))
+    def get_resolution_x(self): return self.get(self.resolution_x_override, self.get_scene_value('resolution_x')) or 0
+    def get_resolution_y(self): return self.get(self.resolution_y_override, self.get_scene_value('resolution_y')) or 0
+    def get_resolution_percentage(self): return self.get(self.resolution_percentage_override, self.get_scene_value('resolution_percentage')) or 0
+    def get_use_persistent_data(self): return self.get(self.use_persistent_data_override, self.get_scene_value('use_persistent_data'))
+    def get_render_filepath(self): return join(self.get(self.render_filepath_override, self.get_scene_value('render_filepath')))
+    def get_file_format(self): return self.get(self.file_format_override, self.get_scene_value('file_format'))
+    def get_use_adaptive_sampling(self): return self.get(self.use_adaptive_sampling_override, self.get_scene_value('use_adaptive_sampling'))
+    def get_samples(self): return self.get(self.samples_override, self.get_scene_value('samples'))
+    def get_denoiser(self): return self.get(self.denoiser_override, self.get_scene_value('denoiser'))
+    def get_denoising_use_gpu(self): return self.get(self.denoising_use_gpu_override, self.get_scene_value('denoising_use_gpu'))
+    def get_denoising_input_passes(self): return self.get(self.denoising_input_passes_override, self.get_scene_value('denoising_input_passes'))
+    def get_denoising_prefilter(self): return self.get(self.denoising_prefilter_override, self.get_scene_value('denoising_prefilter'))
 
     def get_final_resolution(self):
         """
@@ -306,9 +423,18 @@ class BlendProject():
         path = Path(self.get_render_filepath())
         dir = path.parent
 
-        if not dir.exists():
+        if not path_exists(dir):
             return None
 
+        # Walk the folder again only after the watcher saw it change
+        if store.watcher:
+            key = str(path)
+            version = store.watcher.get_version(dir)
+
+            if key in _output_images and _output_images[key][0] == version:
+                _output_images.move_to_end(key)
+                return _output_images[key][1]
+
         rv = None
 
         for local_path, _, files in dir.walk():
@@ -323,6 +449,13 @@ class BlendProject():
 
                 rv = local_path / name
 
+        if store.watcher:
+            _output_images[key] = (version, rv)
+            _output_images.move_to_end(key)
+
+            while len(_output_images) > OUTPUT_IMAGES_MAX:
+                _output_images.popitem(last=False)
+
         return rv
 
 
@@ -345,7 +478,7 @@ class BlendProject():
 
         path = Path(self.get_render_filepath())
 
-        if not path.parent.exists():
+        if not path_exists(path.parent):
             return None
 
         return path.parent
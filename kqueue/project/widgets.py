@@ -123,12 +123,14 @@ class QBlendProject(qtw.QWidget):
         self.w_open = None
         self.w_reload = None
         self.w_not_exists = None
+        self.w_failed = None
 
         self.initialized = True
 
         self.UPDATE_LIST = [
             (project, 'file_exists'),
             (project, 'is_outdated'),
+            (project, 'get_failed_frames'),
         ]
 
         self.update_widgets()
@@ -165,6 +167,11 @@ class QBlendProject(qtw.QWidget):
         if self.w_not_exists:
             self.w_hBoxLayout.removeWidget(self.w_not_exists)
 
+        if self.w_failed:
+            self.w_hBoxLayout.removeWidget(self.w_failed)
+            self.w_failed.deleteLater()
+            self.w_failed = None
+
         if self.project.file_exists():
 
             # [button] Start
@@ -191,6 +198,14 @@ class QBlendProject(qtw.QWidget):
             self.w_not_exists.setFixedWidth(75)
             self.w_hBoxLayout.addWidget(self.w_not_exists)
 
+        failed_frames = self.project.get_failed_frames()
+
+        if failed_frames:
+            self.w_failed = qtw.QLabel(f'Failed: {len(failed_frames)}')
+            self.w_failed.setStyleSheet("color: red; font-weight: bold;")
+            self.w_failed.setToolTip(f'Frames failed to render: {",".join(str(f) for f in failed_frames)}')
+            self.w_hBoxLayout.addWidget(self.w_failed)
+
         self.w_open_render_image.setEnabled(bool(self.project.get_render_output_image()))
         self.w_open_render_folder.setEnabled(bool(self.project.get_render_output_folder()))
 
@@ -206,6 +221,10 @@ class QBlendProject(qtw.QWidget):
     def set_active(self, value: bool):
         self.w_active.setChecked(value)
 
+    def set_loading(self):
+        self.w_frames.setText("Loading...")
+        self.w_frames.setEnabled(False)
+
     def set_frames(self, frames):
         self.w_frames.setText(f'Fra: [{frames}]')
 
@@ -260,7 +279,7 @@ class QBlendProjectSettings(qtw.QWidget):
         self.setWindowTitle(str(self.project.file))
         self.setWindowIcon(qtg.QIcon(ICON))
         self.setMinimumWidth(450)
-        self.setFixedHeight(525)
+        self.setFixedHeight(550)
         self.setWindowModality(Qt.ApplicationModal)
         self.resize(450, 400)
 
@@ -285,11 +304,11 @@ class QBlendProjectSettings(qtw.QWidget):
             # [edit] Frames
             self.frames = qtw.QLineEdit(str(project.get_frames()))
             self.frames.setFixedHeight(FIELD_HEIGHT)
-            self.frames.setPlaceholderText(str(project.frames))
+            self.frames.setPlaceholderText(str(project.get_scene_value('frames')))
             hbox.addWidget(self.frames)
 
             # [button] Frames Reset
-            self.framesReset = QPushButton("", clicked=lambda: self.frames.setText(str(project.frames)))
+            self.framesReset = QPushButton("", clicked=lambda: self.frames.setText(self.get_scene_value('frames')))
             self.framesReset.setFixedHeight(FIELD_HEIGHT)
             self.framesReset.setFixedWidth(30)
             self.framesReset.setIcon(qtg.QIcon('kqueue/icons/reset.svg'))
@@ -325,29 +344,29 @@ class QBlendProjectSettings(qtw.QWidget):
             # [edit] Resolution X
             self.resX = qtw.QLineEdit(str(project.get_resolution_x()))
             self.resX.setFixedHeight(FIELD_HEIGHT)
-            self.resX.setPlaceholderText(str(project.resolution_x))
+            self.resX.setPlaceholderText(str(project.get_scene_value('resolution_x')))
             self.resX.setValidator(qtg.QIntValidator(1, 32 * 1024, self))
             hbox.addWidget(self.resX)
 
             # [edit] Resolution Y
             self.resY = qtw.QLineEdit(str(project.get_resolution_y()))
             self.resY.setFixedHeight(FIELD_HEIGHT)
-            self.resY.setPlaceholderText(str(project.resolution_y))
+            self.resY.setPlaceholderText(str(project.get_scene_value('resolution_y')))
             self.resY.setValidator(qtg.QIntValidator(1, 32 * 1024, self))
             hbox.addWidget(self.resY)
 
             # [edit] Resolution Percentage
             self.resPerc = qtw.QLineEdit(str(project.get_resolution_percentage()))
             self.resPerc.setFixedHeight(FIELD_HEIGHT)
-            self.resPerc.setPlaceholderText(str(project.resolution_percentage))
+            self.resPerc.setPlaceholderText(str(project.get_scene_value('resolution_percentage')))
             self.resPerc.setValidator(qtg.QIntValidator(1, 999999, self))
             hbox.addWidget(self.resPerc)
 
             # [button] Resolution Reset
             def reset_resolution():
-                self.resX.setText(str(project.resolution_x))
-                self.resY.setText(str(project.resolution_y))
-                self.resPerc.setText(str(project.resolution_percentage))
+                self.resX.setText(self.get_scene_value('resolution_x'))
+                self.resY.setText(self.get_scene_value('resolution_y'))
+                self.resPerc.setText(self.get_scene_value('resolution_percentage'))
 
             self.resReset = QPushButton("", clicked=reset_resolution)
             self.resReset.setIcon(qtg.QIcon('kqueue/icons/reset.svg'))
@@ -360,7 +379,7 @@ class QBlendProjectSettings(qtw.QWidget):
         # [edit] Samples
         self.samples = qtw.QLineEdit(str(project.get_samples()))
         self.samples.setFixedHeight(FIELD_HEIGHT)
-        self.samples.setPlaceholderText(str(project.samples))
+        self.samples.setPlaceholderText(str(project.get_scene_value('samples')))
         self.samples.setValidator(qtg.QIntValidator(1, 99999, self))
         l_form.addRow("Samples", self.samples)
 
@@ -374,7 +393,7 @@ class QBlendProjectSettings(qtw.QWidget):
             # [edit] Render Filepath
             self.renderFilepath = qtw.QLineEdit(str(project.get_render_filepath()))
             self.renderFilepath.setFixedHeight(FIELD_HEIGHT)
-            self.renderFilepath.setPlaceholderText(str(project.render_filepath))
+            self.renderFilepath.setPlaceholderText(join(project.get_scene_value('render_filepath')))
             hbox.addWidget(self.renderFilepath)
 
             # [button] Render Filepath
@@ -405,7 +424,7 @@ class QBlendProjectSettings(qtw.QWidget):
 
         # [edit] Camera
         self.camera = QComboBox()
-        self.camera.addItems(project.camera_list)
+        self.camera.addItems(project.get_scene_value('camera_list'))
         self.camera.setCurrentText(str(project.get_camera()))
         self.camera.setFixedHeight(FIELD_HEIGHT)
         l_form.addRow("Camera", self.camera)
@@ -418,6 +437,15 @@ class QBlendProjectSettings(qtw.QWidget):
         self.scene.setCurrentText(str(project.get_scene()))
         l_form.addRow("Scene", self.scene)
 
+        # [label] View Layers
+        self.viewLayers = qtw.QLabel(", ".join(project.get_view_layers()))
+        self.viewLayers.setEnabled(False)
+        self.viewLayers.setFixedHeight(FIELD_HEIGHT)
+        l_form.addRow("View Layers", self.viewLayers)
+
+        self.scene_selected = self.scene.currentText()
+        self.scene.currentTextChanged.connect(self.change_scene)
+
 
         # [edit] Persistent
         self.usePersistentData = QPushButton(str(project.get_use_persistent_data()))
@@ -513,11 +541,60 @@ class QBlendProjectSettings(qtw.QWidget):
             self.save_and_close()
 
 
+    def get_scene_value(self, name, scene=None):
+        """
+        Get a value of the scene selected in this window as a field text.
+        """
+
+        value = self.project.get_scene_value(name, scene or self.scene.currentText())
+
+        if name == 'render_filepath':
+            return join(value)
+
+        return str(value)
+
+
+    def change_scene(self, scene):
+        """
+        Show settings of another scene, fields the user did not edit follow
+        the scene. All scenes are loaded already, no fetch is needed.
+        """
+
+        for widget, name in [
+            (self.frames, 'frames'),
+            (self.resX, 'resolution_x'),
+            (self.resY, 'resolution_y'),
+            (self.resPerc, 'resolution_percentage'),
+            (self.samples, 'samples'),
+            (self.renderFilepath, 'render_filepath'),
+        ]:
+            old_value = self.get_scene_value(name, self.scene_selected)
+            new_value = self.get_scene_value(name, scene)
+
+            if widget.text() == old_value:
+                widget.setText(new_value)
+
+            widget.setPlaceholderText(new_value)
+
+        camera = self.camera.currentText()
+        camera_list = self.project.get_scene_value('camera_list', scene)
+
+        if camera not in camera_list:
+            camera = str(self.project.get_scene_value('camera', scene))
+
+        self.camera.clear()
+        self.camera.addItems(camera_list)
+        self.camera.setCurrentText(camera)
+
+        self.viewLayers.setText(", ".join(self.project.get_view_layers(scene)))
+        self.scene_selected = scene
+
+
     def update_frames_result(self):
         """
         """
 
-        self.wResult_setText.emit(f'{self.project.get_frames_list()}')
+        self.wResult_setText.emit(self.project.get_frames_list_string())
         # print(f'{self.project.get_frames_list()}')
         # self.result.setText(f'{self.project.get_frames_list()}')
 
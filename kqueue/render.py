@@ -2,271 +2,828 @@
 ## Queue Preset
 
 import time
-import subprocess
 import PyQt5.QtCore as qtc
 
-from re import search
-from io import TextIOWrapper
+from os import makedirs
+from json import loads, dump
+from queue import Queue
+from threading import Thread, Lock, Event
 from pathlib import Path
 from .utils.pathutils import join
 from .utils import monitor, audio
+from .utils.utils import kill_process_tree
+from .utils.log_parser import parse_line, parse_samples, get_progress
+from .utils.filter_frames import compress_frames
+from .devices import get_devices
+from .orchestrator import get_orchestrator
+from .session import RenderSession, SessionError, EVENT_TAG
+from .scheduler import FrameScheduler
+from .watchdog import FrameWatch, FrameWatchdog
+from .journal import RenderJournal, get_journal_file, load_resume, is_complete
 from .config import *
 from . import store, main
 
+# Windows cmd reads lines up to 8191 characters
+CMD_LINE_MAX = 8191
+
 
 ################################################################################
+# Settings Script
+
+# Render handlers of the settings script. They print tagged JSON events with
+# exact frame, file and timing data, output line formats change between
+# Blender versions. Handlers are not persistent, loading a file drops them.
+HANDLERS_PY = """
+# Progress events
+import sys
+import json
+import time
 
-class RenderThread(qtc.QThread):
+kqueue_times = {}
 
-    finished = qtc.pyqtSignal()
-    listener_started = False
+def kqueue_emit(event, **data):
+    data['event'] = event
+    sys.stdout.write(KQUEUE_EVENT_TAG + json.dumps(data) + "\\n")
+    sys.stdout.flush()
 
+def kqueue_render_pre(scene, *args):
+    kqueue_times['frame'] = time.time()
+    kqueue_emit('render_pre', file=bpy.data.filepath, frame=scene.frame_current)
 
-    def __init__(self):
-        super().__init__()
+def kqueue_render_post(scene, *args):
+    kqueue_emit('render_post', file=bpy.data.filepath, frame=scene.frame_current, time=time.time() - kqueue_times.get('frame', time.time()))
 
+def kqueue_render_write(scene, *args):
+    kqueue_emit('render_write', file=bpy.data.filepath, frame=scene.frame_current, path=scene.render.frame_path(frame=scene.frame_current))
+
+def kqueue_render_stats(stats, *args):
+    kqueue_emit('render_stats', text=str(stats))
+
+def kqueue_render_cancel(scene, *args):
+    kqueue_emit('render_cancel', file=bpy.data.filepath, frame=scene.frame_current)
+
+for kqueue_name, kqueue_handler in [
+    ('render_pre', kqueue_render_pre),
+    ('render_post', kqueue_render_post),
+    ('render_write', kqueue_render_write),
+    ('render_stats', kqueue_render_stats),
+    ('render_cancel', kqueue_render_cancel),
+]:
+    kqueue_handlers = getattr(bpy.app.handlers, kqueue_name)
+
+    for h in [ h for h in kqueue_handlers if getattr(h, '__name__', "") == kqueue_handler.__name__ ]:
+        kqueue_handlers.remove(h)
+
+    kqueue_handlers.append(kqueue_handler)
+
+kqueue_emit('handlers')
+"""
+
+
+# Out of memory fallback steps: (description, settings script lines)
+OOM_FALLBACKS = {
+    'tiles' : ("smaller tiles", f"""
+cycles.use_auto_tile = True
+cycles.tile_size = {RENDER_OOM_TILE_SIZE}
+"""),
+    'no_persistent_data' : ("no persistent data", """
+render.use_persistent_data = False
+"""),
+    'cpu' : ("CPU", """
+cycles.device = "CPU"
+"""),
+    'resolution' : ("half resolution", """
+render.resolution_percentage = max(1, render.resolution_percentage // 2)
+"""),
+}
+
+
+def get_oom_ladder(device=None):
+    """
+    Get out of memory fallback steps that can help on the device.
+    """
+
+    preset = store.preset
+
+    ladder = []
+
+    for step in RENDER_OOM_LADDER:
+
+        if step not in OOM_FALLBACKS:
+            continue
+
+        # Workbench previews don't use Cycles settings
+        if preset.preview_render and step != 'resolution':
+            continue
+
+        if step == 'resolution' and not preset.preview_render:
+            continue
+
+        if step == 'cpu' and device is not None and device.backend == 'CPU':
+            continue
+
+        ladder.append(step)
+
+    return ladder
+
+
+def get_settings_script(project, device=None, fallbacks=()):
+    """
+    Get the python script that applies settings of a planned project before
+    rendering.
+
+    `device` - render device of the instance, `None` keeps project devices.
+    `fallbacks` - out of memory fallback steps.
+    """
+
+    PYTHON = project.script
+
+    if device is not None and project.engine == 'CYCLES':
+        PYTHON += "\n" + device.get_script().rstrip()
+
+    if fallbacks:
+        PYTHON += "\n\n# Out of memory fallback"
+
+        for step in fallbacks:
+            PYTHON += OOM_FALLBACKS[step][1].rstrip()
+
+    PYTHON += f'\n\nKQUEUE_EVENT_TAG = {EVENT_TAG!r}\n'
+    PYTHON += HANDLERS_PY
+
+    # This message is needed to let us know that all our settings
+    # were applied without errors.
+    PYTHON += '\n\nprint("All settings loaded successfully!")'
+
+    return PYTHON.strip()
+
+
+################################################################################
+# Render Instance
+
+class RenderInstance():
+    """
+    One Blender instance of the scheduler, bound to one device of the pool.
+
+    Every instance has its own temp folder with its own settings script and
+    batch file, so instances don't overwrite each other. The listener keeps
+    its per-instance state here too.
+
+    With `RENDER_USE_SESSION` the instance keeps one Blender alive and sends
+    it jobs, otherwise every job starts Blender from a batch file.
+    """
+
+    def __init__(self, device, output, journal=None):
+        self.device = device
+        self.output = output
+        self.journal = journal
+        self.process = None
+        self.exited = Event()
+        self.session = None
+        self.watch = FrameWatch(on_alert=self.abort)
+
+        # Session that loads the next project, see `prewarm`
+        self.spare = None
+
+        # file => out of memory fallback steps used for the project
+        self.fallbacks = {}
+        self.temp_folder = Path(join(store.working_dir, f'blender/temp/instance_{device.slot}'))
+
+        # Listener state
+        self.project = None
+        self.frame = None
+        self.last_frame = None
+        self.settings_flag = False
+        self.current_render = None
+
+        # Blender reports progress with handler events, output lines are
+        # not parsed then.
+        self.structured = False
+
+
+    def get_name(self):
+        return f'#{self.device.slot} {self.device.get_name()}'
+
+
+    def get_fallbacks(self, project):
+        """
+        Out of memory fallback steps the project renders with.
+        """
+
+        return get_oom_ladder(self.device)[:self.fallbacks.get(project.file, 0)]
+
+
+    def write_settings_script(self, project, fallbacks=()):
+        """
+        Write the settings script of the project, returns its path.
+        """
+
+        makedirs(self.temp_folder, exist_ok=True)
+
+        PYTOH_FILE = join(self.temp_folder, "render_settings.py")
+
+        with open(PYTOH_FILE, 'w', encoding="utf-8") as f:
+            f.write(get_settings_script(project, self.device, fallbacks))
+
+        return PYTOH_FILE
+
+
+    def render(self, project, frames, scheduler):
+        """
+        Render frames of the project and wait until they are done. Blender
+        that failed is started again with the frames that are left, frames
+        that keep failing are skipped.
+        """
 
-    def run(self):
         preset = store.preset
-        mw = store.mw
 
-        audio.play(RENDER_START_AUDIO)
-        preset.set_status('RENDERING')
-        mw.update_widgets.emit()
+        left = list(frames)
+        failures = {}
+        retries = 0
+        ladder = get_oom_ladder(self.device)
 
-        for project in preset.project_list:
+        def is_stopping():
+            return preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED')
 
-            if not project.is_renderable():
-                continue
+        while left and not is_stopping():
+            level = self.fallbacks.get(project.file, 0)
+            fallbacks = self.get_fallbacks(project)
+
+            self.watch.begin(project.file)
+
+            try:
 
-            if preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED'):
+                if RENDER_USE_SESSION:
+                    left, error = self.render_session(project, left, scheduler, fallbacks)
+                else:
+                    left, error = self.render_batch(project, left, fallbacks)
+
+            finally:
+                self.watch.end()
+
+            if not left or is_stopping():
                 break
 
-            sc = project.get_scene()
-            fl = project.get_frames_list()
-            ca = project.get_camera()
+            # The watchdog told why it stopped Blender
+            if self.watch.reason is None:
+                main.log(f'Instance {self.get_name()}: {error}')
 
-            if not sc or not fl or not ca:
+            # Next step of the ladder, the queue goes on
+            if self.watch.out_of_memory and level < len(ladder):
+                self.fallbacks[project.file] = level + 1
+                main.log(f'Instance {self.get_name()}: rendering with {OOM_FALLBACKS[ladder[level]][0]}, {len(left)} frames left.')
                 continue
 
-            PYTOH_FILE = join(store.working_dir, "blender/temp/render_settings.py")
+            # Frame that was being rendered when Blender failed
+            frame = self.watch.get_failing_frame()
 
-            PYTHON = f"""
-import bpy
+            if frame in left:
+                failures[frame] = failures.get(frame, 0) + 1
 
-scene = bpy.context.scene
-cycles = scene.cycles
-render = scene.render
-image_settings = render.image_settings
-shading = scene.display.shading
+                if failures[frame] >= RENDER_FRAME_FAILURES:
+                    left.remove(frame)
+                    self.fail_frames(project, [frame], f'Blender failed {failures[frame]} times')
 
-# Scene
-if "{ca}" in bpy.data.objects:
-    scene.camera = bpy.data.objects["{ca}"]
+            if not left:
+                break
 
-render.filepath = "{project.get_render_filepath().replace('\\', '/')}"
-render.use_overwrite = True
-render.use_persistent_data = {project.get_use_persistent_data()}
+            if retries >= RENDER_RETRY_LIMIT:
+                self.fail_frames(project, left, f'Blender failed {retries + 1} times')
+                break
+
+            delay = min(RENDER_RETRY_BACKOFF * 2 ** retries, RENDER_RETRY_BACKOFF_MAX)
+            retries += 1
+
+            main.log(f'Restarting Blender in {delay:.0f}s, {len(left)} frames left.')
+
+            preset.stopping.wait(delay)
+
+        scheduler.finish(self, measured=RENDER_USE_SESSION)
+
+
+    def steal(self, count):
+        """
+        Give back `count` frames that were not started to the scheduler.
+        Only sessions can, batch files have their frames on the command line.
+        """
+
+        if self.session is None:
+            return False
+
+        return self.session.steal(count)
 
-# Compositor
-render.compositor_device = "GPU"
-render.compositor_precision = "FULL"
-"""
-            # New data
-            for name, value in [
-                ('image_settings.file_format', project.get_file_format()),
-                ('render.resolution_x', project.get_resolution_x()),
-                ('render.resolution_y', project.get_resolution_y()),
-                ('render.resolution_percentage', project.get_resolution_percentage())
-            ]:
-
-                if value is None or value == "None":
-                    continue
-
-                if isinstance(value, str):
-
-                    if value.isnumeric():
-                        value = eval(value)
-
-                    else:
-                        value = f'"{value}"'
-
-                PYTHON += f'\n{name} = {value}'
-
-            if preset.preview_render:
-                PYTHON += f"""
-
-# Render
-render.use_simplify = True
-render.simplify_subdivision_render = 0
-render.use_border = False
-
-# Shading
-shading.color_type = "TEXTURE"
-shading.show_cavity = True
-shading.use_dof = True
-shading.show_object_outline = True
-shading.show_backface_culling = False
-shading.show_shadows = False
-
-# Compositor
-render.compositor_device = "GPU"
-render.compositor_precision = "FULL"
-"""
+
+    def render_session(self, project, frames, scheduler, fallbacks=()):
+        """
+        Send the job to the Blender of this instance.
+
+        Returns `(left, error)`, frames that were not rendered and why.
+        """
+
+        preset = store.preset
+
+        spare, self.spare = self.spare, None
+
+        # Blender that loaded this project already takes the job
+        if spare is not None:
+
+            if spare.loaded_file == project.file and spare.blender_exe == preset.blender_exe and spare.is_running():
+                self.close()
+                spare.on_line = self.watch.feed
+                spare.release()
+                self.session = spare
 
             else:
-                PYTHON += f"""
-render.use_simplify = False
-render.use_border = False
-
-# Render
-cycles.use_adaptive_sampling = {project.get_use_adaptive_sampling()}
-cycles.samples = {project.get_samples()}
-
-# Denoiser
-cycles.denoiser = "{project.get_denoiser()}"
-cycles.denoising_input_passes = "{project.get_denoising_input_passes()}"
-cycles.denoising_prefilter = "{project.get_denoising_prefilter()}"
-cycles.denoising_quality = "HIGH"
-cycles.denoising_use_gpu = {project.get_denoising_use_gpu()}
-"""
+                spare.kill()
+
+        if self.session is None or self.session.blender_exe != preset.blender_exe:
+            self.close()
+            self.session = RenderSession(preset.blender_exe, self.output, owner=self, on_line=self.watch.feed)
+
+        script = self.write_settings_script(project, fallbacks)
+        left = list(frames)
+        done = 0
+
+        def on_event(event):
+            nonlocal left, done
+            name = event.get('event')
+
+            if name == 'ready':
+                scheduler.on_ready(self, event.get('time', 0.0))
+
+            elif name == 'frame':
+                done += 1
+                scheduler.on_frame(self, event.get('frame'), event.get('time'))
+
+            elif name == 'stolen':
+                stolen = event.get('frames') or []
+                left = [ f for f in left if f not in stolen ]
+                scheduler.give_back(self, stolen)
+
+            # The last frame of the job is being rendered
+            if name in ('ready', 'frame') and len(left) - done <= 1:
+                self.prewarm(project, scheduler)
+
+        try:
+            self.session.render(project.file, left, scene=project.scene, engine=project.engine, script=script, on_event=on_event)
+            rendered, error = set(left), None
+
+        except SessionError as e:
+            rendered, error = set(e.frames), str(e)
+
+        # Frames written after running out of memory are broken
+        if self.watch.out_of_memory:
+            rendered &= self.watch.rendered
+            error = error or self.watch.reason
+
+        return [ f for f in left if f not in rendered ], error
+
+
+    def prewarm(self, project, scheduler):
+        """
+        Start Blender for the next project of the instance, it loads the file
+        and waits for the job, so the device doesn't wait for loading.
+        """
+
+        preset = store.preset
+
+        if not RENDER_PREWARM or self.spare is not None:
+            return
+
+        next_project = scheduler.get_next_project(self)
+
+        if next_project is None or next_project.file == project.file:
+            return
+
+        # Another script file, Blender of this job may still read its own
+        script = join(self.temp_folder, "render_settings_next.py")
+
+        with open(script, 'w', encoding="utf-8") as f:
+            f.write(get_settings_script(next_project, self.device, self.get_fallbacks(next_project)))
+
+        # Loading lines would switch the project of the job being rendered
+        spare = RenderSession(preset.blender_exe, self.output, owner=self, hold=True)
+
+        try:
+            spare.load(next_project.file, scene=next_project.scene, engine=next_project.engine, script=script)
+        except (OSError, AttributeError):
+            spare.kill()
+            return
+
+        self.spare = spare
 
-            # Technically, take scene settings and assigning sRGB
-            if preset.assign_srgb or True:
-                PYTHON += "\nimage_settings.color_management = 'FOLLOW_SCENE'"
-                PYTHON += "\nscene.display_settings.display_device = 'sRGB'"
 
-            # This message is needed to let us know that all our settings
-            # were applied without errors.
-            PYTHON += '\n\nprint("All settings loaded successfully!")'
+    def render_batch(self, project, frames, fallbacks=()):
+        """
+        Render frames with a batch file.
+
+        Returns `(left, error)`, frames that were not rendered and why.
+        """
+
+        self.start(project, frames, fallbacks)
+        code = self.wait()
+
+        left = [ f for f in frames if f not in self.watch.rendered ]
+
+        if not left:
+            return [], None
+
+        return left, f'Blender has exited with code {code} before rendering all frames.'
+
+
+    def abort(self, reason):
+        """
+        Kill Blender of the instance, called by the watchdog.
+        """
 
-            with open(PYTOH_FILE, 'w', encoding="utf-8") as f:
-                f.write(PYTHON.strip())
+        main.log(f'Instance {self.get_name()}: {reason}, stopping Blender.')
 
-            BATCH_FILE = join(store.working_dir, f'blender/temp/start_render.bat')
-            BATCH = f"""
+        process = self.session.process if self.session is not None else self.process
+
+        if process is not None:
+            kill_process_tree(process.pid)
+
+
+    def fail_frames(self, project, frames, reason):
+        """
+        Mark frames that were not rendered, they are shown in the project list.
+        """
+
+        preset = store.preset
+
+        failed = preset.failed_frames.setdefault(project.file, [])
+        failed.extend(f for f in frames if f not in failed)
+        failed.sort()
+
+        if self.journal is not None:
+
+            for frame in frames:
+                self.journal.failed(project.file, frame, reason)
+
+        main.log(f'Frames were not rendered: {project.file} | {compress_frames(frames)} | {reason}')
+        store.mw.update_widgets.emit()
+
+
+    def close(self):
+        """
+        Stop the Blender session of this instance.
+        """
+
+        if self.session is not None:
+            self.session.stop()
+            self.session = None
+
+        if self.spare is not None:
+            self.spare.kill()
+            self.spare = None
+
+
+    def start(self, project, frames, fallbacks=()):
+        """
+        Start rendering frames of the project.
+        """
+
+        preset = store.preset
+
+        PYTOH_FILE = self.write_settings_script(project, fallbacks)
+
+        COMMAND = f'blender --background "{project.file}" --scene "{project.scene}" -E "{project.engine}" --python "{PYTOH_FILE}" -f "{compress_frames(frames)}"'
+
+        # Sparse frames that don't fit the line go to the render driver in a
+        # job file, it renders them like a session job.
+        if len(COMMAND) > CMD_LINE_MAX:
+            JOB_FILE = join(self.temp_folder, "render_job.json")
+
+            with open(JOB_FILE, 'w', encoding="utf-8") as f:
+                dump({
+                    'id' : 0,
+                    'cmd' : 'render',
+                    'file' : project.file,
+                    'scene' : project.scene,
+                    'engine' : project.engine,
+                    'script' : PYTOH_FILE,
+                    'frames' : list(frames),
+                }, f)
+
+            COMMAND = f'blender --background --python "{store.render_driver_py}" -- --job "{JOB_FILE}"'
+
+        BATCH_FILE = join(self.temp_folder, "start_render.bat")
+        BATCH = f"""
 @CHCP 65001 > NUL
 @echo ---BLENDER-RENDER-START
-blender --background "{project.file}" --scene "{sc}" -E "{'CYCLES' if not preset.preview_render else 'BLENDER_WORKBENCH'}" --python "{PYTOH_FILE}" -f "{",".join([str(f) for f in fl])}"
+{COMMAND}
 @echo ---BLENDER-RENDER-END
 """
 
 # BLENDER_WORKBENCH, BLENDER_EEVEE_NEXT, CYCLES
 
-#--cycles-device OPTIX
+        with open(BATCH_FILE, 'w', encoding="utf-8") as f:
+            f.write(BATCH.strip())
+
+        exited = self.exited = Event()
+
+        self.process = get_orchestrator().spawn(
+            [ BATCH_FILE ],
+            on_line=self.read_line,
+            on_exit=lambda code: exited.set(),
+            cwd=join(Path(preset.blender_exe).parent),
+            )
+
+        preset.processes.append(self.process)
+
+
+    def read_line(self, line):
+        """
+        Pass a Blender output line to the watch and the listener.
+        """
 
-            with open(BATCH_FILE, 'w', encoding="utf-8") as f:
-                f.write(BATCH.strip())
+        self.watch.feed(line)
+        self.output.put((self, line))
 
-            preset.process = subprocess.Popen(
-                [ BATCH_FILE ],
-                stderr=subprocess.STDOUT,
-                stdout=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                cwd=join(Path(preset.blender_exe).parent),
-                #    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP, #DETACHED_PROCESS
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                #    preexec_fn=os.setsid,
-                shell=False
-                )
 
-            if not self.listener_started:
-                self.listener_started = True
+    def wait(self):
+        """
+        Wait for Blender and its last output lines, returns the exit code.
+        """
 
+        process = self.process
 
-                self.listen_thread = RenderListenThread()
-                self.timer_thread = RenderTimerThread()
+        if process is None:
+            return None
 
-                # self.listen_thread = qtc.QThread()
-                # self.listen_worker = RenderListenThread()
-                # self.listen_worker.moveToThread(self.listen_thread)
+        code = process.wait()
+        self.exited.wait(timeout=10.0)
 
-                self.listen_thread.gProgressBar_setValue.connect(mw.w_gProgressBar.setValue)
-                self.listen_thread.gProgress_setText.connect(mw.w_gProgress.setText)
+        if process in store.preset.processes:
+            store.preset.processes.remove(process)
 
-                self.listen_thread.pProgressBar_setValue.connect(mw.w_pProgressBar.setValue)
-                self.listen_thread.pProgress_setText.connect(mw.w_pProgress.setText)
+        return code
 
-                self.listen_thread.rProgressBar_setValue.connect(mw.w_rProgressBar.setValueAnimated)
-                # self.listen_thread.gProgressETA_setText.connect(mw.w_gProgressETA.setText)
 
-                self.timer_thread.gProgressETA_setText.connect(mw.w_gProgressETA.setText)
+################################################################################
+# Scheduler
 
-                self.listen_thread.listOfProjects_setCurrentItem.connect(mw.w_listOfProjects.setCurrentItem)
-                self.listen_thread.listOfProjects_setStyleSheet.connect(mw.w_listOfProjects.setStyleSheet)
+class RenderThread(qtc.QThread):
+    """
+    Renders the queue with one Blender instance per device of the pool.
 
-                # self.listen_thread.started.connect(self.listen_worker.run)
-                # self.listen_worker.finished.connect(self.listen_thread.quit)
+    Instances take chunks of frames from the frame scheduler, so an instance
+    that finished early helps the others or starts the next project. Devices
+    of render farm agents join as remote instances, also while rendering.
+    """
 
-                # self.listen_worker.finished.connect(self.listen_worker.deleteLater)
-                # self.listen_thread.finished.connect(self.listen_thread.deleteLater)
+    finished = qtc.pyqtSignal()
+
+
+    def __init__(self):
+        super().__init__()
 
-                self.listen_thread.start()
-                self.timer_thread.start()
+        # (instance, line) from every instance, `None` ends the listener.
+        self.output = Queue()
+        self.instances = []
+        self.workers = []
+        self.lock = Lock()
 
-            preset.process.wait()
+
+    def run(self):
+        preset = store.preset
+        mw = store.mw
+
+        audio.play(RENDER_START_AUDIO)
+        preset.set_status('RENDERING')
+        mw.update_widgets.emit()
+
+        try:
+            devices = get_devices()
+        except ValueError as e:
+            main.log(str(e))
+            devices = get_devices([])
+
+        # Frames saved by an unfinished run of this preset are not rendered again
+        journal_file = get_journal_file(preset)
+        resume = load_resume(journal_file)
+
+        self.journal = RenderJournal(journal_file)
+        self.journal.open(append=bool(resume))
+
+        self.instances = [ RenderInstance(device, self.output, self.journal) for device in devices ]
+
+        jobs = []
+        resumed = 0
+
+        for project in preset.plan.projects:
+            fl = project.frames
+            self.journal.plan(project.file, project.key, fl)
+
+            done = []
+            previous = resume.get(project.file)
+
+            if previous is not None and previous['key'] == project.key:
+                saved = previous['saved']
+                done = [ f for f in fl if f in saved and is_complete(*saved[f]) ]
+
+                for f in done:
+                    preset.renders_list.append(saved[f][0])
+
+            preset.project_progress[project.file] = [len(done), len(fl)]
+            preset.global_frame += len(done)
+            resumed += len(done)
+
+            left = [ f for f in fl if f not in done ] if done else list(fl)
+
+            if left:
+                jobs.append((project, left))
+
+        if resumed:
+            main.log(f'Resuming the last render, {resumed} frames were already rendered.')
+
+        self.scheduler = FrameScheduler(jobs, self.instances,
+                                        should_stop=lambda: preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED'))
+
+        self.listen_thread = RenderListenThread(self.output, self.journal)
+        self.timer = RenderTimer()
+
+        self.listen_thread.gProgressBar_setValue.connect(mw.w_gProgressBar.setValue)
+        self.listen_thread.gProgress_setText.connect(mw.w_gProgress.setText)
+
+        self.listen_thread.pProgressBar_setValue.connect(mw.w_pProgressBar.setValue)
+        self.listen_thread.pProgress_setText.connect(mw.w_pProgress.setText)
+
+        self.listen_thread.rProgressBar_setValue.connect(mw.w_rProgressBar.setValueAnimated)
+
+        self.timer.gProgressETA_setText.connect(mw.w_gProgressETA.setText)
+
+        self.listen_thread.listOfProjects_setCurrentItem.connect(mw.w_listOfProjects.setCurrentItem)
+        self.listen_thread.listOfProjects_setStyleSheet.connect(mw.w_listOfProjects.setStyleSheet)
+
+        self.listen_thread.start()
+        self.timer.start()
+
+        self.watchdog = FrameWatchdog(lambda: list(self.instances))
+        self.watchdog.start()
+
+        for instance in list(self.instances):
+            self.start_worker(instance)
+
+        # Devices of render agents join the local ones
+        if preset.farm is not None:
+
+            for instance in preset.farm.attach(self):
+                self.add_instance(instance)
+
+        if len(self.instances) > 1:
+            main.log(f'Rendering with {len(self.instances)} instances: {", ".join(i.get_name() for i in self.instances)}')
+
+        self.join_workers()
+
+        if preset.farm is not None:
+            preset.farm.detach()
+            self.join_workers()
+
+        self.watchdog.stop()
 
         if not preset.is_status('RENDERING_STOPPING'):
             preset.set_status('RENDERING_FINISHED')
 
+        # Finished runs are not resumed, the listener resets the status
+        status = 'finished' if preset.is_status('RENDERING_FINISHED') else 'stopped'
+
+        self.output.put(None)
+        self.listen_thread.wait()
+
+        self.journal.close(status)
+
         self.finished.emit()
 
 
+    def start_worker(self, instance):
+
+        t = Thread(target=self.work, args=(instance,))
+
+        with self.lock:
+            self.workers.append(t)
+
+        t.start()
+
+
+    def join_workers(self):
+        """
+        Wait for workers, including ones that started meanwhile.
+        """
+
+        while True:
+
+            with self.lock:
+                workers = [ t for t in self.workers if t.is_alive() ]
+
+            if not workers:
+                break
+
+            for t in workers:
+                t.join()
+
+
+    def add_instance(self, instance):
+        """
+        Render with one more instance, e.g. a device of a render agent.
+        """
+
+        instance.output = self.output
+        instance.journal = self.journal
+
+        with self.lock:
+            self.instances.append(instance)
+
+        self.scheduler.add_instance(instance)
+        self.start_worker(instance)
+
+
+    def remove_instance(self, instance):
+        """
+        Instance left, its worker stops after the current chunk.
+        """
+
+        with self.lock:
+
+            if instance in self.instances:
+                self.instances.remove(instance)
+
+        self.scheduler.remove_instance(instance)
+
+
+    def work(self, instance):
+        """
+        Render chunks with one instance until all frames are rendered.
+        """
+
+        while True:
+            chunk = self.scheduler.next_chunk(instance)
+
+            if chunk is None:
+                break
+
+            project, frames = chunk
+            instance.render(project, frames, self.scheduler)
+
+        instance.close()
+
+
 ################################################################################
 # Timer & ETA
 
-class RenderTimerThread(qtc.QThread):
+class RenderTimer(qtc.QObject):
+    """
+    Updates the ETA every second while rendering, runs in the orchestrator
+    loop, the signal is queued to the window.
+    """
+
     gProgressETA_setText = qtc.pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
 
-    def run(self):
-        preset = store.preset
-
-        while True:
-
-            if not preset.is_status('RENDERING'):
-                break
+    def start(self):
+        get_orchestrator().every(1.0, self.update)
 
-            current_time = time.time()
+    def update(self):
+        preset = store.preset
 
-            # Elapsed time
-            elasped_frame_time = current_time - preset.render_start_time
-            elapsed_global_time = current_time - preset.global_render_start_time
-            m, s = divmod(elapsed_global_time, 60)
-            h, m = divmod(m, 60)
+        if not preset.is_status('RENDERING'):
+            return False
 
-            # Average time
-            avg_list = preset.render_avg_time[-3:]
+        current_time = time.time()
 
-            if avg_list:
-                avg_time = sum(avg_list) / len(avg_list)
-            else:
-                avg_time = 0
+        # Elapsed time
+        elasped_frame_time = current_time - preset.render_start_time
+        elapsed_global_time = current_time - preset.global_render_start_time
+        m, s = divmod(elapsed_global_time, 60)
+        h, m = divmod(m, 60)
 
-            avg_m, avg_s = divmod(avg_time, 60)
-            avg_h, avg_m = divmod(avg_m, 60)
+        # Average time
+        avg_list = preset.render_avg_time[-3:]
 
-            # Estimated time
-            eta_time = (preset.global_frames + 1 - preset.global_frame) * avg_time
+        if avg_list:
+            avg_time = sum(avg_list) / len(avg_list)
+        else:
+            avg_time = 0
 
-            if eta_time > 0:
-                eta_time -= elasped_frame_time
+        avg_m, avg_s = divmod(avg_time, 60)
+        avg_h, avg_m = divmod(avg_m, 60)
 
-            eta_m, eta_s = divmod(eta_time, 60)
-            eta_h, eta_m = divmod(eta_m, 60)
+        # Estimated time
+        eta_time = (preset.global_frames + 1 - preset.global_frame) * avg_time
 
-            if eta_time < 0:
-                print("eta:", eta_time, eta_h, eta_m, eta_s, "avg:", avg_time, "glob:", preset.global_frames, "fra:", preset.global_frame)
+        if eta_time > 0:
+            eta_time -= elasped_frame_time
 
-            tt = f'Elapsed: {h:02.0f}:{m:02.0f}:{s:02.0f} | AVG: {avg_h:02.0f}:{avg_m:02.0f}:{avg_s:02.0f} | ETA: {eta_h:02.0f}:{eta_m:02.0f}:{eta_s:02.0f}'
+        eta_m, eta_s = divmod(eta_time, 60)
+        eta_h, eta_m = divmod(eta_m, 60)
 
-            self.gProgressETA_setText.emit(tt)
+        if eta_time < 0:
+            print("eta:", eta_time, eta_h, eta_m, eta_s, "avg:", avg_time, "glob:", preset.global_frames, "fra:", preset.global_frame)
 
-            time.sleep(1.0)
+        tt = f'Elapsed: {h:02.0f}:{m:02.0f}:{s:02.0f} | AVG: {avg_h:02.0f}:{avg_m:02.0f}:{avg_s:02.0f} | ETA: {eta_h:02.0f}:{eta_m:02.0f}:{eta_s:02.0f}'
 
-        self.finished.emit()
+        self.gProgressETA_setText.emit(tt)
 
 
 ################################################################################
@@ -287,11 +844,19 @@ class RenderListenThread(qtc.QThread):
     listOfProjects_setStyleSheet = qtc.pyqtSignal(str)
 
 
-    def __init__(self):
+    def __init__(self, output, journal=None):
         super().__init__()
 
+        self.output = output
+        self.journal = journal
         self.exit_message = None
 
+        # (file, frame) of frames that were started
+        self.started_frames = set()
+
+        # file => row of the project in the list
+        self.project_rows = {}
+
 
     def stop_rendering(self, reason, exit_message=None):
         """
@@ -321,221 +886,281 @@ class RenderListenThread(qtc.QThread):
 
     def run(self):
         """
-        Print info from Blender console.
+        Print info from Blender consoles of all instances.
         """
         preset = store.preset
         mw = store.mw
         log = main.log
 
-        # What is the current project we're rendering.
-        current_project = None
+        while True:
+            item = self.output.get()
 
-        # What is the current frame we're rendering.
-        current_frame = None
+            if item is None:
+                break
 
-        # After project change, we should know if our settings were applied
-        project_settings_flag = False
+            instance, line = item
 
-        # What renders were unsaved due to lack of VRAM or other issues.
-        current_render = []
-        saved_renders = []
-        unsaved_renders = []
+            try:
+                log(line)
+                self.handle_line(instance, line)
 
-        while True:
+            except Exception as e:
+                log(f'Exception during listening: {repr(e)}')
 
-            if preset.is_status('RENDERING_STOPPING', 'RENDERING_FINISHED'):
-                break
+        if preset.is_status('RENDERING_FINISHED'):
+            self.gProgress_setText.emit(f'{preset.global_frame}/{preset.global_frames}')
+            self.pProgress_setText.emit(f'{preset.project_frame}/{preset.project_frames}')
+            self.gProgressBar_setValue.emit(100)
+            self.rProgressBar_setValue.emit(100)
 
-            try:
+            audio.play(RENDER_FINISH_AUDIO)
+            log("Rendering finished.")
 
-                if not preset.process:
-                    break
+            preset.shutdown()
 
-                for line in TextIOWrapper(preset.process.stdout, encoding='utf-8'):
-                    log(line)
+        elif preset.is_status('RENDERING_STOPPING'):
+            audio.play(RENDER_STOP_AUDIO)
+            log("Rendering stopped.")
 
-                    current_time = time.time()
+        else:
+            log(f"Status: {preset.blender_status}")
 
-                    # print("Saved:", saved_renders)
-                    # print("Unsaved:", unsaved_renders)
+        if self.exit_message:
+            log(self.exit_message)
 
-                    # Change project
-                    found = search(r'(?:.*)--background ["](.*?.blend)["].*?-f ["](.*?)["]', line)
+        for file, frames in preset.failed_frames.items():
+            log(f'Failed frames: {file} | {compress_frames(frames)}')
 
-                    if found:
-                        project_settings_flag = True
+        preset.set_status('READY_TO_RENDER')
 
-                        file = found.group(1)
-                        frames = found.group(2)
-                        preset.last_frame_flag = None
-                        preset.project_frame = 0
-                        preset.project_frames = len(frames.split(','))
+        monitor.screen_on()
 
-                        for i in range(mw.w_listOfProjects.count()):
-                            item = mw.w_listOfProjects.item(i)
-                            w_project = mw.w_listOfProjects.itemWidget(item)
-                            project = w_project.project
+        mw.update_widgets.emit()
+        self.finished.emit()
 
-                            if file.strip() != project.file.strip():
-                                continue
 
-                            current_project = project
-                            self.listOfProjects_setCurrentItem.emit(item)
+    def set_project(self, instance, file):
+        """
+        Instance started rendering a project.
+        """
 
-                        current_frame = None
+        preset = store.preset
 
-                        continue
+        instance.settings_flag = True
+        instance.structured = False
+        instance.last_frame = None
 
-                    # Settings check
-                    if project_settings_flag:
-                        found = search(r'(?:.*)All settings loaded successfully!', line)
+        found = self.find_project(file.strip())
 
-                        if found:
-                            project_settings_flag = False
-                            continue
+        if found is not None:
+            instance.project, item = found
+            self.listOfProjects_setCurrentItem.emit(item)
 
-                    # Local progress <100% with Tiles
-                    found = search(r'(?:.*)Rendered (\d+)/(\d+) Tiles, Sample (\d+)/(\d+)', line)
+        # Removed from the list while rendering, the plan still has it
+        elif preset.plan is not None:
+            instance.project = preset.plan.get(file.strip()) or instance.project
 
-                    if found:
+        if instance.project is not None:
+            preset.project_frame, preset.project_frames = preset.project_progress.get(instance.project.file, [0, 0])
 
-                        if project_settings_flag:
-                            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
-                            continue
+        instance.frame = None
 
-                        tile = int(found.group(1))
-                        tiles = int(found.group(2))
-                        sample = int(found.group(3))
-                        samples = int(found.group(4))
-                        progress = max(0.0, min(1.0, (tile * samples + sample) / (tiles * samples)))
 
-                        self.rProgressBar_setValue.emit(round(progress * 100))
+    def find_project(self, file):
+        """
+        Get `(project, item)` of the list by file, the index is built again
+        if the list has changed.
+        """
 
-                        continue
+        w_list = store.mw.w_listOfProjects
 
-                    # Local progress <100%
-                    found = search(r'(?:.*)Sample (\d+)/(\d+)', line)
+        for attempt in range(2):
+            row = self.project_rows.get(file)
 
-                    if found:
+            if row is not None and row < w_list.count():
+                item = w_list.item(row)
+                project = w_list.itemWidget(item).project
 
-                        if project_settings_flag:
-                            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
-                            continue
+                if project.file.strip() == file:
+                    return project, item
 
-                        sample = int(found.group(1))
-                        samples = int(found.group(2))
-                        progress = max(0.0, min(1.0, float(sample) / float(samples)))
+            if attempt:
+                break
 
-                        self.rProgressBar_setValue.emit(round(progress * 100))
+            self.project_rows = {}
 
-                        continue
+            for i in range(w_list.count()):
+                project = w_list.itemWidget(w_list.item(i)).project
+                self.project_rows.setdefault(project.file.strip(), i)
 
-                    # Progress 100%
-                    found = search(r'(?:.*)Saved: [\'|\"](.*?)[\'|\"]', line)
+        return None
 
-                    if found:
 
-                        if project_settings_flag:
-                            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
-                            continue
+    def handle_event(self, instance, event):
+        """
+        Update progress by an event of the render driver or render handlers.
+        """
 
-                        file = found.group(1)
-                        preset.renders_list.append(file)
-                        preset.render_avg_time.append(current_time - preset.render_start_time)
-                        preset.render_start_time = current_time
+        name = event.get('event')
 
-                        self.rProgressBar_setValue.emit(100)
-                        self.pProgressBar_setValue.emit(100)
-                        self.gProgress_setText.emit(f'{preset.global_frame}/{preset.global_frames}')
-                        self.pProgress_setText.emit(f'{preset.project_frame}/{preset.project_frames}')
+        # Change project, render session job
+        if name == 'start':
+            self.set_project(instance, event['file'])
 
-                        if current_render and current_render not in saved_renders:
-                            saved_renders.append(current_render)
+        # Handlers are registered, they stay registered while the file is loaded
+        elif name == 'handlers':
+            instance.structured = True
 
-                        current_render = None
-                        current_frame = None
+        elif name == 'ready':
+            instance.structured = instance.structured or bool(event.get('handlers'))
 
-                        mw.update_widgets.emit()
+        elif name == 'render_pre':
+            self.start_frame(instance, event.get('frame'))
 
-                        continue
+        elif name == 'render_write':
+            self.save_frame(instance, event.get('path'))
 
-                    # Progress...
-                    found = search(r'(?:.*)Rendering single frame \(frame (\d+)\)', line)
+        elif name == 'render_stats':
+            self.update_samples(instance, event.get('text') or "")
 
-                    if not found:
-                        found = search(r'(?:.*)Rendering frame (\d+)', line)
+        elif name == 'render_cancel':
+            instance.frame = None
 
-                    if found:
 
-                        if project_settings_flag:
-                            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
-                            continue
+    def handle_line(self, instance, line):
+        """
+        Update progress by a Blender output line of an instance.
+        """
 
-                        current_frame = int(found.group(1))
-                        preset.frame_flag = current_frame
+        if line.startswith(EVENT_TAG):
+            self.handle_event(instance, loads(line[len(EVENT_TAG):]))
+            return
 
-                        if preset.frame_flag != preset.last_frame_flag:
-                            preset.last_frame_flag = preset.frame_flag
+        parsed = parse_line(line)
 
-                            preset.global_frame += 1
-                            preset.project_frame += 1
-                            gProgress = max(0.0, min(1.0, (preset.global_frame - 1) / preset.global_frames))
-                            pProgress = max(0.0, min(1.0, (preset.project_frame -1 ) / preset.project_frames))
+        if parsed is None:
+            return
 
-                            self.gProgressBar_setValue.emit(round(gProgress * 100))
-                            self.pProgressBar_setValue.emit(round(pProgress * 100))
-                            self.gProgress_setText.emit(f'{max(0, preset.global_frame - 1)}/{preset.global_frames}')
-                            self.pProgress_setText.emit(f'{max(0, preset.project_frame - 1)}/{preset.project_frames}')
+        kind, found = parsed
 
-                            # if current_render and (current_render not in unsaved_renders):
-                            #     unsaved_renders.append(current_render)
+        # Change project, batch file
+        if kind == 'project':
+            self.set_project(instance, found.group('blend'))
+            return
 
-                            #     # Delete old render if the new one was not saved
-                            #     p, f = current_render
-                            #     path = Path(p.compose_render_filename(f))
+        # Settings check
+        if kind == 'settings':
+            instance.settings_flag = False
+            return
 
-                            #     if path.exists():
-                            #         path.unlink()
-                            #         print(f'Removed: {path}')
+        # Handler events tell the rest
+        if instance.structured:
+            return
 
-                            current_render = [current_project, current_frame]
+        if kind in ('tiles', 'samples'):
+            self.set_samples(instance, kind, found)
 
-                        continue
+        # Progress 100%
+        elif kind == 'saved':
+            self.save_frame(instance, found.group('saved'))
 
-                if not preset.process:
-                    break
+        # Progress...
+        elif kind == 'frame':
+            self.start_frame(instance, int(found.group('frame')))
 
-                for line in TextIOWrapper(preset.process.stdin, encoding='utf-8'):
-                    log(line)
 
-            except Exception as e:
-                log(f'Exception during listening: {repr(e)}')
+    def update_samples(self, instance, text):
+        """
+        Update render progress by a stats text.
+        """
 
+        parsed = parse_samples(text)
 
-        if preset.is_status('RENDERING_FINISHED'):
-            self.gProgress_setText.emit(f'{preset.global_frame}/{preset.global_frames}')
-            self.pProgress_setText.emit(f'{preset.project_frame}/{preset.project_frames}')
-            self.gProgressBar_setValue.emit(100)
-            self.rProgressBar_setValue.emit(100)
+        if parsed is not None:
+            self.set_samples(instance, *parsed)
 
-            audio.play(RENDER_FINISH_AUDIO)
-            log("Rendering finished.")
 
-            preset.shutdown()
+    def set_samples(self, instance, kind, found):
+        """
+        Local progress <100%.
+        """
 
-        elif preset.is_status('RENDERING_STOPPING'):
-            audio.play(RENDER_STOP_AUDIO)
-            log("Rendering stopped.")
+        if instance.settings_flag:
+            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
+            return
 
-        else:
-            log(f"Status: {preset.blender_status}")
+        self.rProgressBar_setValue.emit(round(get_progress(kind, found) * 100))
 
-        if self.exit_message:
-            log(self.exit_message)
 
-        preset.set_status('READY_TO_RENDER')
+    def save_frame(self, instance, file):
+        """
+        Frame of the instance was saved to `file`.
+        """
 
-        monitor.screen_on()
+        preset = store.preset
+        mw = store.mw
+
+        current_time = time.time()
+
+        if instance.settings_flag:
+            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
+            return
+
+        preset.renders_list.append(file)
+
+        if self.journal is not None and instance.project is not None and instance.frame is not None:
+            self.journal.saved(instance.project.file, instance.frame, file)
+
+        preset.render_avg_time.append(current_time - preset.render_start_time)
+        preset.render_start_time = current_time
+
+        self.rProgressBar_setValue.emit(100)
+        self.pProgressBar_setValue.emit(100)
+        self.gProgress_setText.emit(f'{preset.global_frame}/{preset.global_frames}')
+        self.pProgress_setText.emit(f'{preset.project_frame}/{preset.project_frames}')
+
+        instance.current_render = None
+        instance.frame = None
 
         mw.update_widgets.emit()
-        self.finished.emit()
+
+
+    def start_frame(self, instance, frame):
+        """
+        Instance started rendering a frame.
+        """
+
+        preset = store.preset
+
+        if instance.settings_flag:
+            self.stop_rendering(reason='NOT_LOADED_SETTINGS')
+            return
+
+        instance.frame = frame
+
+        file = instance.project.file if instance.project else None
+
+        # Frames started again after a crash are counted once
+        if instance.frame == instance.last_frame or (file, instance.frame) in self.started_frames:
+            return
+
+        instance.last_frame = instance.frame
+        self.started_frames.add((file, instance.frame))
+
+        progress = preset.project_progress.setdefault(file, [0, 0])
+        progress[0] += 1
+
+        preset.global_frame += 1
+        preset.project_frame, preset.project_frames = progress
+        gProgress = max(0.0, min(1.0, (preset.global_frame - 1) / max(1, preset.global_frames)))
+        pProgress = max(0.0, min(1.0, (preset.project_frame - 1) / max(1, preset.project_frames)))
+
+        self.gProgressBar_setValue.emit(round(gProgress * 100))
+        self.pProgressBar_setValue.emit(round(pProgress * 100))
+        self.gProgress_setText.emit(f'{max(0, preset.global_frame - 1)}/{preset.global_frames}')
+        self.pProgress_setText.emit(f'{max(0, preset.project_frame - 1)}/{preset.project_frames}')
+
+        instance.current_render = [instance.project, instance.frame]
+
+        if self.journal is not None:
+            self.journal.started(file, instance.frame)
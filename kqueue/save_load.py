@@ -1,12 +1,17 @@
 ################################################################################
 ## Save and Load
 
+import json
 import pickle
+import sqlite3
 
+from time import time
+from threading import local
 from pathlib import Path
+from .config import *
 from . import store
 
-__cache = None
+__connections = local()
 __persistent = None
 
 
@@ -59,29 +64,155 @@ def load_project_file(filename):
     return version, data
 
 
-def save_cache(data):
+def get_cache_connection():
     """
-    Save cache data into file.
+    Get the cache database connection of the current thread.
+
+    WAL mode lets several kQueue instances read while one writes.
+    """
+
+    connection = getattr(__connections, 'connection', None)
+
+    if connection is not None:
+        return connection
+
+    file = store.cache_db
+    file.parent.mkdir(parents=True, exist_ok=True)
+
+    connection = sqlite3.connect(file, timeout=10.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    with connection:
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                file TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    __connections.connection = connection
+
+    # The pickled cache of older versions has no fingerprints and no
+    # per-scene data, the loader could not use its entries.
+    if store.cache_file:
+        store.cache_file.unlink(missing_ok=True)
+
+    return connection
+
+
+def close_cache_connection():
+    """
+    Close the cache database connection of the current thread, threads
+    that used the cache call it before they end.
     """
 
-    global __cache
+    connection = getattr(__connections, 'connection', None)
 
-    __cache = data
+    if connection is None:
+        return
 
-    __save(data, file=store.cache_file)
+    connection.close()
+    __connections.connection = None
 
 
-def load_cache(file=None):
+def load_cache_entry(filename):
+    """
+    Load cached project data of a single file.
     """
-    Load cache file data.
+
+    connection = get_cache_connection()
+    row = connection.execute("SELECT data, accessed FROM cache WHERE file = ?", (filename,)).fetchone()
+
+    if row is None:
+        return None
+
+    data, accessed = row
+    current_time = time()
+
+    # Don't write on every lookup, the hour precision is enough for pruning.
+    if current_time - accessed > CACHE_TOUCH_INTERVAL:
+
+        with connection:
+            connection.execute("UPDATE cache SET accessed = ? WHERE file = ?", (current_time, filename))
+
+    return json.loads(data)
+
+
+def save_cache_entry(filename, data):
     """
+    Insert or update cached project data of a single file.
+    """
+
+    connection = get_cache_connection()
+    text = json.dumps(data)
+
+    with connection:
+        connection.execute("""
+            INSERT INTO cache (file, data, size, accessed) VALUES (?, ?, ?, ?)
+            ON CONFLICT (file) DO UPDATE SET data = excluded.data, size = excluded.size, accessed = excluded.accessed
+        """, (filename, text, len(text), time()))
+
+    if store.watcher:
+        store.watcher.set_cached(filename)
+
+
+def has_cache_entry(filename):
+    """
+    Is there cached project data of a file?
+    """
+
+    connection = get_cache_connection()
+    return connection.execute("SELECT 1 FROM cache WHERE file = ?", (filename,)).fetchone() is not None
+
+
+def prune_cache(max_entries=CACHE_MAX_ENTRIES, max_size=CACHE_MAX_SIZE):
+    """
+    Delete entries of files that were deleted, then the least recently used
+    entries above the entries number and size limits.
+
+    Files are deleted only if their folder still exists, a network share
+    that is offline for a while keeps its entries.
+    """
+
+    connection = get_cache_connection()
+    files = [ row[0] for row in connection.execute("SELECT file FROM cache") ]
+    dead = [ (file,) for file in files if not Path(file).exists() and Path(file).parent.exists() ]
+
+    with connection:
+        connection.executemany("DELETE FROM cache WHERE file = ?", dead)
+
+        # Least recently used entries
+        connection.execute("""
+            DELETE FROM cache WHERE file IN (
+                SELECT file FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+
+        # Entries that don't fit the size limit
+        connection.execute("""
+            DELETE FROM cache WHERE file IN (
+                SELECT file FROM (
+                    SELECT file, SUM(size) OVER (ORDER BY accessed DESC) AS total FROM cache
+                ) WHERE total > ?
+            )
+        """, (max_size,))
+
+    left = { row[0] for row in connection.execute("SELECT file FROM cache") }
+
+    close_cache_connection()
+
+    if store.watcher:
 
-    global __cache
+        for file in files:
 
-    if __cache:
-        return __cache
+            if file not in left:
+                store.watcher.set_cached(file, False)
 
-    return __load(file=store.cache_file)
+    return len(dead)
 
 
 def save_persistent(data):
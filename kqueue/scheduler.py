@@ -0,0 +1,358 @@
+################################################################################
+## Frame Scheduler
+##
+## Splits frames of the queue into chunks that render instances take from one
+## shared queue. Chunk sizes follow measured frame time and Blender overhead
+## of every project, and an instance without work steals frames that were not
+## started yet from the busiest instance, so all instances finish together.
+
+from math import ceil
+from time import time
+from threading import Condition
+from .config import *
+
+
+class ProjectStats():
+    """
+    Measured timing of a project.
+    """
+
+    def __init__(self):
+
+        # Seconds per frame and per invocation, `None` until measured.
+        self.frame_time = None
+        self.overhead = None
+
+        # (frames, seconds) of whole chunks, for invocations without events.
+        self.samples = []
+
+
+    def add_frame_time(self, seconds):
+        self.frame_time = ema(self.frame_time, seconds)
+
+
+    def add_overhead(self, seconds):
+        self.overhead = ema(self.overhead, seconds)
+
+
+    def add_chunk(self, frames, seconds):
+        """
+        Fit `seconds = overhead + frames * frame_time` over whole chunks.
+        """
+
+        self.samples.append((frames, seconds))
+
+        if len(self.samples) == 1:
+
+            if self.frame_time is None:
+                self.frame_time = seconds / frames
+
+            return
+
+        n = len(self.samples)
+        mx = sum(x for x, _ in self.samples) / n
+        my = sum(y for _, y in self.samples) / n
+        sxx = sum((x - mx) ** 2 for x, _ in self.samples)
+
+        if not sxx:
+            self.frame_time = my / mx
+            return
+
+        sxy = sum((x - mx) * (y - my) for x, y in self.samples)
+        frame_time = sxy / sxx
+
+        if frame_time <= 0:
+            return
+
+        self.frame_time = frame_time
+        self.overhead = max(0.0, my - frame_time * mx)
+
+
+def ema(old, new, factor=0.3):
+    return new if old is None else old + (new - old) * factor
+
+
+class Chunk():
+    """
+    Frames an instance is rendering.
+    """
+
+    def __init__(self, project, frames):
+        self.project = project
+        self.frames = list(frames)
+        self.done = set()
+        self.start_time = time()
+        self.stealing = False
+
+
+    def get_unstarted(self):
+        """
+        Number of frames that were not started, the first unfinished one is
+        being rendered.
+        """
+
+        return max(0, len(self.frames) - len(self.done) - 1)
+
+
+class FrameScheduler():
+    """
+    Shared queue of frames.
+
+    `jobs` - list of `(project, frames)` in queue order.
+    `instances` - render instances, `instance.steal(count)` asks the instance
+    to give back `count` frames it didn't start, returns `False` if it can't.
+    `should_stop` - returns `True` when rendering was stopped.
+    """
+
+    def __init__(self, jobs, instances, should_stop=None):
+        self.instances = list(instances)
+        self.condition = Condition()
+        self.should_stop = should_stop or (lambda: False)
+
+        # file => [project, frames left]
+        self.pending = {}
+
+        for project, frames in jobs:
+            self.pending[project.file] = [project, list(frames)]
+
+        # instance => chunk
+        self.running = {}
+
+        # instance => file it rendered last, the file stays loaded there
+        self.last_files = {}
+
+        # file => stats
+        self.stats = {}
+
+
+    def add_instance(self, instance):
+        """
+        Instance joined while rendering, e.g. a render agent connected.
+        """
+
+        with self.condition:
+
+            if instance not in self.instances:
+                self.instances.append(instance)
+
+            self.condition.notify_all()
+
+
+    def remove_instance(self, instance):
+        """
+        Instance left, it gets no more chunks.
+        """
+
+        with self.condition:
+
+            if instance in self.instances:
+                self.instances.remove(instance)
+
+            self.condition.notify_all()
+
+
+    def get_stats(self, project):
+        return self.stats.setdefault(project.file, ProjectStats())
+
+
+    def next_chunk(self, instance):
+        """
+        Wait for the next chunk of the instance, `None` when all is done.
+        """
+
+        with self.condition:
+
+            while not self.should_stop() and instance in self.instances:
+                file = self.pick_file(instance)
+
+                if file is not None:
+                    project, frames = self.pending[file]
+                    size = self.get_chunk_size(project, len(frames))
+
+                    chunk = Chunk(project, frames[:size])
+                    del frames[:size]
+
+                    if not frames:
+                        del self.pending[file]
+
+                    self.running[instance] = chunk
+                    self.last_files[instance] = file
+
+                    return project, chunk.frames
+
+                if not self.running:
+                    return None
+
+                self.steal(instance)
+                self.condition.wait(timeout=1.0)
+
+            return None
+
+
+    def get_next_project(self, instance):
+        """
+        Project of the next chunk of the instance as the queue is now, `None`
+        if nothing is left.
+        """
+
+        with self.condition:
+            file = self.pick_file(instance)
+
+            if file is None:
+                return None
+
+            return self.pending[file][0]
+
+
+    def pick_file(self, instance):
+        """
+        Prefer the project the instance has loaded, then the queue order.
+        """
+
+        if not self.pending:
+            return None
+
+        file = self.last_files.get(instance)
+
+        if file in self.pending:
+            return file
+
+        return next(iter(self.pending))
+
+
+    def get_chunk_size(self, project, left):
+        """
+        Chunk size of a project with `left` frames in the queue.
+
+        Shrinks as the queue drains (guided self-scheduling), but stays large
+        enough to keep invocation overhead under `RENDER_CHUNK_OVERHEAD`.
+        """
+
+        stats = self.get_stats(project)
+        workers = max(1, len(self.instances))
+
+        # Frames of all projects that wait, later projects keep instances busy too
+        total = sum(len(frames) for _, frames in self.pending.values())
+        size = ceil(max(left, total) / (2 * workers))
+
+        if stats.frame_time is None:
+            size = min(size, RENDER_CHUNK_FIRST)
+
+        elif stats.overhead:
+            size = max(size, ceil(stats.overhead / (RENDER_CHUNK_OVERHEAD * stats.frame_time)))
+
+        return max(1, min(left, size, RENDER_CHUNK_MAX))
+
+
+    def steal(self, thief):
+        """
+        Ask the busiest instance to give back half of its unstarted frames.
+        """
+
+        victim, chunk = None, None
+
+        for instance, c in self.running.items():
+
+            if instance is thief or c.stealing:
+                continue
+
+            if chunk is None or c.get_unstarted() > chunk.get_unstarted():
+                victim, chunk = instance, c
+
+        if chunk is None:
+            return
+
+        count = chunk.get_unstarted() // 2
+
+        if count < 1:
+            return
+
+        # Not worth loading the project for less than its overhead
+        stats = self.get_stats(chunk.project)
+
+        if stats.frame_time and stats.overhead and self.last_files.get(thief) != chunk.project.file:
+
+            if count * stats.frame_time < stats.overhead:
+                return
+
+        if victim.steal(count):
+            chunk.stealing = True
+
+
+    def on_ready(self, instance, seconds):
+        """
+        Instance loaded the project and applied settings in `seconds`.
+        """
+
+        with self.condition:
+            chunk = self.running.get(instance)
+
+            if chunk is not None:
+                self.get_stats(chunk.project).add_overhead(seconds)
+
+            # Idle instances can steal from it now
+            self.condition.notify_all()
+
+
+    def on_frame(self, instance, frame, seconds=None):
+        """
+        Instance rendered a frame.
+        """
+
+        with self.condition:
+            chunk = self.running.get(instance)
+
+            if chunk is None:
+                return
+
+            chunk.done.add(frame)
+
+            if seconds is not None:
+                self.get_stats(chunk.project).add_frame_time(seconds)
+
+            self.condition.notify_all()
+
+
+    def give_back(self, instance, frames):
+        """
+        Put frames the instance didn't render back at the front of the queue.
+        """
+
+        with self.condition:
+            chunk = self.running.get(instance)
+
+            if chunk is None:
+                return
+
+            chunk.stealing = False
+
+            if not frames:
+                self.condition.notify_all()
+                return
+
+            chunk.frames = [ f for f in chunk.frames if f not in frames ]
+            file = chunk.project.file
+
+            if file in self.pending:
+                self.pending[file][1][:0] = frames
+            else:
+                self.pending = { file : [chunk.project, list(frames)], **self.pending }
+
+            self.condition.notify_all()
+
+
+    def finish(self, instance, measured=True):
+        """
+        Instance finished its chunk.
+
+        `measured` - were frame times reported by events? Otherwise the whole
+        chunk time is used to estimate frame time and overhead.
+        """
+
+        with self.condition:
+            chunk = self.running.pop(instance, None)
+
+            if chunk is not None and not measured and chunk.frames:
+                self.get_stats(chunk.project).add_chunk(len(chunk.frames), time() - chunk.start_time)
+
+            self.condition.notify_all()
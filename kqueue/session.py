@@ -0,0 +1,290 @@
+################################################################################
+## Render Session
+##
+## Long-lived Blender that runs `render_driver.py` and renders jobs sent over
+## stdin, so consecutive projects don't pay Blender startup and Cycles keeps
+## its kernels loaded.
+
+import json
+import subprocess
+
+from queue import Queue
+from threading import Lock
+from pathlib import Path
+from .orchestrator import get_orchestrator
+from . import store
+
+EVENT_TAG = "KQUEUE-RENDER "
+
+
+class SessionError(Exception):
+    pass
+
+
+class RenderSession():
+    """
+    One Blender waiting for render jobs.
+
+    `output` - queue that receives `(owner, line)` for every output line.
+    `processes` - list that holds the running process, `preset.processes` by
+    default, so stopping the render kills it.
+    `driver` - render driver script, `store.render_driver_py` by default.
+    `on_line` - called with every output line in the orchestrator loop.
+    `hold` - keep output lines from `output` until `release`, a Blender that
+    loads ahead of its job doesn't show in the progress of the current job.
+    """
+
+    def __init__(self, blender_exe, output, owner=None, processes=None, driver=None, on_line=None, hold=False):
+        self.blender_exe = blender_exe
+        self.output = output
+        self.owner = owner
+        self.on_line = on_line
+        self.processes = processes if processes is not None else store.preset.processes
+        self.driver = driver or store.render_driver_py
+        self.process = None
+        self.events = Queue()
+        self.lock = Lock()
+        self.request_id = 0
+        self.current_id = None
+        self.restarts = 0
+        self.held = [] if hold else None
+        self.held_lock = Lock()
+
+        # Project sent with `load`
+        self.loaded_file = None
+
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+
+    def start(self):
+        """
+        Start Blender with the render driver.
+        """
+
+        self.kill()
+
+        self.loaded_file = None
+        events = self.events = Queue()
+        self.process = get_orchestrator().spawn(
+            [
+                self.blender_exe,
+                "--background",
+                "--python", str(Path(self.driver).resolve()),
+                "--",
+                "--serve",
+            ],
+            on_line=lambda line: self.read_line(line, events),
+            # Wake up the job that waits for a crashed process
+            on_exit=lambda code: events.put(None),
+            cwd=str(Path(self.blender_exe).parent),
+        )
+
+        self.processes.append(self.process)
+
+
+    def stop(self):
+        """
+        Ask Blender to quit, kill it if it doesn't.
+        """
+
+        process = self.process
+
+        if process is None or process.poll() is not None:
+            self.kill()
+            return
+
+        try:
+            process.stdin.write(json.dumps({ 'cmd' : 'quit' }) + "\n")
+            process.stdin.flush()
+            process.wait(timeout=10.0)
+
+        except Exception:
+            pass
+
+        self.kill()
+
+
+    def kill(self):
+
+        process, self.process = self.process, None
+
+        if process is None:
+            return
+
+        if process.poll() is None:
+            process.kill()
+
+        try:
+            process.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            pass
+
+        if process in self.processes:
+            self.processes.remove(process)
+
+
+    def read_line(self, line, events):
+        """
+        Pass an output line to the listener, keep events for the session.
+        """
+
+        if self.on_line is not None:
+            self.on_line(line)
+
+        with self.held_lock:
+
+            if self.held is not None:
+                self.held.append(line)
+            else:
+                self.output.put((self.owner, line))
+
+        if not line.startswith(EVENT_TAG):
+            return
+
+        try:
+            events.put(json.loads(line[len(EVENT_TAG):]))
+        except ValueError:
+            pass
+
+
+    def release(self):
+        """
+        Pass the held output lines to the listener, and the next ones as they
+        are read.
+        """
+
+        with self.held_lock:
+            held, self.held = self.held or [], None
+
+            for line in held:
+                self.output.put((self.owner, line))
+
+
+    def send(self, request):
+
+        with self.lock:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+
+
+    def steal(self, count):
+        """
+        Ask the job being rendered to give back `count` frames it didn't
+        start, they arrive as a `stolen` event. Returns `False` if there is
+        no job to ask.
+        """
+
+        request_id = self.current_id
+
+        if request_id is None or not self.is_running():
+            return False
+
+        try:
+            self.send({ 'id' : request_id, 'cmd' : 'steal', 'count' : count })
+        except (OSError, AttributeError):
+            return False
+
+        return True
+
+
+    def load(self, file, scene=None, engine=None, script=None):
+        """
+        Let Blender load a project ahead of its job, returns at once. The job
+        that renders it doesn't load it again.
+        """
+
+        if not self.is_running():
+            self.start()
+
+        self.request_id += 1
+
+        self.send({
+            'id' : self.request_id,
+            'cmd' : 'load',
+            'file' : file,
+            'scene' : scene,
+            'engine' : engine,
+            'script' : script,
+        })
+
+        self.loaded_file = file
+
+
+    def render(self, file, frames, scene=None, engine=None, script=None, on_event=None):
+        """
+        Render frames, returns frames that were rendered.
+
+        `on_event` - called with every event of the job.
+
+        Raises `SessionError` with `frames` attribute set to the rendered
+        frames if Blender crashed or the job failed.
+        """
+
+        if not self.is_running():
+
+            if self.process is not None:
+                self.restarts += 1
+
+            self.start()
+
+        self.request_id += 1
+        request_id = self.request_id
+        rendered = []
+
+        try:
+            self.send({
+                'id' : request_id,
+                'cmd' : 'render',
+                'file' : file,
+                'scene' : scene,
+                'engine' : engine,
+                'script' : script,
+                'frames' : frames,
+            })
+
+        except (OSError, AttributeError) as e:
+            self.kill()
+            error = SessionError(f'Blender does not respond: {e}')
+            error.frames = rendered
+            raise error
+
+        self.current_id = request_id
+
+        try:
+
+            while True:
+                event = self.events.get()
+
+                if event is None:
+                    self.kill()
+                    error = SessionError("Blender has crashed.")
+                    error.frames = rendered
+                    raise error
+
+                if event.get('id') != request_id:
+                    continue
+
+                if on_event is not None:
+                    on_event(event)
+
+                name = event.get('event')
+
+                if name == 'frame':
+                    rendered.append(event.get('frame'))
+
+                elif name == 'stolen':
+                    stolen = set(event.get('frames') or [])
+                    frames = [ f for f in frames if f not in stolen ]
+
+                elif name == 'done':
+                    return rendered
+
+                elif name == 'error':
+                    error = SessionError(event.get('error'))
+                    error.frames = rendered
+                    raise error
+
+        finally:
+            self.current_id = None
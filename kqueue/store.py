@@ -2,11 +2,15 @@
 app = None
 mw = None
 preset = None
+watcher = None
 working_dir = None
 cache_file = None
+cache_db = None
 crash_file = None
 persistent_file = None
 bridge_file = None
 get_data_py = None
+render_driver_py = None
+journal_folder = None
 get_data_bat = None
 temp_folder = None
\ No newline at end of file
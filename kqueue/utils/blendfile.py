@@ -0,0 +1,713 @@
+################################################################################
+## Blend File Reader
+##
+## Reads project data straight from the .blend file blocks, without launching
+## Blender. Only the blocks we need are kept: scenes, objects, collections,
+## the file globals, files the project depends on and the data blocks written
+## right after scenes and collections (markers, collection children, ID
+## properties).
+
+import os
+import gzip
+import struct
+
+try:
+    from compression import zstd # Python 3.14+
+except ImportError:
+
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+# Keys that `get_data.py` writes, the loader needs all of them.
+KEYS = [
+    'frame_start',
+    'frame_end',
+    'scene',
+    'scene_list',
+    'camera',
+    'camera_list',
+    'resolution_x',
+    'resolution_y',
+    'resolution_percentage',
+    'render_filepath',
+    'file_format',
+    'use_persistent_data',
+    'use_adaptive_sampling',
+    'samples',
+    'denoiser',
+    'denoising_use_gpu',
+    'denoising_input_passes',
+    'denoising_prefilter',
+    'markers',
+    'scenes',
+    'dependencies',
+]
+
+# Keys of every scene in `scenes`.
+SCENE_KEYS = [ key for key in KEYS if key not in ['scene', 'scene_list', 'scenes', 'dependencies'] ]
+
+# ID blocks we read, data blocks are kept only after these.
+ID_CODES = [ b'SC', b'GR' ]
+OTHER_CODES = [ b'OB', b'GLOB', b'LI', b'IM', b'CF', b'VO' ]
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+OB_CAMERA = 11
+R_PERSISTENT_DATA = 1 << 26
+VIEW_LAYER_RENDER = 1 << 0
+
+# Image sources: file, sequence, movie, tiled. Sequences and tiles give their folder.
+IMA_SRC_FILES = [ 1, 2, 3, 6 ]
+IMA_SRC_FOLDERS = [ 2, 6 ]
+
+IMAGE_TYPES = {
+    0 : 'TARGA',
+    1 : 'IRIS',
+    4 : 'JPEG',
+    14 : 'TARGA_RAW',
+    17 : 'PNG',
+    20 : 'BMP',
+    21 : 'HDR',
+    22 : 'TIFF',
+    23 : 'OPEN_EXR',
+    26 : 'CINEON',
+    27 : 'DPX',
+    28 : 'OPEN_EXR_MULTILAYER',
+    30 : 'JPEG2000',
+    35 : 'WEBP',
+}
+
+# ID property types.
+IDP_STRING, IDP_INT, IDP_FLOAT, IDP_GROUP, IDP_DOUBLE, IDP_BOOLEAN = 0, 1, 2, 6, 8, 10
+
+# Cycles settings live in ID properties, which are only written once the
+# value was changed. Missing properties have their default value.
+CYCLES_PROPERTIES = {
+    'use_adaptive_sampling' : (True, None),
+    'samples' : (4096, None),
+    'denoiser' : ('OPENIMAGEDENOISE', { 2 : 'OPTIX', 4 : 'OPENIMAGEDENOISE' }),
+    'denoising_use_gpu' : (True, None),
+    'denoising_input_passes' : ('RGB_ALBEDO_NORMAL', { 1 : 'RGB', 2 : 'RGB_ALBEDO', 3 : 'RGB_ALBEDO_NORMAL' }),
+    'denoising_prefilter' : ('ACCURATE', { 1 : 'NONE', 2 : 'FAST', 3 : 'ACCURATE' }),
+}
+
+PRIMITIVES = {
+    'char' : 'b',
+    'uchar' : 'B',
+    'int8_t' : 'b',
+    'uint8_t' : 'B',
+    'short' : 'h',
+    'ushort' : 'H',
+    'int16_t' : 'h',
+    'uint16_t' : 'H',
+    'int' : 'i',
+    'int32_t' : 'i',
+    'uint' : 'I',
+    'uint32_t' : 'I',
+    'int64_t' : 'q',
+    'uint64_t' : 'Q',
+    'float' : 'f',
+    'double' : 'd',
+}
+
+
+class BlendFileError(Exception):
+    pass
+
+
+################################################################################
+# Reading
+
+def open_blend(file):
+    """
+    Open a .blend file as a binary stream, decompress if needed.
+    """
+
+    f = open(file, 'rb')
+    magic = f.read(4)
+    f.seek(0)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+    if magic == ZSTD_MAGIC:
+
+        if zstd is None:
+            f.close()
+            raise BlendFileError("Zstandard module is not available.")
+
+        if hasattr(zstd, 'ZstdDecompressor') and hasattr(zstd.ZstdDecompressor, 'stream_reader'):
+            return zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+
+        return zstd.ZstdFile(f, mode='rb')
+
+    return f
+
+
+def skip(f, size):
+    """
+    Skip bytes, even if the stream is not seekable.
+    """
+
+    try:
+        f.seek(size, 1)
+        return
+
+    except Exception:
+        pass
+
+    while size > 0:
+        chunk = f.read(min(size, 1 << 20))
+
+        if not chunk:
+            break
+
+        size -= len(chunk)
+
+
+class BlendFile():
+    """
+    Header, DNA and the blocks we kept of a .blend file.
+    """
+
+    def __init__(self, file, codes=None):
+        self.file = file
+        self.blocks = []
+        self.addresses = {}
+        self.structs = {}
+        self.struct_names = []
+
+        codes = codes or ID_CODES + OTHER_CODES
+
+        with open_blend(file) as f:
+            self.read_header(f)
+            self.read_blocks(f, codes)
+
+
+    def read_header(self, f):
+        header = f.read(12)
+
+        if not header.startswith(b'BLENDER'):
+            raise BlendFileError(f'Not a .blend file: {self.file}')
+
+        # BLENDER-v402 or BLENDER17-01v0500
+        if header[7:9].isdigit():
+            header += f.read(int(header[7:9]) - 12)
+            self.pointer_size = 8
+            self.endian = '<' if header[12:13] == b'v' else '>'
+            self.version = int(header[13:17])
+            self.large_heads = True
+
+        else:
+            self.pointer_size = 8 if header[7:8] == b'-' else 4
+            self.endian = '<' if header[8:9] == b'v' else '>'
+            self.version = int(header[9:12])
+            self.large_heads = False
+
+        self.header = header
+
+        if self.large_heads:
+            self.head_format = self.endian + 'iiQqq'
+        elif self.pointer_size == 8:
+            self.head_format = self.endian + '4siQii'
+        else:
+            self.head_format = self.endian + '4siIii'
+
+        self.head_size = struct.calcsize(self.head_format)
+        self.pointer_format = self.endian + ('Q' if self.pointer_size == 8 else 'I')
+
+
+    def read_blocks(self, f, codes):
+        keep_data = False
+        dna = None
+
+        while True:
+            head = f.read(self.head_size)
+
+            if len(head) < self.head_size:
+                break
+
+            if self.large_heads:
+                code, sdna, old, size, count = struct.unpack(self.head_format, head)
+                code = struct.pack(self.endian + 'i', code)
+            else:
+                code, size, old, sdna, count = struct.unpack(self.head_format, head)
+
+            code = code.rstrip(b'\0')
+
+            if code == b'ENDB':
+                break
+
+            if code == b'DNA1':
+                dna = f.read(size)
+                continue
+
+            if code == b'DATA':
+                keep = keep_data
+            else:
+                keep = code in codes
+                keep_data = code in ID_CODES
+
+            if not keep:
+                skip(f, size)
+                continue
+
+            block = Block(self, code, f.read(size), old, sdna, count)
+            self.blocks.append(block)
+            self.addresses[old] = block
+
+        if dna is None:
+            raise BlendFileError(f'No DNA found: {self.file}')
+
+        self.read_dna(dna)
+
+
+    def read_dna(self, data):
+        """
+        Parse the SDNA block, so we know every struct layout.
+        """
+
+        e = self.endian
+        pos = 8
+
+        def align(pos):
+            return (pos + 3) & ~3
+
+        def read_strings(pos):
+            count = struct.unpack_from(e + 'i', data, pos)[0]
+            pos += 4
+            rv = []
+
+            for _ in range(count):
+                end = data.index(b'\0', pos)
+                rv.append(data[pos:end].decode('utf-8', 'replace'))
+                pos = end + 1
+
+            # Skip the padding and the next tag.
+            return rv, align(pos) + 4
+
+        # SDNA NAME ... TYPE ...
+        names, pos = read_strings(pos)
+        types, pos = read_strings(pos)
+
+        # TLEN ... STRC
+        lengths = struct.unpack_from(e + f'{len(types)}h', data, pos)
+        pos = align(pos + 2 * len(types)) + 4
+
+        # STRC
+        count = struct.unpack_from(e + 'i', data, pos)[0]
+        pos += 4
+
+        for _ in range(count):
+            type_index, fields_count = struct.unpack_from(e + 'hh', data, pos)
+            pos += 4
+
+            fields = {}
+            offset = 0
+
+            for _ in range(fields_count):
+                field_type, field_name = struct.unpack_from(e + 'hh', data, pos)
+                pos += 4
+
+                type_name = types[field_type]
+                name = names[field_name]
+                pointer = '*' in name
+                dims = [ int(d) for d in name.replace(']', '[').split('[')[1::2] if d ]
+                clean = name.split('[')[0].strip('*()')
+
+                size = self.pointer_size if pointer else lengths[field_type]
+
+                for dim in dims:
+                    size *= dim
+
+                fields[clean] = Field(type_name, offset, size, pointer, dims)
+                offset += size
+
+            self.structs[types[type_index]] = fields
+            self.struct_names.append(types[type_index])
+
+
+    def get_blocks(self, code):
+        return [ block for block in self.blocks if block.code == code ]
+
+
+    def get_block(self, address):
+        return self.addresses.get(address)
+
+
+class Field():
+
+    def __init__(self, type_name, offset, size, pointer, dims):
+        self.type_name = type_name
+        self.offset = offset
+        self.size = size
+        self.pointer = pointer
+        self.dims = dims
+
+
+class Block():
+    """
+    File block with a struct view on its data.
+    """
+
+    def __init__(self, blend, code, data, old, sdna, count):
+        self.blend = blend
+        self.code = code
+        self.data = data
+        self.old = old
+        self.sdna = sdna
+        self.count = count
+
+
+    def get_struct_name(self):
+        return self.blend.struct_names[self.sdna]
+
+
+    def get(self, path, default=None, offset=0, struct_name=None):
+        """
+        Get struct value by dotted path: `r.im_format.imtype`.
+        """
+
+        blend = self.blend
+        struct_name = struct_name or self.get_struct_name()
+
+        for name in path.split('.'):
+            fields = blend.structs.get(struct_name, {})
+
+            if name not in fields:
+                return default
+
+            field = fields[name]
+            offset += field.offset
+            struct_name = field.type_name
+
+            if field.pointer:
+                return struct.unpack_from(blend.pointer_format, self.data, offset)[0]
+
+        if struct_name in blend.structs:
+            return (struct_name, offset)
+
+        if struct_name == 'char' and field.dims:
+            raw = self.data[offset:offset + field.size]
+            return raw.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+        fmt = PRIMITIVES.get(struct_name)
+
+        if fmt is None:
+            return default
+
+        return struct.unpack_from(blend.endian + fmt, self.data, offset)[0]
+
+
+    def get_any(self, *paths, default=None):
+        """
+        Get the first existing value, for fields renamed between versions.
+        """
+
+        for path in paths:
+            value = self.get(path)
+
+            if value is not None:
+                return value
+
+        return default
+
+
+    def get_name(self):
+        return self.get('id.name', "")[2:]
+
+
+    def iter_list(self, path):
+        """
+        Iterate over `ListBase` items.
+        """
+
+        address = self.get(f'{path}.first')
+        seen = set()
+
+        while address and address not in seen:
+            seen.add(address)
+            block = self.blend.get_block(address)
+
+            if block is None:
+                raise BlendFileError(f'Unknown list item: {address}')
+
+            yield block
+
+            address = block.get('next')
+
+
+################################################################################
+# Project Data
+
+def read_blend_data(file, blend=None):
+    """
+    Read project data like `get_data.py` does.
+
+    `blend` - already read `BlendFile` of this file.
+
+    Returns a dict with the keys we managed to decode or `None` if the file
+    could not be read at all.
+    """
+
+    if blend is None:
+
+        try:
+            blend = BlendFile(file)
+        except Exception:
+            return None
+
+    data = {}
+
+    scenes = blend.get_blocks(b'SC')
+
+    if not scenes:
+        return data
+
+    data['scene_list'] = sorted([ scene.get_name() for scene in scenes ])
+
+    # Active scene
+    scene = None
+
+    for glob in blend.get_blocks(b'GLOB'):
+        scene = blend.get_block(glob.get('curscene'))
+
+    if scene is None:
+        scene = scenes[0]
+
+    data.update(read_scene_data(blend, scene))
+    data['scene'] = scene.get_name()
+
+    data['scenes'] = {}
+
+    for scene in scenes:
+        data['scenes'][scene.get_name()] = read_scene_data(blend, scene)
+
+    try:
+        data['dependencies'] = read_dependencies(blend)
+    except Exception:
+        pass
+
+    return data
+
+
+def is_complete(data):
+    """
+    Does project data have all the keys the loader needs, for every scene?
+    """
+
+    if not data or not all(key in data for key in KEYS):
+        return False
+
+    return all(key in scene_data for scene_data in data['scenes'].values() for key in SCENE_KEYS)
+
+
+def read_scene_data(blend, scene):
+    """
+    Read render data of a scene block.
+    """
+
+    data = {}
+
+    def decode(func):
+        try:
+            func()
+        except Exception:
+            pass
+
+    def general():
+        data['frame_start'] = scene.get('r.sfra')
+        data['frame_end'] = scene.get('r.efra')
+        data['resolution_x'] = scene.get('r.xsch')
+        data['resolution_y'] = scene.get('r.ysch')
+        data['resolution_percentage'] = scene.get('r.size')
+        data['render_filepath'] = scene.get('r.pic')
+        data['use_persistent_data'] = bool(scene.get('r.mode', 0) & R_PERSISTENT_DATA)
+
+        file_format = IMAGE_TYPES.get(scene.get('r.im_format.imtype'))
+
+        if file_format:
+            data['file_format'] = file_format
+
+        for key in list(data):
+
+            if data[key] is None:
+                del data[key]
+
+    def camera():
+        address = scene.get('camera')
+
+        if not address:
+            data['camera'] = None
+            return
+
+        block = blend.get_block(address)
+
+        if block is not None:
+            data['camera'] = block.get_name()
+
+    def camera_list():
+        data['camera_list'] = [ ob.get_name() for ob in get_scene_objects(blend, scene)
+                                if ob.get('type') == OB_CAMERA ]
+
+    def markers():
+        data['markers'] = [ marker.get('frame') for marker in scene.iter_list('markers') ]
+
+    def cycles():
+        data.update(read_cycles_properties(blend, scene))
+
+    def view_layers():
+        data['view_layers'] = [ { 'name' : vl.get('name'), 'use' : bool(vl.get('flag', 0) & VIEW_LAYER_RENDER) }
+                                for vl in scene.iter_list('view_layers') ]
+
+    for func in [general, camera, camera_list, markers, cycles, view_layers]:
+        decode(func)
+
+    return data
+
+
+def read_dependencies(blend):
+    """
+    Get absolute paths of linked libraries, images and caches, like
+    `get_data.py` does.
+    """
+
+    rv = set()
+
+    def get_path(block):
+        return block.get_any('filepath', 'name', default="")
+
+    def resolve(path, library_address, depth=0):
+        """
+        Resolve `//` paths, relative to the library the ID comes from.
+        """
+
+        if not path.startswith("//"):
+            return os.path.normpath(path)
+
+        base = os.path.dirname(os.path.abspath(blend.file))
+        library = blend.get_block(library_address) if library_address else None
+
+        if library is not None and depth < 16:
+            base = os.path.dirname(resolve(get_path(library), library.get('parent'), depth + 1))
+
+        return os.path.normpath(os.path.join(base, path[2:]))
+
+    def add(block, library_address, folder=False):
+        path = get_path(block)
+
+        if not path:
+            return
+
+        path = resolve(path, library_address)
+        rv.add(os.path.dirname(path) if folder else path)
+
+    for library in blend.get_blocks(b'LI'):
+        add(library, library.get('parent'))
+
+    for image in blend.get_blocks(b'IM'):
+        source = image.get('source')
+
+        if source not in IMA_SRC_FILES or image.get('packedfile') or image.get('packedfiles.first'):
+            continue
+
+        add(image, image.get('id.lib'), folder=source in IMA_SRC_FOLDERS)
+
+    for code in [b'CF', b'VO']:
+
+        for block in blend.get_blocks(code):
+
+            if not block.get('packedfile'):
+                add(block, block.get('id.lib'))
+
+    return sorted(rv)
+
+
+def get_scene_objects(blend, scene):
+    """
+    Get scene objects in the order of `scene.objects`.
+    """
+
+    rv = []
+    seen = set()
+
+    def walk(collection):
+
+        if collection is None:
+            raise BlendFileError("Unknown collection.")
+
+        for item in collection.iter_list('gobject'):
+            ob = blend.get_block(item.get('ob'))
+
+            if ob is None:
+                raise BlendFileError("Unknown object.")
+
+            if ob.old in seen:
+                continue
+
+            seen.add(ob.old)
+            rv.append(ob)
+
+        for child in collection.iter_list('children'):
+            walk(blend.get_block(child.get('collection')))
+
+    walk(blend.get_block(scene.get('master_collection')))
+
+    return rv
+
+
+def read_cycles_properties(blend, scene):
+    """
+    Read Cycles settings from the scene ID properties.
+    """
+
+    stored = {}
+
+    for path in ['id.system_properties', 'id.properties']:
+        group = blend.get_block(scene.get(path) or 0)
+
+        if group is None:
+            continue
+
+        for prop in group.iter_list('data.group'):
+
+            if prop.get('name') != 'cycles' or prop.get('type') != IDP_GROUP:
+                continue
+
+            for child in prop.iter_list('data.group'):
+                stored[child.get('name')] = child
+
+        if stored:
+            break
+
+    data = {}
+
+    for name, (default, items) in CYCLES_PROPERTIES.items():
+        prop = stored.get(name)
+
+        if prop is None:
+            data[name] = default
+            continue
+
+        if prop.get('type') not in [IDP_INT, IDP_BOOLEAN]:
+            continue
+
+        value = prop.get('data.val')
+
+        if items is not None:
+
+            if value not in items:
+                continue
+
+            value = items[value]
+
+        elif isinstance(default, bool):
+            value = bool(value)
+
+        data[name] = value
+
+    return data
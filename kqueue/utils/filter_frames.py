@@ -1,7 +1,15 @@
 ################################################################################
 ## Filter Frames
+##
+## Frame input like "1-100, 120-200x2, ^150-160" becomes a `FrameSet` of
+## integer ranges with a step, so long sequences are counted, searched and
+## sliced without a list of every frame. Input with fractional frames is
+## expanded frame by frame as before, those frames are kept one by one.
 
 from re import compile, VERBOSE
+from math import ceil, floor, gcd
+from bisect import bisect_right
+from itertools import accumulate, chain
 from numpy import arange, around, isclose
 
 rx_filter = compile(r"""
@@ -38,6 +46,8 @@ rx_exclude = compile(r"""
 def filter_frames(frame_input, increment=1, filter_individual=False):
     """
     Filter frame input & convert it to a set of frames.
+
+    Returns a `FrameSet`, `None` if there are no frames in the input.
     """
     def float_filter(st):
         try:
@@ -66,53 +76,73 @@ def filter_frames(frame_input, increment=1, filter_individual=False):
                               for elem in input_filtered[first_exclude_item:]]
 
     """
-    Find single values as well as all ranges & compile frame list.
+    Find single values as well as all ranges: (exclude, start, end, step, conform).
     """
-    frame_list, exclude_list, conform_list  = [], [], []
+    items = []
 
     conform_flag = False
     for item in input_filtered:
         frame = float_filter(item)
 
         if frame is not None: # Single floats
-            frame_list.append(frame)
-            if conform_flag: conform_list.append(frame)
+            items.append((False, frame, frame, increment, conform_flag))
 
         else:  # Ranges & items to exclude
             exclude_item = rx_exclude.search(item)
             range_item = rx_group.search(item)
 
             if exclude_item:  # Single exclude items like ^-3 or ^10
-                exclude_list.append(float_filter(exclude_item.group(1)))
+                frame = float_filter(exclude_item.group(1))
+                items.append((True, frame, frame, increment, False))
                 if filter_individual: conform_flag = True
 
             elif range_item:  # Ranges like 1-10, 20-10, 1-3x0.1, ^2-7 or ^-3--1
                 start = min(float_filter(range_item.group(1)), float_filter(range_item.group(3)))
                 end = max(float_filter(range_item.group(1)), float_filter(range_item.group(3)))
                 step = increment if not range_item.group(4) else float_filter(range_item.group(6))
+                exclude = item.startswith(("^", "!"))
+
+                items.append((exclude, start, end, step, conform_flag and not exclude and start < end))
+                if exclude and filter_individual and start < end: conform_flag = True
+
+    """
+    Integer frames stay ranges.
+    """
+    if not filter_individual and all(float(v).is_integer() and step > 0 for _, start, end, step, _ in items for v in (start, end, step)):
+        frames, excluded = FrameSet(), FrameSet()
 
-                if start < end:  # Build the range & add all items to list
-                    frame_range = around(arange(start, end, step), decimals=5).tolist()
-                    if item.startswith(("^", "!")):
-                        if filter_individual: conform_flag = True
-                        exclude_list.extend(frame_range)
-                        if isclose(step, (end - frame_range[-1])):
-                            exclude_list.append(end)
-                    else:
-                        frame_list.extend(frame_range)
-                        if isclose(step, (end - frame_range[-1])):
-                            frame_list.append(end)
-
-                        if conform_flag:
-                            conform_list.extend(frame_range)
-                            if isclose(step, (end - frame_range[-1])):
-                                conform_list.append(end)
-
-                elif start == end:  # Not a range, add start frame
-                    if not item.startswith(("^", "!")):
-                        frame_list.append(start)
-                    else:
-                        exclude_list.append(start)
+        for exclude, start, end, step, _ in items:
+            frame_range = FrameSet.from_range(int(start), int(end), int(step))
+
+            if exclude:
+                excluded |= frame_range
+            else:
+                frames |= frame_range
+
+        return frames - excluded
+
+    """
+    Compile frame list.
+    """
+    frame_list, exclude_list, conform_list  = [], [], []
+
+    for exclude, start, end, step, conform in items:
+
+        if start < end:  # Build the range
+            frame_range = around(arange(start, end, step), decimals=5).tolist()
+            if frame_range and isclose(step, (end - frame_range[-1])):
+                frame_range.append(end)
+
+        else:  # Not a range, add start frame
+            frame_range = [start]
+
+        if exclude:
+            exclude_list.extend(frame_range)
+        else:
+            frame_list.extend(frame_range)
+
+        if conform:
+            conform_list.extend(frame_range)
 
     if filter_individual:
         exclude_list = sorted(set(exclude_list).difference(conform_list))
@@ -122,4 +152,369 @@ def filter_frames(frame_input, increment=1, filter_individual=False):
     Return integers whenever possible.
     """
     int_frames = [ int_filter(frame) for frame in float_frames ]
-    return float_frames if None in int_frames else int_frames
\ No newline at end of file
+    return FrameSet(float_frames if None in int_frames else int_frames)
+
+
+def compress_frames(frames, separator=".."):
+    """
+    Join frames to a string of ranges, "1..10,12,15..20" by default, the
+    syntax of the Blender `-f` argument.
+    """
+
+    return FrameSet(frames).format(separator, steps=False)
+
+class FrameSet():
+    """
+    Sorted set of frames, read only.
+
+    Frames are stored in pieces, `range` objects of integer frames or
+    1-tuples of fractional ones. Pieces are sorted and don't overlap, every
+    piece ends before the next one starts.
+    """
+
+    def __init__(self, frames=(), pieces=None):
+
+        if isinstance(frames, FrameSet):
+            pieces = frames.pieces
+
+        elif pieces is None:
+            pieces = get_pieces(sorted(set(frames)))
+
+        self.pieces = tuple(pieces)
+        self.starts = [ p[0] for p in self.pieces ]
+
+        # Frames up to the end of every piece
+        self.ends = list(accumulate(len(p) for p in self.pieces))
+
+
+    @classmethod
+    def from_range(cls, start, end, step=1):
+        """
+        Integer frames from `start` to `end` including, every `step` frame.
+        """
+
+        return cls(pieces=[ range(start, end + 1, step) ] if start <= end else [])
+
+
+    def __len__(self):
+        return self.ends[-1] if self.ends else 0
+
+
+    def __iter__(self):
+        return chain.from_iterable(self.pieces)
+
+
+    def __contains__(self, frame):
+        i = bisect_right(self.starts, frame) - 1
+
+        return i >= 0 and contains(self.pieces[i], frame)
+
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+
+            if step != 1:
+                return FrameSet(self[i] for i in range(start, stop, step))
+
+            return self.slice(start, stop)
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('FrameSet index out of range')
+
+        i = bisect_right(self.ends, index)
+        piece = self.pieces[i]
+
+        return piece[index - self.ends[i] + len(piece)]
+
+
+    def __eq__(self, other):
+
+        if not isinstance(other, FrameSet):
+            return NotImplemented
+
+        return self.pieces == other.pieces or (len(self) == len(other) and all(a == b for a, b in zip(self, other)))
+
+
+    def __or__(self, other):
+        return self.union(other)
+
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+
+    def __str__(self):
+        return self.format()
+
+
+    def __repr__(self):
+        return f'FrameSet("{self}")'
+
+
+    def slice(self, start, stop):
+        """
+        Frames from index `start` to `stop`.
+        """
+
+        pieces = []
+        i = bisect_right(self.ends, start)
+
+        while start < stop and i < len(self.pieces):
+            piece = self.pieces[i]
+            offset = self.ends[i] - len(piece)
+            pieces.append(piece[start - offset:stop - offset])
+            start = self.ends[i]
+            i += 1
+
+        return FrameSet(pieces=pieces)
+
+
+    def union(self, other):
+        return FrameSet(pieces=combine(self.pieces, FrameSet(other).pieces, True))
+
+
+    def difference(self, other):
+        return FrameSet(pieces=combine(self.pieces, FrameSet(other).pieces, False))
+
+
+    def format(self, separator="-", steps=True):
+        """
+        Get frames as ranges, "1-10,12,20-30x2" is frame input again.
+
+        `steps` - write ranges with a step, otherwise their frames. Frame
+        input has no stepped range with a negative end, like "-11--5x3",
+        those frames are written one by one.
+        """
+
+        parts = []
+
+        for piece in self.pieces:
+
+            if len(piece) <= 2 or (piece.step > 1 and (not steps or piece[-1] < 0)):
+                parts.extend(str(f) for f in piece)
+
+            elif piece.step == 1:
+                parts.append(f'{piece[0]}{separator}{piece[-1]}')
+
+            else:
+                parts.append(f'{piece[0]}{separator}{piece[-1]}x{piece.step}')
+
+        return ",".join(parts)
+
+
+def contains(piece, frame):
+    """
+    Is the frame in the piece? `in` on a range iterates over other numbers
+    than `int`.
+    """
+
+    if isinstance(piece, range):
+
+        if isinstance(frame, float) and frame.is_integer():
+            frame = int(frame)
+
+        return isinstance(frame, int) and frame in piece
+
+    return frame in piece
+
+
+def get_pieces(frames):
+    """
+    Split sorted unique frames to pieces, runs of integer frames with one step
+    become ranges.
+    """
+
+    pieces = []
+    start = step = last = None
+
+    for frame in frames:
+
+        if not isinstance(frame, int):
+
+            if start is not None:
+                pieces.append(range(start, last + 1, step or 1))
+                start = None
+
+            pieces.append((frame,))
+
+        elif start is None:
+            start = last = frame
+            step = None
+
+        elif step is None or frame - last == step:
+            step = frame - last
+            last = frame
+
+        # Two frames are no run, the second may start one
+        elif last - start == step:
+            pieces.append(range(start, start + 1))
+            start, step, last = last, frame - last, frame
+
+        else:
+            pieces.append(range(start, last + 1, step))
+            start = last = frame
+            step = None
+
+    if start is not None:
+        pieces.append(range(start, last + 1, step or 1))
+
+    return pieces
+
+
+def join_pieces(pieces):
+    """
+    Join neighbouring pieces that continue one range.
+    """
+
+    joined = []
+
+    for piece in pieces:
+
+        if not len(piece):
+            continue
+
+        if joined and isinstance(piece, range) and isinstance(joined[-1], range):
+            last = joined[-1]
+            step = last.step if len(last) > 1 else piece.step if len(piece) > 1 else 1
+
+            if piece[0] - last[-1] == step and (len(last) == 1 or len(piece) == 1 or last.step == piece.step):
+                joined[-1] = range(last[0], piece[-1] + 1, step)
+                continue
+
+        joined.append(piece)
+
+    return joined
+
+
+def get_index(piece, value, inclusive):
+    """
+    Index of the first frame of a range from `value` on, after `value` if not
+    `inclusive`.
+    """
+
+    distance = value - piece.start
+
+    if isinstance(distance, int):
+        index = -(-distance // piece.step) if inclusive else distance // piece.step + 1
+    else:
+        index = ceil(distance / piece.step) if inclusive else floor(distance / piece.step) + 1
+
+    return min(max(index, 0), len(piece))
+
+
+def cut(piece, low, high, open):
+    """
+    Frames of the piece from `low` to `high`, without them if `open`.
+    """
+
+    if isinstance(piece, range):
+        return piece[get_index(piece, low, not open):get_index(piece, high, open)]
+
+    if (low < piece[0] < high) if open else (low <= piece[0] <= high):
+        return piece
+
+    return ()
+
+
+def covers(piece, other):
+    """
+    Are all frames of `other` in the piece?
+    """
+
+    if len(other) == 1 or not isinstance(piece, range):
+        return all(contains(piece, f) for f in other)
+
+    return other.step % piece.step == 0 and contains(piece, other[0]) and contains(piece, other[-1])
+
+
+def subtract(piece, other):
+    """
+    Frames of a range that are not in another range, returns pieces.
+    """
+
+    before = piece[:get_index(piece, other[0], True)]
+    after = piece[get_index(piece, other[-1], False):]
+    middle = piece[len(before):len(piece) - len(after)]
+
+    if len(other) == 1 or len(middle) <= 1:
+        middle = get_pieces([ f for f in middle if not contains(other, f) ])
+        return [before] + middle + [after]
+
+    # Frames of `other` repeat every `period` frames, a range of the frames
+    # left is cut in `classes` ranges of one remainder. They are in `other`
+    # or not as a whole.
+    period = middle.step * other.step // gcd(middle.step, other.step)
+    classes = period // middle.step
+
+    if classes <= len(middle):
+        left = [ middle[j::classes] for j in range(classes) if not contains(other, middle[j]) ]
+
+        if len(left) <= 1:
+            return [before] + left + [after]
+
+    return [before] + get_pieces([ f for f in middle if not contains(other, f) ]) + [after]
+
+
+def combine(pieces, others, union):
+    """
+    Union or difference of two piece lists. The number line is split at the
+    first and last frames of all pieces, in every window each list has one
+    piece at most.
+    """
+
+    points = sorted(set(chain.from_iterable((p[0], p[-1]) for p in chain(pieces, others))))
+    result = []
+    a = b = 0
+
+    for i, point in enumerate(points):
+        windows = [ (point, point, False) ]
+
+        if i + 1 < len(points):
+            windows.append((point, points[i + 1], True))
+
+        for low, high, open in windows:
+
+            # Pieces that ended before the window
+            limit = high if open else low
+
+            while a < len(pieces) and pieces[a][-1] < limit:
+                a += 1
+
+            while b < len(others) and others[b][-1] < limit:
+                b += 1
+
+            pa = cut(pieces[a], low, high, open) if a < len(pieces) else ()
+            pb = cut(others[b], low, high, open) if b < len(others) else ()
+
+            if not len(pa) and not len(pb):
+                continue
+
+            if not len(pb):
+                result.append(pa)
+
+            elif union:
+
+                if len(pa) and covers(pa, pb):
+                    result.append(pa)
+
+                elif not len(pa) or covers(pb, pa):
+                    result.append(pb)
+
+                else:
+                    result.extend(get_pieces(sorted(set(pa) | set(pb))))
+
+            elif not len(pa):
+                continue
+
+            elif isinstance(pa, range) and isinstance(pb, range):
+                result.extend(subtract(pa, pb))
+
+            else:
+                result.extend(get_pieces([ f for f in pa if not contains(pb, f) ]))
+
+    return join_pieces(result)
@@ -0,0 +1,143 @@
+################################################################################
+## File Fingerprint
+##
+## Size and nanosecond modification time are checked first, they are cheap.
+## Only when they differ the content hash is computed, so touching a file
+## without changing its render data does not force a Blender re-read.
+##
+## Files the project depends on (libraries, images, caches) are only compared
+## by their `stat` state, hashing textures would cost more than a reload.
+
+import os
+import json
+
+from hashlib import blake2b
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from . import blendfile
+
+CHUNK_SIZE = 1 << 20
+
+# Hashes kept in memory, the least recently used are forgotten first
+HASHES_MAX = 4096
+
+# (file, size, mtime_ns) => hash, so polling does not hash the same file twice.
+__hashes = OrderedDict()
+__lock = Lock()
+
+
+def get_fingerprint(file, previous=None):
+    """
+    Get file fingerprint: `{'size', 'mtime_ns', 'hash'}`.
+
+    `previous` - known fingerprint, returned as is if the file was not touched.
+    """
+
+    stat = Path(file).stat()
+
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+
+    return {
+        'size' : stat.st_size,
+        'mtime_ns' : stat.st_mtime_ns,
+        'hash' : get_hash(file, stat.st_size, stat.st_mtime_ns),
+    }
+
+
+def is_same(fingerprint, file):
+    """
+    Is the render-relevant content of the file unchanged?
+    """
+
+    if not fingerprint or not Path(file).exists():
+        return False
+
+    return get_fingerprint(file, previous=fingerprint)['hash'] == fingerprint.get('hash')
+
+
+def get_state(path):
+    """
+    Get `(exists, size, mtime_ns)` of a path.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (False, 0, 0)
+
+    return (True, stat.st_size, stat.st_mtime_ns)
+
+
+def get_dependency_states(paths):
+    """
+    Get `{path: [exists, size, mtime_ns]}` of project dependencies.
+    """
+
+    return { path : list(get_state(path)) for path in paths }
+
+
+def is_same_dependencies(states, get_state=get_state):
+    """
+    Are all dependencies in the same state they were when recorded?
+
+    `get_state` - state getter, the watcher passes its own.
+    """
+
+    if states is None:
+        return False
+
+    return all(tuple(get_state(path)) == tuple(state) for path, state in states.items())
+
+
+def get_hash(file, size, mtime_ns):
+    """
+    Get memoized content hash.
+    """
+
+    key = (str(file), size, mtime_ns)
+
+    with __lock:
+
+        if key in __hashes:
+            __hashes.move_to_end(key)
+            return __hashes[key]
+
+    rv = compute_hash(file)
+
+    with __lock:
+        __hashes[key] = rv
+
+        while len(__hashes) > HASHES_MAX:
+            __hashes.popitem(last=False)
+
+    return rv
+
+
+def compute_hash(file):
+    """
+    Hash the header and the decoded render data of the file blocks.
+
+    If the blocks can't be fully decoded, the whole file is hashed.
+    """
+
+    h = blake2b(digest_size=16)
+
+    try:
+        blend = blendfile.BlendFile(file)
+        data = blendfile.read_blend_data(file, blend=blend)
+    except Exception:
+        blend, data = None, None
+
+    if blend is not None and blendfile.is_complete(data):
+        h.update(blend.header)
+        h.update(json.dumps(data, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    with open(file, 'rb') as f:
+
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+
+    return h.hexdigest()
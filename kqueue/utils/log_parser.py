@@ -0,0 +1,105 @@
+################################################################################
+## Blender Log Parser
+##
+## Classifies Blender output lines for the render listener in one pass. Most
+## lines are "Fra:" progress lines, a prefix check sends them to the smaller
+## progress pattern. Other lines are rejected by keywords before the one
+## precompiled alternation of all the patterns runs.
+
+from re import compile
+
+rx_samples = compile(
+    r'Rendered (?P<tile>\d+)/(?P<tiles>\d+) Tiles, Sample (?P<tile_sample>\d+)/(?P<tile_samples>\d+)'
+    r'|Sample (?P<sample>\d+)/(?P<samples>\d+)'
+)
+
+rx_frame = r'Rendering (?:single frame \(frame |frame )(?P<frame>\d+)'
+
+rx_progress = compile(rx_samples.pattern + "|" + rx_frame)
+
+rx_line = compile("|".join([
+    # Frames of the job are in the render plan, the frame list is not read
+    r'--background "(?P<blend>.*?\.blend)"',
+    r'(?P<settings>All settings loaded successfully!)',
+    rx_samples.pattern,
+    r'Saved: [\'"](?P<saved>.*?)[\'"]',
+    rx_frame,
+]))
+
+# Last group of every alternative => line kind
+KINDS = {
+    'blend' : 'project',
+    'settings' : 'settings',
+    'tile_samples' : 'tiles',
+    'samples' : 'samples',
+    'saved' : 'saved',
+    'frame' : 'frame',
+}
+
+# Lines without these words are of no interest
+KEYWORDS = ( 'Sample', 'Saved:', 'Rendering ', '--background', 'All settings' )
+
+# Cycles device errors, the frame is lost
+rx_oom = compile(r'Out of memory|out of GPU memory|CUDA error|OptiX error|HIP error|Illegal address')
+OOM_KEYWORDS = ( 'emory', 'rror', 'ddress' )
+
+
+def parse_line(line):
+    """
+    Classify a Blender output line.
+
+    Returns `(kind, match)` or `None`, kind is one of 'project', 'settings',
+    'tiles', 'samples', 'saved', 'frame'.
+    """
+
+    if line.startswith('Fra:'):
+        found = rx_progress.search(line)
+
+    elif any(word in line for word in KEYWORDS):
+        found = rx_line.search(line)
+
+    else:
+        return None
+
+    if found is None:
+        return None
+
+    return KINDS[found.lastgroup], found
+
+
+def is_out_of_memory(line):
+    """
+    Did Cycles run out of memory or fail on the device?
+    """
+
+    return any(word in line for word in OOM_KEYWORDS) and rx_oom.search(line) is not None
+
+
+def parse_samples(text):
+    """
+    Get render progress of a stats text, `None` if there is none.
+    """
+
+    found = rx_samples.search(text)
+
+    if found is None:
+        return None
+
+    return KINDS[found.lastgroup], found
+
+
+def get_progress(kind, found):
+    """
+    Render progress of a 'tiles' or 'samples' match, from 0.0 to 1.0.
+    """
+
+    if kind == 'tiles':
+        tile = int(found.group('tile'))
+        tiles = int(found.group('tiles'))
+        sample = int(found.group('tile_sample'))
+        samples = int(found.group('tile_samples'))
+        return max(0.0, min(1.0, (tile * samples + sample) / max(1, tiles * samples)))
+
+    sample = int(found.group('sample'))
+    samples = int(found.group('samples'))
+    return max(0.0, min(1.0, sample / max(1, samples)))
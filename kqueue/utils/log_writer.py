@@ -0,0 +1,237 @@
+################################################################################
+## Log Writer
+##
+## Log lines go to a bounded queue and a writer thread appends them to the
+## log file in batches, so callers like the render listener don't wait for
+## the disk. The file is rotated and compressed when it grows too big, and
+## the status line of the window is updated at a limited rate, it shows only
+## the last line anyway.
+
+import sys
+import gzip
+import shutil
+
+from time import time, sleep
+from queue import Queue, Empty, Full
+from threading import Thread, Lock, Event
+from pathlib import Path
+from ..config import *
+
+# Lines written at most in one batch
+BATCH_SIZE = 1000
+
+
+class LogWriter():
+    """
+    Writer thread of one log file.
+
+    `on_line` - called with the last line for the window, at most every
+    `gui_interval` seconds.
+    """
+
+    def __init__(self, file, on_line=None, queue_size=LOG_QUEUE_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 gui_interval=LOG_GUI_INTERVAL, max_size=LOG_MAX_SIZE, backups=LOG_BACKUPS):
+        self.file = Path(file)
+        self.on_line = on_line
+        self.queue = Queue(maxsize=queue_size)
+        self.flush_interval = flush_interval
+        self.gui_interval = gui_interval
+        self.max_size = max_size
+        self.backups = backups
+        self.thread = None
+        self.lock = Lock()
+
+        # Lines that didn't fit in the queue
+        self.dropped = 0
+
+
+    def start(self):
+
+        with self.lock:
+
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+
+    def write(self, line, gui=True, file=True):
+        """
+        Queue a line, never blocks. Lines are dropped if the queue is full.
+
+        `gui` - show the line in the window?
+        `file` - write the line to the log file?
+        """
+
+        self.start()
+
+        try:
+            self.queue.put_nowait((line, gui, file))
+
+        except Full:
+
+            with self.lock:
+                self.dropped += 1
+
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until queued lines are written.
+        """
+
+        if self.thread is None:
+            return
+
+        done = Event()
+
+        try:
+            self.queue.put((None, done, None), timeout=timeout)
+        except Full:
+            return
+
+        done.wait(timeout)
+
+
+    def run(self):
+        buffer = []
+        gui_line = None
+        last_gui = 0.0
+        last_write = time()
+
+        while True:
+            items = []
+
+            # Sleep until the next line, or until the pending window update
+            # or file write is due. Idle, the thread doesn't wake up at all.
+            timeout = None
+
+            if gui_line is not None:
+                timeout = max(0.0, last_gui + self.gui_interval - time())
+
+            if buffer:
+                due = max(0.0, last_write + self.flush_interval - time())
+                timeout = due if timeout is None else min(timeout, due)
+
+            try:
+                items.append(self.queue.get(timeout=timeout))
+            except Empty:
+                pass
+
+            while len(items) < BATCH_SIZE:
+
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            flushed = []
+            console = []
+
+            for line, gui, file in items:
+
+                # Flush request
+                if line is None:
+                    flushed.append(gui)
+                    continue
+
+                console.append(line)
+
+                if file:
+                    buffer.append(line)
+
+                if gui and self.on_line is not None:
+                    gui_line = line
+
+            # Lines are dropped only while the queue is full, the thread has
+            # lines to get then and reports them with the next batch.
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+
+            if dropped:
+                line = f'WARN {dropped} log lines were dropped.'
+                console.append(line)
+                buffer.append(line)
+
+            if console and sys.stdout is not None:
+
+                try:
+                    sys.stdout.write("\n".join(console) + "\n")
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+
+            now = time()
+
+            if gui_line is not None and (flushed or now - last_gui >= self.gui_interval):
+
+                try:
+                    self.on_line(gui_line)
+                except Exception:
+                    pass
+
+                gui_line = None
+                last_gui = now
+
+            if buffer and (flushed or len(buffer) >= BATCH_SIZE or now - last_write >= self.flush_interval):
+                self.write_lines(buffer)
+                buffer = []
+                last_write = now
+
+            for done in flushed:
+                done.set()
+
+
+    def write_lines(self, lines):
+        """
+        Append lines to the file, another program may hold it for a moment.
+        """
+
+        text = "".join(f'\n{line}' for line in lines)
+
+        for _ in range(100):
+
+            try:
+                with open(self.file, 'a', encoding='utf-8') as f:
+                    f.write(text)
+                    size = f.tell()
+
+                break
+
+            except OSError:
+                sleep(.01)
+
+        else:
+            return
+
+        if self.max_size and size > self.max_size:
+            self.rotate()
+
+
+    def rotate(self):
+        """
+        Compress the file to `log.txt.1.gz`, older ones shift up to `backups`.
+        """
+
+        if not self.backups:
+            return
+
+        def get_backup(i):
+            return Path(f'{self.file}.{i}.gz')
+
+        try:
+            get_backup(self.backups).unlink(missing_ok=True)
+
+            for i in range(self.backups - 1, 0, -1):
+
+                if get_backup(i).exists():
+                    get_backup(i).replace(get_backup(i + 1))
+
+            rotated = Path(f'{self.file}.rotated')
+            self.file.replace(rotated)
+
+            with open(rotated, 'rb') as src, gzip.open(get_backup(1), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+            rotated.unlink()
+
+        except OSError:
+            pass
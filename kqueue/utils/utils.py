@@ -29,6 +29,25 @@ def is_laptop_psutil():
         return False
 
 
+def kill_process_tree(pid):
+    """
+    Kill a process and its children, e.g. Blender started by a batch file.
+    """
+
+    try:
+        process = psutil.Process(pid)
+        children = process.children(recursive=True)
+    except psutil.Error:
+        return
+
+    for proc in [ *children, process ]:
+
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+
+
 # _taskbar_progress = None
 
 
@@ -0,0 +1,252 @@
+################################################################################
+## Render Watchdog
+##
+## Every render instance feeds the output lines of its Blender to a frame
+## watch in the orchestrator loop, so it knows the frame being rendered, how
+## long frames of the project take and when Blender printed last. The watchdog
+## kills Blender that stalled or renders a frame far longer than usual, the
+## watch itself reports a frame that ran out of memory at once. The instance
+## then starts Blender again with the frames that are left.
+
+from json import loads
+from time import time
+from statistics import median
+from collections import deque
+from threading import Lock
+from .utils.log_parser import parse_line, is_out_of_memory
+from .session import EVENT_TAG
+from .orchestrator import get_orchestrator
+from .config import *
+
+# Frame times needed before a frame can take too long
+MIN_HISTORY = 3
+
+
+class FrameWatch():
+    """
+    Progress of the Blender job of one render instance.
+
+    `on_alert` - called with the reason when a frame ran out of memory.
+    """
+
+    def __init__(self, history=RENDER_FRAME_HISTORY, on_alert=None):
+        self.lock = Lock()
+        self.durations = deque(maxlen=history)
+        self.on_alert = on_alert
+        self.file = None
+        self.active = False
+        self.reason = None
+        self.out_of_memory = False
+        self.frame = None
+        self.frame_start = None
+        self.last_output = time()
+
+        # Frames of the job that were saved
+        self.rendered = set()
+
+
+    def begin(self, file):
+        """
+        Blender starts a job, frame times are kept for the same project.
+        """
+
+        with self.lock:
+
+            if file != self.file:
+                self.file = file
+                self.durations.clear()
+
+            self.active = True
+            self.reason = None
+            self.out_of_memory = False
+            self.frame = None
+            self.frame_start = None
+            self.last_output = time()
+            self.rendered = set()
+
+
+    def end(self):
+
+        with self.lock:
+            self.active = False
+
+
+    def feed(self, line):
+        """
+        Read an output line of Blender.
+        """
+
+        with self.lock:
+            self.last_output = time()
+
+        if line.startswith(EVENT_TAG):
+
+            try:
+                event = loads(line[len(EVENT_TAG):])
+            except ValueError:
+                return
+
+            name = event.get('event')
+
+            if name == 'render_pre':
+                self.start_frame(event.get('frame'))
+
+            elif name == 'render_write':
+                self.save_frame(self.frame)
+
+            elif name == 'render_stats' and is_out_of_memory(event.get('text') or ""):
+                self.alert_out_of_memory()
+
+            # Render driver
+            elif name == 'frame':
+                self.save_frame(event.get('frame'))
+
+            return
+
+        if is_out_of_memory(line):
+            self.alert_out_of_memory()
+            return
+
+        parsed = parse_line(line)
+
+        if parsed is None:
+            return
+
+        kind, found = parsed
+
+        if kind == 'frame':
+            self.start_frame(int(found.group('frame')))
+
+        elif kind == 'saved':
+            self.save_frame(self.frame)
+
+
+    def alert_out_of_memory(self):
+        """
+        The frame is lost, Blender may still write what it has.
+        """
+
+        with self.lock:
+
+            if not self.active or self.out_of_memory:
+                return
+
+            self.out_of_memory = True
+
+            if self.reason is not None:
+                return
+
+            self.reason = reason = f'Frame {self.frame} ran out of memory'
+
+        if self.on_alert is not None:
+            self.on_alert(reason)
+
+
+    def start_frame(self, frame):
+
+        with self.lock:
+
+            if frame is None or frame == self.frame:
+                return
+
+            self.frame = frame
+            self.frame_start = time()
+
+
+    def save_frame(self, frame):
+
+        with self.lock:
+
+            # Frames written after running out of memory are broken
+            if frame is None or frame in self.rendered or self.out_of_memory:
+                return
+
+            if frame == self.frame and self.frame_start is not None:
+                self.durations.append(time() - self.frame_start)
+
+            self.rendered.add(frame)
+            self.frame = None
+            self.frame_start = None
+
+
+    def get_failing_frame(self):
+        """
+        Frame that was being rendered when Blender failed, if any.
+        """
+
+        with self.lock:
+            return self.frame
+
+
+    def check(self, now, stall_timeout, factor, minimum):
+        """
+        Get the reason to kill Blender, `None` if it is fine.
+        """
+
+        with self.lock:
+
+            if not self.active or self.reason is not None:
+                return None
+
+            idle = now - self.last_output
+
+            if idle > stall_timeout:
+                return f'Blender printed nothing for {idle:.0f}s'
+
+            if self.frame_start is None or len(self.durations) < MIN_HISTORY:
+                return None
+
+            usual = median(self.durations)
+            elapsed = now - self.frame_start
+
+            if elapsed > max(minimum, factor * usual):
+                return f'Frame {self.frame} takes {elapsed:.0f}s, usually {usual:.0f}s'
+
+            return None
+
+
+class FrameWatchdog():
+    """
+    Checks frame watches of render instances from time to time.
+
+    `get_instances` - returns instances to check.
+    """
+
+    def __init__(self, get_instances, interval=RENDER_WATCHDOG_INTERVAL, stall_timeout=RENDER_STALL_TIMEOUT,
+                 factor=RENDER_FRAME_TIMEOUT_FACTOR, minimum=RENDER_FRAME_TIMEOUT_MIN):
+        self.get_instances = get_instances
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.factor = factor
+        self.minimum = minimum
+        self.periodic = None
+
+
+    def start(self):
+
+        # Killing Blender looks up its child processes, it runs on a worker thread
+        if self.periodic is None:
+            self.periodic = get_orchestrator().every(self.interval, self.check, blocking=True)
+
+
+    def stop(self):
+
+        if self.periodic is not None:
+            self.periodic.cancel()
+            self.periodic = None
+
+
+    def check(self):
+        now = time()
+
+        for instance in self.get_instances():
+            watch = getattr(instance, 'watch', None)
+
+            if watch is None:
+                continue
+
+            reason = watch.check(now, self.stall_timeout, self.factor, self.minimum)
+
+            if reason is not None:
+                watch.reason = reason
+                instance.abort(reason)
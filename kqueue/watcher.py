@@ -0,0 +1,553 @@
+################################################################################
+## Files Watcher
+##
+## Tracks project files, files they depend on and render output folders in
+## the background, so the interface reads their state from memory instead of calling `stat` on every
+## update. Uses inotify on Linux and ReadDirectoryChangesW on Windows, other
+## systems fall back to polling.
+
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+import PyQt5.QtCore as qtc
+
+from time import time
+from select import select
+from threading import Lock
+from pathlib import Path
+
+try:
+    import win32con
+    import win32file
+    import pywintypes
+except ImportError:
+    win32file = None
+
+from .utils import fingerprint
+from .utils.fingerprint import get_state
+from .config import *
+from . import save_load
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+           IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+FILE_LIST_DIRECTORY = 0x0001
+ERROR_OPERATION_ABORTED = 995
+
+
+class Inotify():
+    """
+    Minimal inotify binding over ctypes.
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.watches = {}
+
+
+    def add(self, folder):
+        """
+        Watch a folder, returns `False` if it can't be watched.
+        """
+
+        if folder in self.watches.values():
+            return True
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_MASK)
+
+        if wd < 0:
+            return False
+
+        self.watches[wd] = folder
+        return True
+
+
+    def remove(self, folder):
+
+        for wd, path in list(self.watches.items()):
+
+            if path != folder:
+                continue
+
+            self.libc.inotify_rm_watch(self.fd, wd)
+            del self.watches[wd]
+
+
+    def read(self, timeout):
+        """
+        Wait for events, returns a set of touched paths.
+        """
+
+        rv = set()
+        readable, _, _ = select([self.fd], [], [], timeout)
+
+        if not readable:
+            return rv
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return rv
+
+        pos = 0
+
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            folder = self.watches.get(wd)
+
+            if folder is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+
+            rv.add(folder)
+
+            if name:
+                rv.add(str(Path(folder) / name))
+
+        return rv
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryChanges():
+    """
+    Folder change notifications with ReadDirectoryChangesW, every folder
+    completes on one I/O completion port.
+    """
+
+    def __init__(self):
+
+        try:
+            self.port = win32file.CreateIoCompletionPort(win32file.INVALID_HANDLE_VALUE, None, 0, 0)
+        except pywintypes.error as e:
+            raise OSError(e.winerror, e.strerror)
+
+        self.filter = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
+                       win32con.FILE_NOTIFY_CHANGE_ATTRIBUTES | win32con.FILE_NOTIFY_CHANGE_SIZE |
+                       win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+
+        # key => folder
+        self.watches = {}
+
+        # key => (handle, buffer, overlapped), closed ones are kept until
+        # their aborted request completes.
+        self.requests = {}
+        self.closed = {}
+
+        self.next_key = 1
+
+
+    def add(self, folder):
+        """
+        Watch a folder, returns `False` if it can't be watched.
+        """
+
+        if folder in self.watches.values():
+            return True
+
+        try:
+            handle = win32file.CreateFile(
+                folder,
+                FILE_LIST_DIRECTORY,
+                win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+                None,
+                win32con.OPEN_EXISTING,
+                win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
+                None
+            )
+
+        except pywintypes.error:
+            return False
+
+        key = self.next_key
+        self.next_key += 1
+
+        win32file.CreateIoCompletionPort(handle, self.port, key, 0)
+
+        self.watches[key] = folder
+        self.requests[key] = (handle, win32file.AllocateReadBuffer(64 * 1024), pywintypes.OVERLAPPED())
+
+        if not self.request(key):
+            self.remove(folder)
+            return False
+
+        return True
+
+
+    def request(self, key):
+        """
+        Ask for the next changes of a folder.
+        """
+
+        handle, buffer, overlapped = self.requests[key]
+
+        try:
+            win32file.ReadDirectoryChangesW(handle, buffer, False, self.filter, overlapped)
+        except pywintypes.error:
+            return False
+
+        return True
+
+
+    def remove(self, folder):
+
+        for key, path in list(self.watches.items()):
+
+            if path != folder:
+                continue
+
+            handle = self.requests[key][0]
+            win32file.CancelIo(handle)
+            handle.Close()
+
+            self.closed[key] = self.requests.pop(key)
+            del self.watches[key]
+
+
+    def read(self, timeout):
+        """
+        Wait for changes, returns a set of touched paths.
+        """
+
+        rv = set()
+        timeout = int(timeout * 1000)
+
+        while True:
+            rc, size, key, overlapped = win32file.GetQueuedCompletionStatus(self.port, timeout)
+
+            if overlapped is None:
+                break
+
+            # Take what is already queued without waiting
+            timeout = 0
+
+            folder = self.watches.get(key)
+
+            if folder is None or rc == ERROR_OPERATION_ABORTED:
+                self.closed.pop(key, None)
+                continue
+
+            rv.add(folder)
+
+            # Zero bytes mean the buffer overflowed, the folder itself is
+            # reported and the periodic rescan catches up.
+            if size:
+                buffer = self.requests[key][1]
+
+                for _, name in win32file.FILE_NOTIFY_INFORMATION(buffer, size):
+                    rv.add(str(Path(folder) / name))
+
+            # The folder was deleted or is not reachable anymore
+            if not self.request(key):
+                self.remove(folder)
+
+        return rv
+
+
+    def close(self):
+
+        for folder in list(self.watches.values()):
+            self.remove(folder)
+
+        self.port.Close()
+
+
+class WatcherThread(qtc.QThread):
+    """
+    Keeps the state of watched files and folders.
+
+    Every tracked path has its `stat` signature, project files also have
+    their fingerprint, computed here and not in the interface.
+    """
+
+    changed = qtc.pyqtSignal(str)
+
+    # Project file changed, with `WATCHER_PREFETCH` the GUI thread queues it
+    prefetch = qtc.pyqtSignal(str)
+
+
+    def __init__(self, interval=WATCHER_POLL_INTERVAL):
+        super().__init__()
+
+        self.interval = interval
+        self.lock = Lock()
+        self.running = True
+
+        # path => (exists, size, mtime_ns)
+        self.states = {}
+
+        # path => fingerprint
+        self.fingerprints = {}
+
+        # path => change counter
+        self.versions = {}
+
+        # project file => has a cache entry
+        self.cached = {}
+
+        self.files = set()
+        self.folders = set()
+        self.dependencies = set()
+        self.dirty = set()
+
+        self.notifier = None
+
+        try:
+
+            if sys.platform.startswith('linux'):
+                self.notifier = Inotify()
+
+            elif win32file is not None:
+                self.notifier = DirectoryChanges()
+
+        except OSError:
+            self.notifier = None
+
+
+    def set_paths(self, files, folders, dependencies=()):
+        """
+        Set project files, output folders and project dependencies to watch.
+        """
+
+        files = { str(Path(file)) for file in files if file }
+        folders = { str(Path(folder)) for folder in folders if folder }
+        dependencies = { str(Path(path)) for path in dependencies if path }
+
+        with self.lock:
+            added = (files - self.files) | (folders - self.folders) | (dependencies - self.dependencies)
+
+            self.files = files
+            self.folders = folders
+            self.dependencies = dependencies
+            self.dirty |= added
+
+            for path in list(self.states):
+
+                if path not in files and path not in folders and path not in dependencies:
+                    self.states.pop(path, None)
+                    self.fingerprints.pop(path, None)
+                    self.cached.pop(path, None)
+
+
+    def exists(self, path):
+        """
+        Does the path exist? Unknown paths are checked right away.
+        """
+
+        state = self.get_state(path)
+        return state[0]
+
+
+    def get_state(self, path):
+        key = str(Path(path))
+
+        with self.lock:
+            state = self.states.get(key)
+
+        if state is None:
+            state = get_state(key)
+
+            with self.lock:
+                self.states[key] = state
+
+        return state
+
+
+    def get_known_state(self, path):
+        """
+        Get the state of a path from memory, `None` if the watcher did not
+        see it yet. Unknown paths are checked on the next loop.
+        """
+
+        key = str(Path(path))
+
+        with self.lock:
+            state = self.states.get(key)
+
+            if state is None:
+                self.dirty.add(key)
+
+        return state
+
+
+    def is_cached(self, file):
+        """
+        Has a watched project file a cache entry? `None` if unknown yet.
+        """
+
+        with self.lock:
+            return self.cached.get(str(Path(file)))
+
+
+    def set_cached(self, file, cached=True):
+        """
+        A cache entry of the project file was saved or deleted.
+        """
+
+        key = str(Path(file))
+
+        with self.lock:
+
+            if cached or key in self.cached:
+                self.cached[key] = cached
+
+
+    def get_fingerprint(self, file):
+        """
+        Get the fingerprint of a watched project file, `None` if unknown yet.
+        """
+
+        with self.lock:
+            return self.fingerprints.get(str(Path(file)))
+
+
+    def get_version(self, path):
+        """
+        Get change counter of a path, increases every time it changes.
+        """
+
+        with self.lock:
+            return self.versions.get(str(Path(path)), 0)
+
+
+    def stop(self):
+        self.running = False
+
+
+    def run(self):
+        last_scan = 0.0
+
+        while self.running:
+            touched = set()
+
+            if self.notifier is not None:
+                self.update_watches()
+                touched = self.notifier.read(self.interval)
+
+            else:
+                self.msleep(int(self.interval * 1000))
+
+            with self.lock:
+                polled = self.files | self.folders
+                paths = polled | self.dependencies
+                dirty, self.dirty = self.dirty, set()
+
+            # Network shares don't always report changes, rescan everything
+            # from time to time. When polling, project files and output
+            # folders are checked on every loop, dependencies only rarely
+            # change and wait for the rescan.
+            if time() - last_scan > WATCHER_RESCAN_INTERVAL:
+                dirty |= paths
+                last_scan = time()
+
+            elif self.notifier is None:
+                dirty |= polled
+
+            dirty |= touched & paths
+
+            for path in dirty:
+                self.update_path(path)
+
+        if self.notifier is not None:
+            self.notifier.close()
+
+        save_load.close_cache_connection()
+
+
+    def update_watches(self):
+        """
+        Watch parent folders of files and the folders themselves.
+        """
+
+        with self.lock:
+            folders = { str(Path(file).parent) for file in self.files | self.dependencies }
+            folders |= self.folders
+            folders |= { str(Path(folder).parent) for folder in self.folders }
+
+        for folder in folders:
+            self.notifier.add(folder)
+
+        for folder in set(self.notifier.watches.values()) - folders:
+            self.notifier.remove(folder)
+
+
+    def update_path(self, path):
+        """
+        Update state of a path and notify if it changed.
+        """
+
+        state = get_state(path)
+
+        with self.lock:
+            old_state = self.states.get(path)
+            old_cached = self.cached.get(path)
+            is_file = path in self.files
+            known = path in self.fingerprints
+
+        # `save_cache_entry` and `prune_cache` keep the flag up to date, the
+        # database is asked only when the file changed or is new.
+        cached = old_cached
+
+        if is_file and (state != old_state or old_cached is None):
+            cached = save_load.has_cache_entry(path)
+
+        if state == old_state and cached == old_cached and (known or not is_file):
+            return
+
+        fp = None
+
+        if is_file and state[0]:
+
+            try:
+                fp = fingerprint.get_fingerprint(path, previous=self.get_fingerprint(path))
+            except OSError:
+                fp = None
+
+        with self.lock:
+            self.states[path] = state
+            self.versions[path] = self.versions.get(path, 0) + 1
+
+            if is_file:
+                self.fingerprints[path] = fp
+                self.cached[path] = cached
+
+        # The interface reads only this state, so a path seen for the first
+        # time is a change too.
+        self.changed.emit(path)
+
+        if old_state is None or state == old_state:
+            return
+
+        if is_file and WATCHER_PREFETCH and fp is not None:
+            self.prefetch.emit(path)
+